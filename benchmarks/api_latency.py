@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+""" Measure the latency of the read-heavy REST API routes of a running
+scanning station server under concurrent load.
+
+The routes are requested for the first workflow on the server, so at least
+one workflow with a captured page must exist.
+
+Example::
+
+    $ python benchmarks/api_latency.py http://localhost:5000 --clients 20
+"""
+import argparse
+import json
+import threading
+import time
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+#: (label, path template), formatted with the workflow's id
+ROUTES = (
+    ("workflow list", "/api/workflow"),
+    ("workflow summary", "/api/workflow?summary=1"),
+    ("workflow", "/api/workflow/{0}"),
+    ("pages", "/api/workflow/{0}/page"),
+    ("thumbnail", "/api/workflow/{0}/page/{1}/raw/thumb"),
+    ("scaled image", "/api/workflow/{0}/page/{1}/raw?width=800"),
+)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    idx = int(round(pct/100.0 * (len(values) - 1)))
+    return values[idx]
+
+
+def fetch(url):
+    start = time.time()
+    resp = urlopen(url)
+    resp.read()
+    resp.close()
+    return time.time() - start
+
+
+def run_client(base_url, paths, num_requests, results, lock):
+    timings = []
+    for idx in range(num_requests):
+        label, path = paths[idx % len(paths)]
+        timings.append((label, fetch(base_url + path)))
+    with lock:
+        results.extend(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('url', help="Base URL of the server")
+    parser.add_argument('--clients', type=int, default=20,
+                        help="Number of concurrent clients")
+    parser.add_argument('--requests', type=int, default=60,
+                        help="Number of requests per client")
+    args = parser.parse_args()
+    base_url = args.url.rstrip('/')
+
+    workflows = json.loads(
+        urlopen(base_url + '/api/workflow?summary=1').read().decode('utf8'))
+    if not workflows:
+        parser.error("The server has no workflows.")
+    workflow_id = workflows[0]['id']
+    pages = json.loads(urlopen(
+        base_url + '/api/workflow/{0}/page'.format(workflow_id))
+        .read().decode('utf8'))
+    if not pages:
+        parser.error("The first workflow has no pages.")
+    paths = [(label, path.format(workflow_id, pages[0]['capture_num']))
+             for label, path in ROUTES]
+
+    results, lock = [], threading.Lock()
+    threads = [threading.Thread(target=run_client,
+                                args=(base_url, paths, args.requests,
+                                      results, lock))
+               for _ in range(args.clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+
+    print("{0} clients, {1} requests in {2:.1f}s ({3:.1f} requests/s)"
+          .format(args.clients, len(results), duration,
+                  len(results)/duration))
+    print("{0:<20} {1:>10} {2:>10} {3:>10}".format(
+        "Route", "p50 (ms)", "p99 (ms)", "max (ms)"))
+    for label in [label for label, _ in ROUTES] + [None]:
+        timings = [t for l, t in results if label is None or l == label]
+        print("{0:<20} {1:>10.1f} {2:>10.1f} {3:>10.1f}".format(
+            label or "all", percentile(timings, 50)*1000,
+            percentile(timings, 99)*1000, max(timings)*1000))
+
+
+if __name__ == '__main__':
+    main()
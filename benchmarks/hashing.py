@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+""" Benchmark the throughput of :py:func:`spreads.vendor.bagit.hash_file`
+with different buffer sizes, I/O strategies and algorithms on a synthetic
+bag.
+
+Example::
+
+    $ python benchmarks/hashing.py --num-files 50 --file-size 20
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import spreads.vendor.bagit as bagit  # noqa
+
+#: (label, buffer size, mmap threshold)
+IO_CONFIGURATIONS = (
+    ("16 KiB read", 16*1024, 0),
+    ("1 MiB readinto", 1024**2, 0),
+    ("8 MiB readinto", 8*1024**2, 0),
+    ("1 MiB mmap", 1024**2, 1),
+)
+
+ALGORITHM_SETS = (
+    ('md5',),
+    ('blake2b-128',),
+    ('md5', 'blake2b-128'),
+    ('md5', 'sha256'),
+)
+
+
+def make_bag(path, num_files, file_size):
+    bag = bagit.Bag(path)
+    raw_path = os.path.join(path, 'data', 'raw')
+    os.mkdir(raw_path)
+    chunk = os.urandom(1024**2)
+    for idx in range(num_files):
+        with open(os.path.join(raw_path, '{0:03}.dng'.format(idx)),
+                  'wb') as fp:
+            for _ in range(file_size):
+                fp.write(chunk)
+    bag.add_payload(raw_path)
+    return bag
+
+
+def run(bag, algorithms, buffer_size, mmap_threshold):
+    start = time.time()
+    total_bytes = 0
+    for fpath in bag.payload:
+        _, _, num_bytes = bagit.hash_file(fpath, algorithms, buffer_size,
+                                          mmap_threshold)
+        total_bytes += num_bytes
+    return total_bytes / (time.time() - start) / 1024**2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--num-files', type=int, default=20)
+    parser.add_argument('--file-size', type=int, default=20,
+                        help="Size of each file in MiB")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Report the best of this many runs")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bag = make_bag(os.path.join(tmpdir, 'bag'), args.num_files,
+                       args.file_size)
+        print("Hashing {0} files with {1} MiB each"
+              .format(args.num_files, args.file_size))
+        print("{0:<20} {1:<20} {2:>10}".format("I/O", "Algorithms", "MB/s"))
+        for algorithms in ALGORITHM_SETS:
+            for label, buffer_size, mmap_threshold in IO_CONFIGURATIONS:
+                speed = max(run(bag, algorithms, buffer_size, mmap_threshold)
+                            for _ in range(args.repeat))
+                print("{0:<20} {1:<20} {2:>10.1f}".format(
+                    label, "+".join(algorithms), speed))
+        bag.shutdown_executors()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+""" Compare the throughput of tar downloads through
+:py:class:`spreadsplug.web.handlers.TarDownloadHandler` with the previous
+implementation, which handed every write of the tarfile module to the IOLoop
+through a sleep-polled single-item queue.
+
+Both handlers are served from a local server for a synthetic bag. The CPU
+time includes the client, which runs in the same process.
+
+Example::
+
+    $ python benchmarks/tar_download.py --num-files 20 --file-size 20
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pathlib import Path  # noqa
+from tornado import gen  # noqa
+from tornado.ioloop import IOLoop  # noqa
+from tornado.web import Application  # noqa
+
+import spreads.vendor.bagit as bagit  # noqa
+from spreadsplug.web import handlers  # noqa
+
+
+class LegacyQueueIO(object):
+    """ The previous pipe between the tar thread and the IOLoop. """
+    def __init__(self):
+        self.queue = Queue.Queue(maxsize=1)
+        self.closed = False
+        self.last_read = None
+        self.read_time = None
+
+    def write(self, data):
+        while not self.closed:
+            try:
+                self.queue.put(data, block=False)
+                return
+            except Queue.Full:
+                if self.read_time is not None:
+                    time.sleep(self.read_time*1.1)
+        raise ValueError("I/O operation on closed file")
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed and self.queue.empty():
+            raise StopIteration
+        if self.last_read is None:
+            self.last_read = time.time()
+        else:
+            read_time = time.time() - self.last_read
+            if self.read_time is None or self.read_time > read_time:
+                self.read_time = read_time
+            self.last_read += read_time
+        return self.queue.get()
+    next = __next__
+
+
+class LegacyTarDownloadHandler(handlers.TarDownloadHandler):
+    """ The previous handler, sending a single write per flush. """
+    def initialize(self, workflow):
+        self.workflow = workflow
+        self.pipe = None
+
+    def write_tar(self):
+        try:
+            self.workflow.bag.package_as_tarstream(self.fp)
+        except ValueError:
+            pass
+        self.fp.close()
+
+    @gen.coroutine
+    def get(self, workflow_id, filename):
+        self.set_header('Content-length',
+                        self.calculate_tarsize(self.workflow))
+        self.fp = LegacyQueueIO()
+        threading.Thread(target=self.write_tar).start()
+        while True:
+            try:
+                self.write(next(self.fp))
+            except StopIteration:
+                break
+            yield self.flush()
+        self.finish()
+
+    def on_connection_close(self):
+        self.fp.close()
+
+
+def make_bag(path, num_files, file_size):
+    bag = bagit.Bag(path)
+    raw_path = os.path.join(path, 'data', 'raw')
+    os.mkdir(raw_path)
+    chunk = os.urandom(1024**2)
+    for idx in range(num_files):
+        with open(os.path.join(raw_path, '{0:03}.dng'.format(idx)),
+                  'wb') as fp:
+            for _ in range(file_size):
+                fp.write(chunk)
+    bag.add_payload(raw_path)
+    return bag
+
+
+def serve(workflow, port, ready):
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    handlers.Workflow.find_by_id = staticmethod(lambda *args: workflow)
+    Application([
+        (r"/current/([0-9a-z-]+)/(.*)\.tar", handlers.TarDownloadHandler,
+         dict(base_path=None)),
+        (r"/legacy/([0-9a-z-]+)/(.*)\.tar", LegacyTarDownloadHandler,
+         dict(workflow=workflow)),
+    ]).listen(port, '127.0.0.1')
+    IOLoop.current().add_callback(ready.set)
+    IOLoop.current().start()
+
+
+def run(url):
+    start, start_cpu = time.time(), time.process_time()
+    resp = urlopen(url)
+    num_bytes = 0
+    while True:
+        data = resp.read(1024**2)
+        if not data:
+            break
+        num_bytes += len(data)
+    duration = time.time() - start
+    cpu_time = time.process_time() - start_cpu
+    return num_bytes / duration / 1024**2, cpu_time / (num_bytes / 1024**3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--num-files', type=int, default=20)
+    parser.add_argument('--file-size', type=int, default=20,
+                        help="Size of each file in MiB")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Report the best of this many runs")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bag = make_bag(os.path.join(tmpdir, 'bag'), args.num_files,
+                       args.file_size)
+        workflow = type('Workflow', (object,),
+                        {'bag': bag, 'path': Path(bag.path)})()
+        ready = threading.Event()
+        server = threading.Thread(target=serve,
+                                  args=(workflow, args.port, ready))
+        server.daemon = True
+        server.start()
+        ready.wait()
+        print("Downloading {0} files with {1} MiB each"
+              .format(args.num_files, args.file_size))
+        print("{0:<20} {1:>10} {2:>12}".format("Handler", "MB/s",
+                                              "CPU s/GiB"))
+        for label in ('legacy', 'current'):
+            url = 'http://127.0.0.1:{0}/{1}/{2}/bag.tar'.format(
+                args.port, label, uuid.uuid4())
+            speed, cpu = max(run(url) for _ in range(args.repeat))
+            print("{0:<20} {1:>10.1f} {2:>12.2f}".format(label, speed, cpu))
+        bag.shutdown_executors()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
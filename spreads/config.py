@@ -78,6 +78,11 @@ CORE_OPTIONS = {
     'capture_keys': OptionTemplate(value=[" ", "b"],
                                    docstring="Keys to trigger capture",
                                    selectable=False),
+    'checksum_algorithms': OptionTemplate(
+        value=['md5'],
+        docstring=("Checksum algorithms for the manifests of new workflows "
+                   "('md5', 'sha1', 'sha256' or the faster 'blake2b-128')"),
+        advanced=True),
     'convert_old': OptionTemplate(
         value=False,
         docstring=("Convert workflows from older spreads version to the new "
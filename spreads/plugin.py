@@ -214,8 +214,13 @@ class DeviceDriver(SpreadsPlugin):  # pragma: no cover
     def capture(self, path):
         """ Capture a single image with the device.
 
+        Implementations that have the image data in memory should return it,
+        this allows it to be checksummed without reading it from disk again.
+
         :param path:    Path for the image
         :type path:     :py:class:`pathlib.Path`
+        :returns:       The data that was written to `path` (optional)
+        :rtype:         bytes or None
 
         """
         raise NotImplementedError
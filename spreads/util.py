@@ -20,6 +20,8 @@ Various utility functions and classes.
 """
 
 import abc
+import ctypes
+import ctypes.util
 import glob
 import json
 import logging
@@ -28,6 +30,8 @@ import pkg_resources
 import platform
 import re
 import subprocess
+import sys
+import time
 from unicodedata import normalize
 
 import blinker
@@ -429,9 +433,6 @@ class RomanNumeral(object):
         else:
             return strval
 
-    def __str__(self):
-        return str(str(self))
-
     def __repr__(self):
         return str(self)
 
@@ -458,3 +459,90 @@ class CustomJSONEncoder(json.JSONEncoder):
             else:
                 return str(obj.absolute())
         return json.JSONEncoder.default(self, obj)
+
+
+class DirectoryWatcher(object):
+    """ Cheaply detect entries being added to, removed from or renamed in a
+        directory.
+
+    Uses inotify where available and falls back to comparing the
+    modification time of the directory otherwise. Neither requires a
+    background thread, :py:meth:`changed` simply has to be called before
+    relying on a previously obtained listing of the directory.
+    """
+    # IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF |
+    # IN_MOVE_SELF
+    _INOTIFY_MASK = 0x100 | 0x200 | 0x40 | 0x80 | 0x400 | 0x800
+    #: Modification times closer to the present than this (in seconds) are
+    #: not trusted, since file systems with a coarse timestamp resolution
+    #: would otherwise hide changes that happened in quick succession
+    MTIME_GRACE = 2
+
+    def __init__(self, path):
+        """ Create a new instance.
+
+        :param path:    Directory to watch
+        :type path:     :py:class:`pathlib.Path`
+        """
+        self.path = Path(path)
+        self._fd = self._init_inotify()
+        self._mtime = None
+        self._first_check = True
+
+    def _init_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        wd = libc.inotify_add_watch(fd, os.fsencode(str(self.path)),
+                                    self._INOTIFY_MASK)
+        if wd < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    @property
+    def uses_inotify(self):
+        """ Whether changes are detected via inotify or by polling. """
+        return self._fd is not None
+
+    def changed(self):
+        """ Check if the directory changed since the last call.
+
+        :returns:   Whether the directory changed, always True for the first
+                    call
+        :rtype:     bool
+        """
+        if self._fd is not None:
+            changed = self._first_check
+            while True:
+                try:
+                    if not os.read(self._fd, 4096):
+                        break
+                except BlockingIOError:
+                    break
+                changed = True
+        else:
+            try:
+                mtime = self.path.stat().st_mtime
+            except OSError:
+                mtime = None
+            changed = (mtime != self._mtime or mtime is None or
+                       time.time() - mtime < self.MTIME_GRACE)
+            self._mtime = mtime
+        self._first_check = False
+        return changed
+
+    def close(self):
+        """ Release the inotify watch, if any. """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
@@ -21,9 +21,11 @@ entities.
 """
 
 import copy
+import itertools
 import logging
 import shutil
 import threading
+import time
 import uuid
 from datetime import datetime
 
@@ -46,6 +48,13 @@ except ImportError:
     HAS_JPEGTRAN = False
     from PIL import Image
 
+#: Name of the file that pages captured since ``pagemeta.json`` was last
+#: written are appended to, one JSON object per line
+PAGE_JOURNAL_FNAME = 'pagemeta.journal'
+#: Number of removed pages that are remembered for
+#: :py:meth:`Workflow.get_page_changes`
+MAX_REMOVED_PAGES = 1024
+
 signals = Namespace()
 on_created = signals.signal('workflow:created', doc="""\
 Sent by a :class:`Workflow` when a new workflow was created.
@@ -143,17 +152,21 @@ class Page(object):
     :attr page_label:       A label for the page. Must be an integer, a string
                             of digits or a roman numeral (e.g. 12, '12',
                             'XII'). Defaults to the sequence number.
+    :attr revision:         Revision of the workflow's pages in which the page
+                            was last changed, see
+                            :py:attr:`Workflow.page_revision`.
     """
     # FIXME: This type is insufficient for the case where the raw images
     # contain two individual pages, i.e. the whole bookspreads was captured in
     # a single image. How would we deal with that scenario?
     __slots__ = ["sequence_num", "capture_num", "raw_image", "page_label",
-                 "processed_images"]
+                 "processed_images", "revision"]
 
     def __init__(self, raw_image, sequence_num=None, capture_num=None,
-                 page_label=None, processed_images=None):
+                 page_label=None, processed_images=None, revision=0):
         self.raw_image = raw_image
         self.processed_images = processed_images or {}
+        self.revision = revision
         if capture_num:
             self.capture_num = capture_num
         else:
@@ -204,9 +217,118 @@ class Page(object):
             'page_label': self.page_label,
             'raw_image': self.raw_image,
             'processed_images': self.processed_images,
+            'revision': self.revision,
         }
 
 
+class PageList(list):
+    """ List of :py:class:`Page` objects that supports looking up pages by
+        their capture or sequence number in constant time.
+
+    Behaves like a regular list. The lookup indexes are built lazily and are
+    discarded whenever the list is modified, with the exception of appends,
+    which update them in place.
+    Since the numbers of a page can change after it has been added to the
+    list, every index hit is checked against the page and the index is
+    rebuilt if it turns out to be stale.
+    """
+    def __init__(self, pages=()):
+        super(PageList, self).__init__(pages)
+        #: Lookup indexes, keyed by the attribute they index
+        self._indexes = {}
+        #: Mapping from object ids of pages to their position in the list
+        self._positions = None
+
+    def _invalidate(self):
+        self._indexes = {}
+        self._positions = None
+
+    def _get_index(self, attr, rebuild=False):
+        if rebuild or attr not in self._indexes:
+            index = {}
+            for page in self:
+                # Earlier pages take precedence, like with a linear search
+                index.setdefault(getattr(page, attr), page)
+            self._indexes[attr] = index
+        return self._indexes[attr]
+
+    def _lookup(self, attr, num, default):
+        page = self._get_index(attr).get(num)
+        if page is None or getattr(page, attr) != num:
+            page = self._get_index(attr, rebuild=True).get(num)
+        return default if page is None else page
+
+    def get_by_capture_num(self, capture_num, default=None):
+        """ Get the page with the given capture number.
+
+        :param capture_num: Capture number to look for
+        :type capture_num:  int
+        :param default:     Value to return if there is no matching page
+        :returns:           The matching page or `default`
+        :rtype:             :py:class:`Page`
+        """
+        return self._lookup('capture_num', capture_num, default)
+
+    def get_by_sequence_num(self, sequence_num, default=None):
+        """ Get the page with the given sequence number.
+
+        :param sequence_num: Sequence number to look for
+        :type sequence_num:  int
+        :param default:      Value to return if there is no matching page
+        :returns:            The matching page or `default`
+        :rtype:              :py:class:`Page`
+        """
+        return self._lookup('sequence_num', sequence_num, default)
+
+    def index(self, page, *args):
+        """ Get the position of a page in the list.
+
+        Without the optional start/stop arguments, this is a constant-time
+        operation.
+        """
+        if args:
+            return super(PageList, self).index(page, *args)
+        if self._positions is None:
+            self._positions = {id(p): idx for idx, p in enumerate(self)}
+        idx = self._positions.get(id(page))
+        if idx is None or self[idx] is not page:
+            return super(PageList, self).index(page)
+        return idx
+
+    def append(self, page):
+        super(PageList, self).append(page)
+        for attr, index in self._indexes.items():
+            index.setdefault(getattr(page, attr), page)
+        if self._positions is not None:
+            self._positions.setdefault(id(page), len(self)-1)
+
+    def extend(self, pages):
+        for page in pages:
+            self.append(page)
+
+    def __iadd__(self, pages):
+        self.extend(pages)
+        return self
+
+    def _invalidating(name):
+        def method(self, *args, **kwargs):
+            self._invalidate()
+            return getattr(super(PageList, self), name)(*args, **kwargs)
+        method.__name__ = name
+        return method
+
+    insert = _invalidating('insert')
+    remove = _invalidating('remove')
+    pop = _invalidating('pop')
+    clear = _invalidating('clear')
+    sort = _invalidating('sort')
+    reverse = _invalidating('reverse')
+    __setitem__ = _invalidating('__setitem__')
+    __delitem__ = _invalidating('__delitem__')
+    __imul__ = _invalidating('__imul__')
+    del _invalidating
+
+
 class TocEntry(object):
     """ Represent a 'table of contents' entry.
 
@@ -244,6 +366,155 @@ class TocEntry(object):
         }
 
 
+def _cache_created_workflow(sender, **kwargs):
+    """ Receiver for :py:data:`on_created` that adds new workflows to the
+        cache.
+    """
+    type(sender)._add_to_cache(sender)
+
+
+class WorkflowRegistry(object):
+    """ Index of the workflows in a directory by path, id and slug.
+
+    The directory is only rescanned when a
+    :py:class:`spreads.util.DirectoryWatcher` reports that its entries
+    changed, so looking up a workflow usually does not touch the file
+    system at all.
+    """
+    #: Interval in seconds in which directories that did not contain a
+    #: workflow yet are checked again, e.g. while they are still being copied
+    PENDING_CHECK_INTERVAL = 1.0
+
+    def __init__(self, location, workflow_cls):
+        """ Create a new instance.
+
+        :param location:        Directory that contains the workflows
+        :type location:         :py:class:`pathlib.Path`
+        :param workflow_cls:    Class to instantiate workflows with
+        :type workflow_cls:     type
+        """
+        self.location = location
+        self._workflow_cls = workflow_cls
+        self._watcher = util.DirectoryWatcher(location)
+        self._lock = threading.RLock()
+        self._by_path = {}
+        self._by_id = {}
+        self._by_slug = {}
+        #: Directories that did not contain a workflow during the last scan
+        self._pending = set()
+        self._last_pending_check = 0
+
+    def add(self, workflow):
+        """ Add a workflow to the index.
+
+        :param workflow:    Workflow to be added
+        :type workflow:     :py:class:`Workflow`
+        """
+        with self._lock:
+            self._by_path[workflow.path] = workflow
+            self._by_id[workflow.id] = workflow
+            self._by_slug[workflow.slug] = workflow
+            self._pending.discard(workflow.path)
+
+    def discard(self, workflow):
+        """ Remove a workflow from the index, if present.
+
+        :param workflow:    Workflow to be removed
+        :type workflow:     :py:class:`Workflow`
+        """
+        with self._lock:
+            if self._by_path.get(workflow.path) is workflow:
+                del self._by_path[workflow.path]
+                self._rebuild_indexes()
+                workflow._shutdown_executors()
+
+    def _rebuild_indexes(self):
+        self._by_id = {wf.id: wf for wf in self._by_path.values()}
+        self._by_slug = {wf.slug: wf for wf in self._by_path.values()}
+
+    def sync(self, reload=False):
+        """ Bring the index up to date with the directory.
+
+        :param reload:  Discard all known workflows and load them again
+        :type reload:   bool
+        """
+        with self._lock:
+            changed = self._watcher.changed()
+            if reload:
+                for workflow in self._by_path.values():
+                    workflow._shutdown_executors()
+                self._by_path = {}
+                changed = True
+            if changed:
+                self._scan()
+            elif (self._pending and time.time() - self._last_pending_check >
+                    self.PENDING_CHECK_INTERVAL):
+                for path in list(self._pending):
+                    self._load(path)
+                self._last_pending_check = time.time()
+
+    def _scan(self):
+        # Hidden directories are used for staging uploads and syncs, see
+        # :py:class:`spreadsplug.web.handlers.StreamingUploadHandler`
+        candidates = {p for p in self.location.iterdir()
+                      if p.is_dir() and not p.name.startswith('.')}
+        for path in set(self._by_path) - candidates:
+            self._by_path.pop(path)._shutdown_executors()
+        self._pending = set()
+        for path in candidates - set(self._by_path):
+            self._load(path)
+        self._rebuild_indexes()
+        self._last_pending_check = time.time()
+
+    def _load(self, path):
+        self._pending.discard(path)
+        is_workflow = ((path/'bagit.txt').exists() or
+                       (path/'raw').exists())
+        if not is_workflow:
+            self._pending.add(path)
+            return
+        logging.debug("Cache missed, instantiating workflow from {0}."
+                      .format(path))
+        try:
+            self.add(self._workflow_cls(path))
+        except bagit.BagError as e:
+            logging.warning(str(e))
+
+    @property
+    def workflows(self):
+        """ All workflows in the directory.
+
+        :rtype:     list of :py:class:`Workflow`
+        """
+        self.sync()
+        return list(self._by_path.values())
+
+    def get_by_id(self, id):
+        """ Look up a workflow by its id.
+
+        :param id:  ID of workflow to be looked up
+        :rtype:     :py:class:`Workflow` or None
+        """
+        self.sync()
+        return self._by_id.get(id)
+
+    def get_by_slug(self, slug):
+        """ Look up a workflow by its slug.
+
+        :param slug:    Slug of workflow to be looked up
+        :type slug:     unicode
+        :rtype:         :py:class:`Workflow` or None
+        """
+        self.sync()
+        workflow = self._by_slug.get(slug)
+        if workflow is None or workflow.slug != slug:
+            # Slugs can change, so make sure we don't miss a renamed workflow
+            with self._lock:
+                self._rebuild_indexes()
+            workflow = self._by_slug.get(slug)
+        return workflow
+
+
 class Workflow(object):
     """ Core entity for managing scanning workflows.
 
@@ -265,7 +536,7 @@ class Workflow(object):
     :attr metadata:     Metadata, contains at least a ``title`` field.
     :type metadata:     :py:class:`spreads.metadata.Metadata`
     :attr pages:        Pages available in the workflow
-    :type pages:        list of :py:class:`Page`
+    :type pages:        :py:class:`PageList`
     :attr table_of_contents: Table of contents entries in the workflow
     :type table_of_contents: list of :py:class:`TocEntry`
     :attr last_modified: Time of last modification
@@ -275,13 +546,13 @@ class Workflow(object):
     :attr out_files:    Generated output files
     :type out_files:    list of :py:class:`pathlib.Path`
     """
-    # Class-wide cache of :py:class:`Workflow` instances
+    # Class-wide cache of :py:class:`WorkflowRegistry` instances, by location
     _cache = {}
 
     def __new__(cls, *args, **kwargs):
         """ Automatically cache every new :py:class:`Workflow` instance. """
-        on_created.connect(lambda sender, **kwargs: cls._add_to_cache(sender),
-                           weak=False)
+        # Connecting the same receiver repeatedly is a no-op
+        on_created.connect(_cache_created_workflow)
         return super(Workflow, cls).__new__(cls)
 
     @classmethod
@@ -312,12 +583,14 @@ class Workflow(object):
         return wf
 
     @classmethod
-    def _add_to_cache(cls, workflow):
-        location = workflow.path.parent
+    def _get_registry(cls, location):
         if location not in cls._cache:
-            cls._cache[location] = [workflow]
-        elif workflow not in Workflow._cache[location]:
-            cls._cache[location].append(workflow)
+            cls._cache[location] = WorkflowRegistry(location, cls)
+        return cls._cache[location]
+
+    @classmethod
+    def _add_to_cache(cls, workflow):
+        cls._get_registry(workflow.path.parent).add(workflow)
 
     @classmethod
     def find_all(cls, location, key='slug', reload=False):
@@ -336,28 +609,9 @@ class Workflow(object):
             location = Path(location)
         if key not in ('slug', 'id'):
             raise ValueError("'key' must be one of ('id', 'slug')")
-        if location in cls._cache and not reload:
-            found = cls._cache[location]
-        else:
-            found = []
-        for candidate in location.iterdir():
-            is_workflow = (location.is_dir() and
-                           ((candidate/'bagit.txt').exists or
-                            (candidate/'raw').exists))
-            if not is_workflow:
-                continue
-            if not next((wf for wf in found if wf.path == candidate), None):
-                logging.debug(
-                    "Cache missed, instantiating workflow from {0}."
-                    .format(candidate))
-                try:
-                    workflow = cls(candidate)
-                except bagit.BagError as e:
-                    logging.warn(e.message)
-                    continue
-                found.append(workflow)
-        cls._cache[location] = found
-        return {getattr(wf, key): wf for wf in cls._cache[location]}
+        registry = cls._get_registry(location)
+        registry.sync(reload=reload)
+        return {getattr(wf, key): wf for wf in registry.workflows}
 
     @classmethod
     def find_by_id(cls, location, id):
@@ -371,10 +625,7 @@ class Workflow(object):
         """
         if not isinstance(location, Path):
             location = Path(location)
-        try:
-            return cls.find_all(location, key='id')[id]
-        except KeyError:
-            return None
+        return cls._get_registry(location).get_by_id(id)
 
     @classmethod
     def find_by_slug(cls, location, slug):
@@ -389,10 +640,7 @@ class Workflow(object):
         """
         if not isinstance(location, Path):
             location = Path(location)
-        try:
-            return cls.find_all(location, key='slug')[slug]
-        except KeyError:
-            return None
+        return cls._get_registry(location).get_by_slug(slug)
 
     @classmethod
     def remove(cls, workflow):
@@ -408,7 +656,7 @@ class Workflow(object):
                 "Cannot remove a workflow while it is busy."
                 " (active step: '{0}')".format(workflow.status['step']))
         shutil.rmtree(str(workflow.path))
-        cls._cache[workflow.path.parent].remove(workflow)
+        cls._get_registry(workflow.path.parent).discard(workflow)
         on_removed.send(senderId=workflow.id)
 
     def __init__(self, path, config=None, metadata=None):
@@ -425,6 +673,65 @@ class Workflow(object):
         self.path = path
         is_new = not self.path.exists()
 
+        #: Lazily loaded attributes that back the corresponding properties,
+        #: see :py:meth:`_load`
+        self._config = None
+        self._bag = None
+        self._plugin_instances = None
+        self._pages = None
+        self._table_of_contents = None
+        #: Change tracking for pages, initialized when the pages are loaded,
+        #: see :py:meth:`_reset_page_revisions`
+        self._page_revision = None
+        self._page_states = None
+        self._removed_pages = None
+        self._delta_base = None
+        #: Standalone `bag-info.txt` that is used for reading the id and slug
+        #: as long as the bag has not been loaded
+        self._summary_info = None
+        #: Lock that is held while one of the lazily loaded attributes is
+        #: initialized, since workflows are shared between threads
+        self._load_lock = threading.RLock()
+
+        #: Lock that is held when a shot is being executed during the capture
+        #: phase
+        self._capture_lock = threading.RLock()
+        #: List of :py:class:`spreads.plugin.DeviceDriver` instances that
+        #: backs the corresponding getters and setters
+        self._devices = None
+        # Thread pool for background tasks
+        self._threadpool = concfut.ThreadPoolExecutor(max_workers=1)
+        # List of unfinished :py:class:`concurrent.futures.Future` instances
+        self._pending_tasks = []
+
+        # Existing workflows that are opened without a configuration (e.g.
+        # when listing all workflows in a directory) only load their bag,
+        # configuration, plugins, pages and table of contents on first use
+        if is_new or config is not None or not bagit.Bag.is_bag(str(path)):
+            self._load(config)
+        if not self.slug:
+            self.slug = util.slugify(str(self.path.name))
+        if not self.id:
+            self.id = str(uuid.uuid4())
+        #: :py:class:`spreads.metadata.Metadata` instance that backs the
+        #: corresponding getter and setter
+        self._metadata = Metadata(self.path)
+
+        # This will invoke the setter
+        if metadata:
+            self.metadata = metadata
+
+        if is_new:
+            on_created.send(self, workflow=self)
+
+    def _load(self, config=None):
+        """ Load the configuration, the bag and the plugins.
+
+        :param config:  Configuration for the workflow, loaded from the bag
+                        if not specified
+        :type config:   dict, :py:class:`confit.ConfigView` or
+                        :py:class:`spreads.config.Configuration`
+        """
         # See if supplied `config` is already a valid ConfigView object
         if isinstance(config, confit.ConfigView):
             self.config = config
@@ -432,13 +739,20 @@ class Workflow(object):
             self.config = config.as_view()
         else:
             self.config = self._load_config(config)
+        self._load_bag()
+        self._load_plugins()
+        self._save_config()
 
+    def _load_bag(self):
+        """ Open the bag, converting the workflow directory if neccessary. """
         try:
-            self.bag = bagit.Bag(str(self.path))
+            self._bag = bagit.Bag(
+                str(self.path),
+                checksums=self.config['core']['checksum_algorithms'].get())
         except bagit.BagError:
             if self.config['core']['convert_old'].get(bool):
                 # Convert non-bagit directories from older versions
-                self.bag = bagit.Bag.convert_directory(str(self.path))
+                self._bag = bagit.Bag.convert_directory(str(self.path))
                 self.pages = [Page(img)
                               for img in (self.path/'data'/'raw').iterdir()]
                 self._save_pages()
@@ -447,57 +761,227 @@ class Workflow(object):
                     "Specified workflow directory is not structured according "
                     "to BagIt convertions and automatic conversion has been "
                     "disabled (check `convert_old` setting)")
-        if not self.slug:
-            self.slug = util.slugify(str(self.path.name))
-        if not self.id:
-            self.id = str(uuid.uuid4())
-        #: :py:class:`spreads.metadata.Metadata` instance that backs the
-        #: corresponding getter and setter
-        self._metadata = Metadata(self.path)
+        self._summary_info = None
 
-        # This will invoke the setter
-        if metadata:
-            self.metadata = metadata
-
-        #: Lock that is held when a shot is being executed during the capture
-        #: phase
-        self._capture_lock = threading.RLock()
-        #: List of :py:class:`spreads.plugin.DeviceDriver` instances that
-        #: backs the corresponding getters and setters
-        self._devices = None
-        # Thread pool for background tasks
-        self._threadpool = concfut.ThreadPoolExecutor(max_workers=1)
-        # List of unfinished :py:class:`concurrent.futures.Future` instances
-        self._pending_tasks = []
+    def _load_plugins(self):
+        """ Instantiate the workflow's plugins.
 
+        :returns:   Whether the list of enabled plugins in the configuration
+                    had to be changed
+        :rtype:     bool
+        """
         # Filter out subcommand plugins, since these are not workflow-specific
         plugin_classes = [
             (name, cls)
             for name, cls in plugin.get_plugins(*self.config["plugins"]
                                                 .get()).items()
             if not cls.__bases__ == (plugin.SubcommandHooksMixin,)]
-        self._plugins = [cls(self.config) for name, cls in plugin_classes]
-        self.config['plugins'] = [name for name, cls in plugin_classes]
-        self._save_config()
+        self._plugin_instances = [cls(self.config)
+                                  for name, cls in plugin_classes]
+        plugin_names = [name for name, cls in plugin_classes]
+        changed = plugin_names != self.config['plugins'].get()
+        self.config['plugins'] = plugin_names
+        return changed
+
+    def _shutdown_executors(self):
+        """ Release the hashing workers of the bag, if it was loaded. """
+        if self._bag is not None:
+            self._bag.shutdown_executors(wait=False)
+
+    def reload(self):
+        """ Discard the loaded configuration, bag, plugins, pages and table
+            of contents, so that they are loaded from disk again on their next
+            use, e.g. after the files of the workflow were replaced.
+        """
+        with self._load_lock:
+            self._shutdown_executors()
+            self._config = None
+            self._bag = None
+            self._plugin_instances = None
+            self._pages = None
+            self._table_of_contents = None
+            self._page_revision = None
+            self._page_states = None
+            self._removed_pages = None
+            self._delta_base = None
+            self._summary_info = None
+            self._metadata = Metadata(self.path)
 
-        self.pages = self._load_pages()
-        self.table_of_contents = self._load_toc()
+    @property
+    def config(self):
+        if self._config is None:
+            with self._load_lock:
+                if self._config is None:
+                    self._config = self._load_config(None)
+        return self._config
 
-        if is_new:
-            on_created.send(self, workflow=self)
+    @config.setter
+    def config(self, value):
+        self._config = value
+
+    @property
+    def bag(self):
+        if self._bag is None:
+            with self._load_lock:
+                if self._bag is None:
+                    self._load_bag()
+        return self._bag
+
+    @property
+    def _plugins(self):
+        if self._plugin_instances is None:
+            with self._load_lock:
+                if (self._plugin_instances is None and
+                        self._load_plugins()):
+                    self._save_config()
+        return self._plugin_instances
+
+    @property
+    def _bag_info(self):
+        """ Information from `bag-info.txt`, read without loading the bag. """
+        if self._bag is not None:
+            return self._bag.info
+        if self._summary_info is None:
+            self._summary_info = bagit.BagInfo(str(self.path/'bag-info.txt'))
+        return self._summary_info
 
     @property
     def id(self):
-        return self.bag.info.get('spreads-id')
+        return self._bag_info.get('spreads-id')
 
     @id.setter
     def id(self, value):
         self.bag.info['spreads-id'] = value
 
+    @property
+    def pages(self):
+        if self._pages is None:
+            with self._load_lock:
+                if self._pages is None:
+                    pages, revision = self._load_pages()
+                    pages = PageList(pages)
+                    self._reset_page_revisions(pages, revision)
+                    self._pages = pages
+        return self._pages
+
+    @pages.setter
+    def pages(self, value):
+        if self._page_revision is None:
+            self._reset_page_revisions([])
+        self._pages = PageList(value)
+
+    @property
+    def page_revision(self):
+        """ Revision of the workflow's pages.
+
+        It is incremented whenever pages are added, changed or removed, and
+        each page records the revision it was last changed in (see
+        :py:meth:`get_page_changes`).
+        """
+        self.pages
+        return self._page_revision
+
+    def get_page_changes(self, since):
+        """ Get the changes to the pages since a given revision.
+
+        :param since:   Revision as in :py:attr:`page_revision`
+        :type since:    int
+        :returns:       The pages that were added or changed since the
+                        revision and the capture numbers of the pages that
+                        were removed since then. The latter is `None` if the
+                        removals are unknown (e.g. because the revision
+                        predates the loading of the workflow), in which case
+                        all pages are returned.
+        :rtype:         tuple of a list of :py:class:`Page` and a list of int
+        """
+        pages = self.pages
+        if not self._delta_base <= since <= self._page_revision:
+            return list(pages), None
+        current = set(p.capture_num for p in pages)
+        removed = [num for revision, num in self._removed_pages
+                   if revision > since and num not in current]
+        return [p for p in pages if p.revision > since], removed
+
+    @staticmethod
+    def _get_page_state(page):
+        state = page.to_dict()
+        del state['revision']
+        state['processed_images'] = dict(state['processed_images'])
+        return state
+
+    def _reset_page_revisions(self, pages, revision=0):
+        """ Start tracking changes to the pages.
+
+        :param pages:       Pages as they are stored on disk
+        :type pages:        list of :py:class:`Page`
+        :param revision:    Revision that ``pagemeta.json`` was written at
+        :type revision:     int
+        """
+        self._page_states = dict((p.capture_num, self._get_page_state(p))
+                                 for p in pages)
+        self._page_revision = max(
+            [revision] + [p.revision for p in pages] +
+            [int(self._bag_info.get('spreads-page-revision', 0))])
+        #: Revisions and capture numbers of removed pages
+        self._removed_pages = []
+        #: Oldest revision that changes can be determined for
+        self._delta_base = self._page_revision
+
+    def _update_page_revisions(self):
+        """ Assign a new revision to all pages that were added or changed since
+            they were last saved and record the removed ones.
+
+        :returns:   Whether pages were removed
+        :rtype:     bool
+        """
+        revision = self._page_revision + 1
+        changed = False
+        states = {}
+        for page in self.pages:
+            state = self._get_page_state(page)
+            if self._page_states.get(page.capture_num) != state:
+                page.revision = revision
+                changed = True
+            states[page.capture_num] = state
+        removed = sorted(set(self._page_states) - set(states))
+        self._page_states = states
+        if removed:
+            self._removed_pages.extend((revision, num) for num in removed)
+            if len(self._removed_pages) > MAX_REMOVED_PAGES:
+                dropped = self._removed_pages[:-MAX_REMOVED_PAGES]
+                self._removed_pages = self._removed_pages[-MAX_REMOVED_PAGES:]
+                self._delta_base = dropped[-1][0]
+        if changed or removed:
+            self._page_revision = revision
+        return bool(removed)
+
+    @property
+    def page_count(self):
+        """ Number of pages in the workflow.
+
+        Does not load the pages if they were not loaded already.
+        """
+        if self._pages is not None:
+            return len(self._pages)
+        _, records = self._read_page_records()
+        return len(set(r['capture_num'] for r in records))
+
+    @property
+    def table_of_contents(self):
+        if self._table_of_contents is None:
+            with self._load_lock:
+                if self._table_of_contents is None:
+                    self._table_of_contents = self._load_toc()
+        return self._table_of_contents
+
+    @table_of_contents.setter
+    def table_of_contents(self, value):
+        self._table_of_contents = value
+
     @property
     def slug(self):
         # Read from Bag info
-        return self.bag.info.get('spreads-slug')
+        return self._bag_info.get('spreads-slug')
 
     @slug.setter
     def slug(self, value):
@@ -534,51 +1018,92 @@ class Workflow(object):
     def is_single_camera(self):
         return len(self.devices) == 1
 
-    def _fix_page_numbers(self, page_to_remove):
-        """ Fix page numbers and numeric page labels if a page was removed. """
+    def _fix_page_numbers(self, removed):
+        """ Fix page numbers and numeric page labels if pages were removed.
+
+        Runs in a single pass over the pages, labels are decremented by the
+        number of preceding removed pages with the same numbering scheme,
+        up to the first remaining page that uses a different one.
+
+        :param removed: Object ids of the removed pages
+        :type removed:  set of int
+        """
         def get_num_type(num_str):
-            if page_to_remove.page_label.isdigit():
+            if not num_str:
+                # Would otherwise pass as an (invalid) roman numeral
+                return None
+            elif num_str.isdigit():
                 return int, None
-            elif util.RomanNumeral.is_roman(page_to_remove.page_label):
-                return util.RomanNumeral, page_to_remove.page_label.islower()
-            elif num_str == '':
-                return None, None
-
-        # Fix page labels
-        page_idx = self.pages.index(page_to_remove)
-        num_type = get_num_type(page_to_remove.page_label)
-        if num_type != (None, None):
-            for next_page in self.pages[page_idx+1:]:
-                if get_num_type(next_page.page_label) != num_type:
-                    # We can stop re-numbering when the numbering scheme
-                    # has changed
-                    break
-                num = num_type[0](next_page.page_label)
-                next_page.page_label = str(num - 1)
-
-        # Fix sequence numbers:
-        # TODO: Verify....
-        for idx, next_page in enumerate(self.pages[page_idx+1:], page_idx):
-            next_page.sequence_num = idx
-
-    def _fix_table_of_contents(self, page_to_remove):
-        """ Fix table of contents if a page was removed. """
-        def find_page_in_toc(toc):
-            matches = []
-            for entry in toc:
-                if page_to_remove in (entry.start_page, entry.end_page):
-                    matches.append(entry)
-                if entry.children is not None:
-                    matches.extend(find_page_in_toc(entry.children))
-            return matches
-
-        page_idx = self.pages.index(page_to_remove)
-        for entry in find_page_in_toc(self.table_of_contents):
-            if entry.start_page == page_to_remove:
-                entry.start_page = self.pages[page_idx+1]
+            elif util.RomanNumeral.is_roman(num_str.upper()):
+                return util.RomanNumeral, num_str.islower()
             else:
-                entry.end_page = self.pages[page_idx-1]
-        self._save_toc()
+                return None
+
+        # Number of removed pages whose numbering scheme is still in effect,
+        # by numbering scheme
+        pending = {}
+        seq_num = None
+        for idx, page in enumerate(self.pages):
+            if id(page) in removed:
+                if seq_num is None:
+                    seq_num = idx
+                num_type = get_num_type(page.page_label)
+                if num_type is not None:
+                    pending[num_type] = pending.get(num_type, 0) + 1
+                continue
+            if seq_num is None:
+                continue
+            num_type = get_num_type(page.page_label)
+            # We can stop re-numbering when the numbering scheme has changed
+            if num_type in pending:
+                pending = {num_type: pending[num_type]}
+            else:
+                pending = {}
+            if pending:
+                num = num_type[0](page.page_label)
+                page.page_label = str(num - pending[num_type])
+            page.sequence_num = seq_num
+            seq_num += 1
+
+    def _fix_table_of_contents(self, removed):
+        """ Fix table of contents if pages were removed.
+
+        Entries that start on a removed page will start on the next remaining
+        page, entries that end on one on the previous remaining page.
+        Entries that no longer contain any pages are dropped.
+
+        :param removed: Object ids of the removed pages
+        :type removed:  set of int
+        :returns:       Whether any entries were changed
+        :rtype:         bool
+        """
+        def find_page(page, step):
+            idx = self.pages.index(page) + step
+            while 0 <= idx < len(self.pages):
+                if id(self.pages[idx]) not in removed:
+                    return self.pages[idx]
+                idx += step
+            return None
+
+        def fix_entries(toc):
+            changed = False
+            for entry in list(toc):
+                if id(entry.start_page) in removed:
+                    entry.start_page = find_page(entry.start_page, 1)
+                    changed = True
+                if id(entry.end_page) in removed:
+                    entry.end_page = find_page(entry.end_page, -1)
+                    changed = True
+                if (entry.start_page is None or entry.end_page is None or
+                        (self.pages.index(entry.start_page) >
+                         self.pages.index(entry.end_page))):
+                    toc.remove(entry)
+                    changed = True
+                elif entry.children is not None:
+                    changed = fix_entries(entry.children) or changed
+            return changed
+
+        return fix_entries(self.table_of_contents)
 
     def remove_pages(self, *pages):
         """ Remove one or more pages from the workflow.
@@ -589,15 +1114,20 @@ class Workflow(object):
         :param pages:   One or more pages to remove
         :type pages:    :py:class:`Page`
         """
-        for page in pages:
-            page.raw_image.unlink()
-            for fp in page.processed_images.values():
-                fp.unlink()
-            self._fix_page_numbers(page)
-            self._fix_table_of_contents(page)
-            self.pages.remove(page)
+        removed = {id(page) for page in pages}
+        if not removed:
+            return
+        self._fix_page_numbers(removed)
+        toc_changed = self._fix_table_of_contents(removed)
+        self.pages = [p for p in self.pages if id(p) not in removed]
+        # The bag takes care of deleting the files
+        self.bag.remove_payload(*(
+            str(fp) for page in pages
+            for fp in itertools.chain((page.raw_image,),
+                                      page.processed_images.values())))
+        if toc_changed:
+            self._save_toc()
         self._save_pages()
-        self.bag.update_payload(fast=True)
 
     def crop_page(self, page, left, top, width=None, height=None, run_async=False):
         """ Crop a page's raw image.
@@ -735,13 +1265,9 @@ class Workflow(object):
         :rtype:         list of :py:class:`TocEntry`
         """
         def from_dict(dikt):
-            start_page, end_page = None, None
-            try:
-                start_page = next(p for p in self.pages
-                                  if p.sequence_num == dikt['start_page'])
-                end_page = next(p for p in self.pages
-                                if p.sequence_num == dikt['end_page'])
-            except StopIteration:
+            start_page = self.pages.get_by_sequence_num(dikt['start_page'])
+            end_page = self.pages.get_by_sequence_num(dikt['end_page'])
+            if start_page is None or end_page is None:
                 missing = 'end_page' if start_page else 'start_page'
                 raise ValidationError(
                     *{missing: "No page with that sequence number."})
@@ -758,9 +1284,9 @@ class Workflow(object):
 
     def _save_toc(self):
         """ Write TOC entries to ``toc.json`` in bag. """
-        if not self.table_of_contents:
-            return
         toc_path = self.path / 'toc.json'
+        if not self.table_of_contents and not toc_path.exists():
+            return
         with toc_path.open('w', encoding='utf-8') as fp:
             json.dump([x.to_dict() for x in self.table_of_contents], fp,
                       cls=util.CustomJSONEncoder, indent=2, ensure_ascii=False)
@@ -768,11 +1294,53 @@ class Workflow(object):
         on_modified.send(self,
                          changes={'table_of_contents': self.table_of_contents})
 
+    def _read_page_records(self):
+        """ Read the serialized pages from ``pagemeta.json`` and the page
+            journal.
+
+        After a crash between writing ``pagemeta.json`` and removing the
+        journal, the journal's pages are already contained in (or were
+        removed from) ``pagemeta.json``. They are recognized by their
+        revision, which is not newer than the one ``pagemeta.json`` was
+        written at.
+
+        :returns:   Revision that ``pagemeta.json`` was written at and the
+                    serialized pages
+        :rtype:     tuple of int and list of dict
+        """
+        revision, records = 0, []
+        fpath = self.path / 'pagemeta.json'
+        if fpath.exists():
+            with fpath.open('r') as fp:
+                data = json.load(fp)
+            if isinstance(data, dict):
+                revision, records = data['revision'], data['pages']
+            else:
+                # Written before the revision was recorded
+                records = data
+        journal_path = self.path / PAGE_JOURNAL_FNAME
+        if journal_path.exists():
+            with journal_path.open('r', encoding='utf-8') as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Incomplete last line, e.g. after a crash
+                        self._logger.warning(
+                            "Skipping invalid entry in page journal: {0}"
+                            .format(line))
+                        continue
+                    if record.get('revision', 0) > revision:
+                        records.append(record)
+        return revision, records
+
     def _load_pages(self):
-        """ Load pages from ``pagemeta.json`` in bag.
+        """ Load pages from ``pagemeta.json`` in bag, including the pages
+            that were appended to the page journal since.
 
-        :returns:   Deserialized pages
-        :rtype:     list of :py:class:`Page`
+        :returns:   Deserialized pages and the revision that
+                    ``pagemeta.json`` was written at
+        :rtype:     tuple of a list of :py:class:`Page` and int
         """
         def from_dict(dikt):
             raw_image = self.path/dikt['raw_image']
@@ -789,22 +1357,87 @@ class Workflow(object):
                         capture_num=dikt['capture_num'],
                         processed_images=processed_images,
                         page_label=dikt['page_label'],
-                        sequence_num=dikt['sequence_num'])
-        fpath = self.path / 'pagemeta.json'
-        if not fpath.exists():
-            return []
-        with fpath.open('r') as fp:
-            return sorted([from_dict(p) for p in json.load(fp)],
-                          key=lambda p: p.sequence_num)
+                        sequence_num=dikt['sequence_num'],
+                        revision=dikt.get('revision', 0))
+        revision, records = self._read_page_records()
+        # pagemeta.json files without a revision may share pages with the
+        # journal after a crash, so we keep only the most recent record for
+        # every capture
+        latest = {}
+        for record in records:
+            previous = latest.get(record['capture_num'])
+            if (previous is None or
+                    record.get('revision', 0) >= previous.get('revision', 0)):
+                latest[record['capture_num']] = record
+        pages = sorted([from_dict(p) for p in latest.values()],
+                       key=lambda p: p.sequence_num)
+        return pages, revision
 
     def _save_pages(self):
         """ Write pages to ``pagemeta.json`` in bag. """
         fpath = self.path / 'pagemeta.json'
+        # Make sure pages are loaded before the file is truncated
+        pages = self.pages
+        since = self._page_revision
+        removed = self._update_page_revisions()
         with fpath.open('w', encoding='utf-8') as fp:
-            json.dump([x.to_dict() for x in self.pages], fp,
+            # The revision tells which journal entries are contained in the
+            # file, in case the journal cannot be removed below
+            json.dump({'revision': self._page_revision,
+                       'pages': [x.to_dict() for x in pages]}, fp,
                       cls=util.CustomJSONEncoder, indent=2, ensure_ascii=False)
-        self.bag.add_tagfiles(str(fpath))
-        on_modified.send(self, changes={'pages': self.pages})
+        with self.bag.batch():
+            self.bag.add_tagfiles(str(fpath))
+            if removed:
+                # Otherwise the revision can be determined from the pages,
+                # but it must not go back when the latest pages are removed
+                self.bag.info['spreads-page-revision'] = str(
+                    self._page_revision)
+        # All pages from the journal are now contained in pagemeta.json
+        journal_path = self.path / PAGE_JOURNAL_FNAME
+        if journal_path.exists():
+            journal_path.unlink()
+        self._send_pages_modified(since)
+
+    def _append_pages(self, pages):
+        """ Append newly added pages to the page journal.
+
+        Unlike :py:meth:`_save_pages`, the cost of this does not grow with
+        the number of pages in the workflow. The journal is merged into
+        ``pagemeta.json`` on the next call to :py:meth:`_save_pages`.
+
+        :param pages:   Pages that were appended to :py:attr:`pages`
+        :type pages:    list of :py:class:`Page`
+        """
+        since = self._page_revision
+        self._page_revision += 1
+        for page in pages:
+            page.revision = self._page_revision
+            self._page_states[page.capture_num] = self._get_page_state(page)
+        journal_path = self.path / PAGE_JOURNAL_FNAME
+        with journal_path.open('a', encoding='utf-8') as fp:
+            for page in pages:
+                fp.write(json.dumps(page.to_dict(), cls=util.CustomJSONEncoder,
+                                    ensure_ascii=False))
+                fp.write("\n")
+        self._send_pages_modified(since)
+
+    def _send_pages_modified(self, since):
+        """ Emit :py:data:`on_modified` for the pages.
+
+        Instead of all pages, the changes only contain a ``page_diff`` with
+        the pages that were added or changed since a revision and the capture
+        numbers of the removed ones (see :py:meth:`get_page_changes`). It is
+        a snapshot, so receivers in other threads never have to access the
+        pages of the workflow.
+
+        :param since:   Revision of the pages before they were modified
+        :type since:    int
+        """
+        pages, removed = self.get_page_changes(since)
+        on_modified.send(self, changes={
+            'page_diff': {'since': since, 'revision': self._page_revision,
+                          'pages': pages, 'removed': removed}})
 
     def _run_hook(self, hook_name, *args):
         """ Run a specific hook method on all activated plugins.
@@ -936,13 +1569,19 @@ class Workflow(object):
                 page.sequence_num = len(self.pages)
                 self.pages.append(page)
             self._run_hook('capture', self.devices, self.path)
-            # Queue new images for hashing
-            future = self._threadpool.submit(self.bag.add_payload,
-                                             *(str(p.raw_image)
-                                               for p in captured_pages))
+            # Queue new images for hashing. Drivers can return the image data
+            # they wrote, in which case the files don't have to be read from
+            # disk again.
+            captured_data = [
+                (str(page.raw_image),
+                 data if isinstance(data, bytes) else None)
+                for page, data in zip(captured_pages,
+                                      (f.result() for f in futures))]
+            future = self._threadpool.submit(self.bag.add_payload_data,
+                                             *captured_data)
             self._pending_tasks.append(future)
 
-        self._save_pages()
+        self._append_pages(captured_pages)
         on_capture_succeeded.send(self, pages=captured_pages, retake=retake)
 
     def finish_capture(self):
@@ -950,14 +1589,18 @@ class Workflow(object):
         # Waits for last capture to finish
         with self._capture_lock:
             concfut.wait(self._pending_tasks)
+        # No more hashing to be done until the next capture session, so we
+        # can release the hashing workers
+        self.bag.shutdown_executors()
         with concfut.ThreadPoolExecutor(len(self.devices)) as executor:
             futures = []
             self._logger.debug("Sending finish_capture command to devices")
             for dev in self.devices:
                 futures.append(executor.submit(dev.finish_capture))
         util.check_futures_exceptions(futures)
-        # NOTE: For performance reason, we only save the pages here, since
-        # the ongoing hashing slows things down considerably during capture
+        # NOTE: For performance reasons, captured pages are only appended to
+        # the page journal during capture, here we merge them into
+        # pagemeta.json
         self._save_pages()
         self._run_hook('finish_capture', self.devices, self.path)
         self._run_hook('stop_trigger_loop')
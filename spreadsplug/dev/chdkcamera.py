@@ -305,6 +305,7 @@ class CHDKCameraDevice(DeviceDriver):
             data = update_exif_orientation(data, 6 if upside_down else 8)
         with path.open('wb') as fp:
             fp.write(data)
+        return data
 
     def update_configuration(self, updated):
         if 'zoom_level' in updated:
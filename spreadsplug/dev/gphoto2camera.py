@@ -108,7 +108,10 @@ class GPhoto2CameraDevice(DeviceDriver):
             img.exif_orientation = 8 if upside_down else 6  # -90°
         else:
             img.exif_orientation = 6 if upside_down else 8  # 90°
-        img.save(unicode(path))
+        data = img.as_blob()
+        with path.open('wb') as fp:
+            fp.write(data)
+        return data
 
     def update_configuration(self, updated):
         pass
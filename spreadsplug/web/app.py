@@ -19,7 +19,9 @@
 
 import logging
 import logging.handlers
+import multiprocessing
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # Python 2/3 compatibility
 if sys.version_info[0] >= 3:
@@ -67,10 +69,14 @@ from . import endpoints  # NOQA
 from . import util  # NOQA
 from . import handlers  # NOQA
 try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
     app.json_encoder = util.CustomJSONEncoder
-except AttributeError:
-    # Flask 2.2+ uses json_provider_class instead of json_encoder
-    app.json_provider_class = util.CustomJSONEncoder
+else:
+    # Flask 2.2+ serializes through a JSON provider instead of an encoder
+    class CustomJSONProvider(DefaultJSONProvider):
+        default = staticmethod(util.CustomJSONEncoder().default)
+    app.json = CustomJSONProvider(app)
 from .discovery import DiscoveryListener  # NOQA
 
 #: Global logger
@@ -183,6 +189,18 @@ class WebCommands(plugin.HookPlugin, plugin.SubcommandHooksMixin):
                 value=5000,
                 docstring="TCP-Port to listen on",
                 selectable=False),
+            'image_cache_size': OptionTemplate(
+                value=512,
+                docstring="Maximum size of the cache for thumbnails, scaled "
+                          "images and tiles in MiB",
+                selectable=False,
+                advanced=True),
+            'image_workers': OptionTemplate(
+                value=0,
+                docstring="Number of processes for scaling and converting "
+                          "images, 0 for one per CPU core",
+                selectable=False,
+                advanced=True),
         }
 
     @staticmethod
@@ -256,6 +274,12 @@ class WebApplication(object):
         app.config['standalone'] = self.config['standalone_device'].get()
         app.config['postprocessing_server'] = (
             self.config['postprocessing_server'].get() or None)
+        app.config['image_processor'] = util.ImageProcessor(
+            num_workers=self.config['image_workers'].get(int) or None)
+        app.config['image_cache'] = util.ImageCache(
+            config.cfg_path.parent / 'images',
+            self.config['image_cache_size'].get(int)*1024**2,
+            processor=app.config['image_processor'])
         if not self._debug:
             app.error_handler_spec[None][500] = (
                 endpoints.handle_general_exception)
@@ -285,23 +309,17 @@ class WebApplication(object):
 
     def setup_signals(self):
         """ Connect signal handlers. """
-        def get_signal_callback_http(signal):
-            """ Create a signal callback that adds a signal as a
-                :py:class:`util.Event` to the buffer in :py:mod:`handlers`.
+        def get_signal_callback(signal):
+            """ Create a signal callback that publishes a signal as a
+                :py:class:`util.Event` to the long-polling and websocket
+                clients via the coalescer in :py:mod:`handlers`.
             """
             def signal_callback(sender, **kwargs):
                 event = util.Event(signal, sender, kwargs)
-                handlers.event_buffer.new_events([event])
-            return signal_callback
-
-        def get_signal_callback_websockets(signal):
-            """ Create a signal callback that sends out a signals as a
-                :py:class:`util.Event` via the
-                :py:class:`tornado.web.WebSocketHandler` in :py:mod:`handlers`.
-            """
-            def signal_callback(sender, **kwargs):
-                handlers.WebSocketHandler.send_event(
-                    util.Event(signal, sender, kwargs))
+                # Signals can be sent from any thread, but clients may only
+                # be answered from the IOLoop
+                IOLoop.instance().add_callback(
+                    handlers.event_coalescer.add, event)
             return signal_callback
 
         # Register event handlers
@@ -311,18 +329,56 @@ class WebApplication(object):
                                      tasks, handlers)))
 
         for signal in signals_:
-            signal.connect(get_signal_callback_http(signal), weak=False)
-            signal.connect(get_signal_callback_websockets(signal), weak=False)
+            signal.connect(get_signal_callback(signal), weak=False)
+
+        # Generate thumbnails in the background as soon as new images are
+        # available, so they don't have to be generated on request
+        image_cache = app.config['image_cache']
+
+        def generate_capture_thumbnails(sender, **kwargs):
+            image_cache.generate_thumbnails(
+                sender, [page.raw_image for page in kwargs['pages']])
+
+        def generate_processed_thumbnails(sender, **kwargs):
+            if ('page_diff' not in kwargs.get('changes', {}) or
+                    sender.status['step'] != 'process'):
+                return
+            img_paths = (page.get_latest_processed(image_only=True)
+                         for page in kwargs['changes']['page_diff']['pages'])
+            image_cache.generate_thumbnails(sender,
+                                            [p for p in img_paths if p])
+
+        def remove_thumbnails(sender, **kwargs):
+            image_cache.remove_workflow(kwargs['senderId'])
+
+        spreads.workflow.on_capture_succeeded.connect(
+            generate_capture_thumbnails, weak=False)
+        spreads.workflow.on_modified.connect(
+            generate_processed_thumbnails, weak=False)
+        spreads.workflow.on_removed.connect(remove_thumbnails, weak=False)
 
     def setup_tornado(self):
         """ Configure Tornado web application. """
+        # Blocking work from the native API handlers and the WSGI endpoints
+        # runs on this executor, so that it never stalls the IOLoop
+        self.executor = ThreadPoolExecutor(
+            max_workers=2*multiprocessing.cpu_count())
         if self._debug:
             # Exposes Werkzeug's interactive debugger for WSGI endpoints.
             logger.info("Starting server in debugging mode")
             from werkzeug.debug import DebuggedApplication
-            container = WSGIContainer(DebuggedApplication(app, evalex=True))
+            wsgi_app = DebuggedApplication(app, evalex=True)
         else:
-            container = WSGIContainer(app)
+            wsgi_app = app
+        wsgi_app = util.SerializedWSGIApp(wsgi_app)
+        try:
+            container = WSGIContainer(wsgi_app, executor=self.executor)
+        except TypeError:
+            # Tornado < 6.3 always runs WSGI applications on the IOLoop
+            container = WSGIContainer(wsgi_app)
+        api_args = dict(base_path=app.config['base_path'], fallback=container,
+                        executor=self.executor)
+        image_args = dict(api_args, image_cache=app.config['image_cache'])
         self.application = Application([
             (r"/ws", handlers.WebSocketHandler),
             (r"/api/workflow/([0-9a-z-]+)/download/(.*)\.zip",
@@ -333,8 +389,28 @@ class WebApplication(object):
              dict(base_path=app.config['base_path'])),
             (r"/api/workflow/upload",
              handlers.StreamingUploadHandler,
-             dict(base_path=app.config['base_path'])),
+             dict(base_path=app.config['base_path'],
+                  executor=self.executor)),
+            (r"/api/sync/([0-9a-f-]+)/files/(.+)", handlers.SyncFileHandler,
+             dict(base_path=app.config['base_path'],
+                  executor=self.executor)),
             (r"/api/poll", handlers.EventLongPollingHandler),
+            # Native implementations of the read-heavy API routes, other
+            # methods on these are passed on to the WSGI endpoints
+            (r"/api/workflow", handlers.WorkflowListHandler, api_args),
+            (r"/api/workflow/([^/]+)", handlers.WorkflowHandler, api_args),
+            (r"/api/workflow/([^/]+)/page", handlers.PageListHandler,
+             api_args),
+            (r"/api/workflow/([^/]+)/results", handlers.ResultPullHandler,
+             api_args),
+            (r"/api/workflow/([^/]+)/output/([^/]+)",
+             handlers.OutputFileHandler, api_args),
+            (r"/api/workflow/([^/]+)/page/(\d+)/(raw|processed)"
+             r"(?:/([^/]+))?/thumb",
+             handlers.PageThumbnailHandler, image_args),
+            (r"/api/workflow/([^/]+)/page/(\d+)/(raw|processed)"
+             r"(?:/(?!thumb$|crop$)([^/]+))?",
+             handlers.PageImageHandler, image_args),
             # Fall back to WSGI endpoints
             (r".*", FallbackHandler, dict(fallback=container))
         ], debug=self._debug)
@@ -443,5 +519,6 @@ class WebApplication(object):
         finally:
             # Shut everything down that is still running in the background
             self.consumer.shutdown()
+            app.config['image_processor'].shutdown(wait=False)
             if app.config['mode'] in ('processor', 'full'):
                 discovery_listener.stop()
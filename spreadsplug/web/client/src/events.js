@@ -34,7 +34,7 @@
     poll: function() {
 
       var args = {};
-      if (this.cursor) args.cursor = this.cursor;
+      if (this.cursor !== null) args.cursor = this.cursor;
       jQuery.ajax({url: "/api/poll", type: "POST", dataType: "text",
               data: jQuery.param(args), success: this.onSuccess.bind(this),
               error: this.onError.bind(this)});
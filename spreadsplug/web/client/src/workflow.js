@@ -53,6 +53,22 @@
         .done(options.onSuccess || util.noop);
     },
 
+    /**
+     * Fetches the files that were generated on the postprocessing server
+     * since the workflow was submitted.
+     */
+    pullResults: function(options) {
+      var options = options || {};
+      jQuery.ajax('/api/workflow/' + this.id + '/pull', {
+          type: 'POST',
+          data: JSON.stringify({server: options.server}),
+          contentType: "application/json; charset=utf-8"})
+        .fail(function(xhr) {
+          if (options.onError) options.onError(xhr.responseJSON);
+        })
+        .done(options.onSuccess || util.noop);
+    },
+
     /**
      * Initiates the transfer to a removable storage device.
      */
@@ -160,6 +176,38 @@
         })
         .done(options.onSuccess || util.noop);
     },
+
+    /**
+     * Apply the changes to the pages since a given revision, as sent by the
+     * server in `workflow:modified` events. If our pages are not at that
+     * revision, the changes since our revision are fetched instead.
+     */
+    applyPageDiff: function(diff) {
+      var revision = this.get('page_revision');
+      if (diff.since !== revision) {
+        jQuery.getJSON('/api/workflow/' + this.id + '/page',
+                       {since: revision || 0})
+          .done(function(data) {
+            this.applyPageDiff(_.extend(data, {since: revision}));
+          }.bind(this));
+        return;
+      }
+      var changed = {},
+          pages;
+      _.each(diff.pages, function(page) {
+        changed[page.capture_num] = true;
+      });
+      if (diff.removed === null) {
+        pages = diff.pages;
+      } else {
+        pages = _.reject(this.get('pages'), function(page) {
+          return _.contains(diff.removed, page.capture_num) ||
+                 _.has(changed, page.capture_num);
+        }).concat(diff.pages);
+        pages = _.sortBy(pages, 'sequence_num');
+      }
+      this.set({pages: pages, page_revision: diff.revision});
+    },
   });
 
   module.exports = Backbone.Collection.extend({
@@ -169,6 +217,10 @@
       return -workflow.get('last_modified');
     },
     connectEvents: function(eventDispatcher) {
+      // We missed some events, so our state is no longer reliable
+      eventDispatcher.on('events:resync', function() {
+        this.fetch();
+      }, this);
       eventDispatcher.on('workflow:created', function(data) {
         // Check for pending workflows, if there is one, it's the one that
         // just triggered the event on the server and is about to receive
@@ -204,10 +256,13 @@
       }, this);
       eventDispatcher.on('workflow:modified', function(data) {
         var workflow = this.get(data.senderId);
-        var changes = data.changes;
+        var changes = _.omit(data.changes, 'page_diff');
         changes.last_modified = new Date().getTime() / 1000;
         if (workflow) {
           workflow.set(changes);
+          if (data.changes.page_diff) {
+            workflow.applyPageDiff(data.changes.page_diff);
+          }
         }
         this.sort();
       }, this);
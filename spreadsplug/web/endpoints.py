@@ -28,6 +28,8 @@ import logging.handlers
 import subprocess
 import sys
 import traceback
+import zlib
+from datetime import datetime, timezone
 from isbnlib import is_isbn10, is_isbn13
 
 import pkg_resources
@@ -39,15 +41,20 @@ try:
 except ImportError:
     # Modern Werkzeug versions
     from cachelib import SimpleCache
+from werkzeug.http import is_resource_modified
 
 import spreads.metadata
 import spreads.plugin as plugin
 from spreads.util import is_os, get_version, DeviceException
-from spreads.workflow import Workflow, ValidationError
+from spreads.workflow import (Workflow, ValidationError, on_created,
+                              on_modified)
 
 from spreadsplug.web.app import app
 from .discovery import discover_servers
-from .util import WorkflowConverter, get_thumbnail, scale_image, convert_image
+from .util import (TRANSFORMABLE_SUFFIXES, ImageProcessorBusy, SyncError,
+                   SyncSession, WorkflowConverter, get_file_etag,
+                   get_page_listing, get_workflow_summary,
+                   parse_transform_args)
 
 if is_os('windows'):
     from .util import find_stick_win as find_stick
@@ -78,6 +85,7 @@ class ApiException(Exception):
     def __init__(self, message, status_code=500, payload=None,
                  error_type='general'):
         super(ApiException, self).__init__(message)
+        self.message = message
         if status_code is not None:
             self.status_code = status_code
         self.payload = payload
@@ -103,6 +111,34 @@ def handle_validationerror(error):
         400, error.errors, 'validation'))
 
 
+@app.errorhandler(ImageProcessorBusy)
+def handle_imageprocessorbusy(error):
+    """ Handler for :py:class:`util.ImageProcessorBusy` errors.
+
+    Responds with status code 503 and a `Retry-After` header, so that clients
+    back off until pending image transforms are finished.
+    """
+    response = handle_apiexception(ApiException(str(error), 503,
+                                                error_type='busy'))
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@app.errorhandler(SyncError)
+def handle_syncerror(error):
+    """ Handler for :py:class:`util.SyncError` errors.
+
+    Responds with status code 409 and the number of bytes that were received
+    of the file as the payload if the sender has to continue at a different
+    offset, otherwise with status code 400.
+    """
+    if error.offset is not None:
+        return handle_apiexception(ApiException(
+            str(error), 409, {'offset': error.offset}, 'sync'))
+    return handle_apiexception(ApiException(str(error), 400,
+                                            error_type='sync'))
+
+
 @app.errorhandler(ApiException)
 def handle_apiexception(error):
     """ Handler for :py:class:`ApiException` errors.
@@ -234,6 +270,19 @@ def get_logs():
                    messages=msgs[start:start+count])
 
 
+@app.route('/api/stats')
+def get_stats():
+    """ Get metrics about the server's load.
+
+    :resheader Content-Type:        :mimetype:`application/json`
+    :>json object image_processor:  Queue depth and throughput of the image
+                                    transform pool, see
+                                    :py:meth:`util.ImageProcessor.get_stats`
+    """
+    return jsonify(
+        image_processor=app.config['image_processor'].get_stats())
+
+
 @app.route('/api/isbn')
 def query_isbn():
     """ Search for ISBN records.
@@ -585,10 +634,17 @@ def create_workflow():
 def list_workflows():
     """ Return a list of all workflows.
 
+    :queryparam summary:        Only return the number of pages instead of
+                                the pages and omit the configuration, which
+                                is much cheaper to compute. Without it, the
+                                pages and configuration of every workflow
+                                are loaded, which the client relies on.
     :resheader Content-Type:    :mimetype:`application/json`
     """
-    workflows = Workflow.find_all(app.config['base_path'])
-    return make_response(json.dumps(workflows.values()),
+    workflows = list(Workflow.find_all(app.config['base_path']).values())
+    if request.args.get('summary'):
+        workflows = [get_workflow_summary(wf) for wf in workflows]
+    return make_response(json.dumps(workflows),
                          200, {'Content-Type': 'application/json'})
 
 
@@ -702,7 +758,7 @@ def transfer_workflow(workflow):
             "Could not find a removable devices to transfer to."
             "If you have connected one, make sure that it is formatted with "
             "the FAT32 file system", 503, error_type='transfer')
-    from tasks import transfer_to_stick
+    from .tasks import transfer_to_stick
     transfer_to_stick(workflow.id, app.config['base_path'])
     return 'OK'
 
@@ -746,19 +802,112 @@ def submit_workflow(workflow):
     if not server:
         raise ValidationError(server="required")
     user_config = data.get('config', {})
-    from tasks import upload_workflow
+    from .tasks import upload_workflow
     upload_workflow(workflow.id, app.config['base_path'],
-                    'http://{0}/api/workflow/upload'.format(server),
+                    'http://{0}'.format(server),
                     user_config,
                     start_process=data.get('start_process', False),
                     start_output=data.get('start_output', False))
     return 'OK'
 
 
+@app.route('/api/workflow/<workflow:workflow>/pull', methods=['POST'])
+@restrict_to_modes("scanner")
+def pull_workflow_results(workflow):
+    """ Enqueue fetching the results of postprocessing and output generation
+    for a submitted workflow from a postprocessing server.
+
+    Only result files that are new or have changed on the server are
+    transferred. Watch for :py:data:`spreadsplug.web.tasks.on_pull_started`,
+    :py:data:`spreadsplug.web.tasks.on_pull_completed` and
+    :py:data:`spreadsplug.web.tasks.on_pull_error`.
+
+    :reqheader Accept:  :mimetype:`application/json`
+    :param workflow:    UUID or slug for the workflow to fetch results for
+    :type workflow:     str
+    :<json string server:   Address of server the workflow was submitted to
+
+    :status 200:        When fetching the results was successfully enqueued.
+    :status 400:        When no postprocessing server was specified
+    """
+    data = json.loads(request.data)
+    server = data.get('server')
+    if not server:
+        raise ValidationError(server="required")
+    from .tasks import pull_results
+    pull_results(workflow.id, app.config['base_path'],
+                 'http://{0}'.format(server))
+    return 'OK'
+
+
+@app.route('/api/sync/<workflow_id>', methods=['POST'])
+@restrict_to_modes('processor', 'full')
+def start_sync(workflow_id):
+    """ Start or resume the transfer of a workflow from a scanner.
+
+    The response lists the files that need to be uploaded, which is done in
+    chunks with ``PUT`` requests to
+    ``/api/sync/<workflow_id>/files/<path>`` (see
+    :py:class:`spreadsplug.web.handlers.SyncFileHandler`). Once all of
+    them were uploaded, the transfer has to be committed.
+
+    :reqheader Accept:      :mimetype:`application/json`
+    :param workflow_id:     UUID of the workflow
+    :type workflow_id:      str
+    :<json string name:     Directory name of the workflow on the scanner
+    :<json string algorithm: Checksum algorithm, default is `md5`
+    :<json object files:    ``checksum`` and ``size`` of every file in the
+                            workflow's bag, by its path relative to the bag
+    :>json object missing:  Paths of the files that need to be uploaded,
+                            mapped to the number of bytes that were already
+                            received
+
+    :status 200:            When the transfer was started
+    :status 400:            When the list of files is invalid
+    """
+    data = json.loads(request.data)
+    session = SyncSession(app.config['base_path'], workflow_id)
+    missing = session.start(data.get('name'), data.get('files', {}),
+                            data.get('algorithm', 'md5'))
+    return jsonify(missing=missing)
+
+
+@app.route('/api/sync/<workflow_id>/commit', methods=['POST'])
+@restrict_to_modes('processor', 'full')
+def commit_sync(workflow_id):
+    """ Complete the transfer of a workflow from a scanner.
+
+    :param workflow_id:     UUID of the workflow
+    :type workflow_id:      str
+
+    :status 200:            When the workflow was updated or created, its
+                            JSON representation is returned
+    :status 400:            When not all files were uploaded yet
+    """
+    workflow, is_new = SyncSession(app.config['base_path'],
+                                   workflow_id).commit()
+    if is_new:
+        on_created.send(workflow, workflow=workflow)
+    else:
+        # The pages were replaced as a whole, so clients have to fetch them
+        # again, see `EventCoalescer`
+        on_modified.send(workflow, changes={
+            'metadata': workflow.metadata,
+            'page_diff': {'since': None, 'revision': workflow.page_revision,
+                          'pages': [], 'removed': []},
+            'table_of_contents': workflow.table_of_contents})
+    return make_response(json.dumps(workflow),
+                         200, {'Content-Type': 'application/json'})
+
+
 @app.route('/api/workflow/<workflow:workflow>/output/<fname>')
 def get_output_file(workflow, fname):
     """ Download an output file.
 
+    When running under Tornado, requests are answered by
+    :py:class:`spreadsplug.web.handlers.OutputFileHandler`, which supports
+    range requests.
+
     :param workflow:    UUID or slug for the workflow to download from
     :type workflow:     str
     :param fname:       Filename of the output file to download
@@ -773,7 +922,40 @@ def get_output_file(workflow, fname):
         raise ApiException("Could not find file with name '{0}' amongst "
                            "output files for workflow '{1}'"
                            .format(fname, workflow.id), 404)
-    return send_file(str(fpath))
+    return send_file(str(fpath), conditional=True,
+                     etag=get_file_etag(workflow, fpath))
+
+
+def conditional_response(etag, last_modified, mimetype, get_data):
+    """ Create a response that answers conditional requests with
+        `304 Not Modified` without generating its body.
+
+    :param etag:            Entity tag for the response
+    :type etag:             str
+    :param last_modified:   Modification time as a UNIX timestamp, if
+                            known
+    :type last_modified:    float
+    :param mimetype:        Mimetype of the response body
+    :type mimetype:         str
+    :param get_data:        Callable that returns the response body, only
+                            called if the client's copy is outdated
+    :type get_data:         callable
+    :rtype:                 :py:class:`flask.Response`
+    """
+    if last_modified is not None:
+        last_modified = datetime.fromtimestamp(int(last_modified),
+                                               timezone.utc)
+    response = Response(mimetype=mimetype)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    if not is_resource_modified(request.environ, etag=etag,
+                                last_modified=last_modified):
+        response.status_code = 304
+    else:
+        response.set_data(get_data())
+    return response
 
 
 # =============== #
@@ -791,8 +973,7 @@ def inject_page(func):
         # through to the original function
         if 'workflow' not in kwargs and 'number' not in kwargs:
             return func(*args, **kwargs)
-        page = next((p for p in kwargs['workflow'].pages
-                    if p.capture_num == kwargs['number']), None)
+        page = kwargs['workflow'].pages.get_by_capture_num(kwargs['number'])
         if not page:
             raise ApiException(
                 "Could not find page with capture number {1}"
@@ -854,12 +1035,36 @@ def get_all_pages(workflow):
 
     :param workflow:    UUID or slug for a workflow
     :type workflow:     str
+    :queryparam offset: Index of the first page to return
+    :type offset:       int
+    :queryparam limit:  Maximum number of pages to return
+    :type limit:        int
+    :queryparam fields: Comma-separated names of the page fields to return
+    :type fields:       str
+    :queryparam since:  Only return the pages that were added or changed
+                        since this page revision, together with the capture
+                        numbers of the removed pages
+    :type since:        int
+
+    If any of the query parameters is given, the pages are wrapped in an
+    object, see :py:func:`util.get_page_listing`.
 
     :resheader Content-Type:    :mimetype:`application/json`
     """
+    def get_data():
+        try:
+            listing = get_page_listing(
+                workflow, *(request.args.get(k)
+                            for k in ('offset', 'limit', 'fields', 'since')))
+        except ValueError as e:
+            raise ApiException(str(e), 400)
+        return json.dumps(listing)
 
-    return make_response(json.dumps(workflow.pages),
-                         200, {'Content-Type': 'application/json'})
+    # The listing only changes with the page revision, so clients that
+    # already have the current version are answered without building it
+    etag = "{0}-{1}-{2:x}".format(workflow.id, workflow.page_revision,
+                                  zlib.crc32(request.query_string))
+    return conditional_response(etag, None, 'application/json', get_data)
 
 
 @app.route('/api/workflow/<workflow:workflow>/page/<int:number>/<img_type>',
@@ -870,6 +1075,10 @@ def get_all_pages(workflow):
 def get_page_image(fpath, page, workflow, number, img_type, plugname):
     """ Get image for requested page.
 
+    When running under Tornado, requests for unmodified images are answered
+    by :py:class:`spreadsplug.web.handlers.PageImageHandler`, which supports
+    range requests.
+
     :param workflow:    UUID or slug for a workflow
     :type workflow:     str
     :param number:      Capture number of requested page
@@ -881,40 +1090,39 @@ def get_page_image(fpath, page, workflow, number, img_type, plugname):
                         :py:attr:`spreads.workflow.Workflow.processed_images`
                         dictionary.
     :type plugname:     str
-    :queryparam width:  Optionally scale down image to the desired width
+    :queryparam width:  Optionally scale down image to the desired width,
+                        which is rounded up to a multiple of
+                        :py:attr:`util.ImageCache.WIDTH_STEP`
     :type width:        int
     :queryparam format: Optionally convert image to desired format.
                         If `browser` is specified, non-JPG or PNG images will
-                        be converted to PNG.
+                        be converted to PNG. Defaults to JPEG if only `width`
+                        or `quality` are specified.
     :type format:       str, either `browser` or a format string recognized
-                        by Pillow: http://pillow.readthedocs.org/en/latest/\\
-                                   handbook/image-file-formats.html
+                        by ImageMagick
+    :queryparam quality: Optionally set the quality of lossy formats
+    :type quality:      int, from 1 to 100
+
+    Scaling, conversion and quality can be combined, the image is only
+    decoded once.
 
     :resheader Content-Type:    Depends on value of `format`, by default
                                 the mime-type of the original image.
     """
-    width = request.args.get('width', None)
-    img_format = request.args.get('format', None)
-    # FIXME: This clearly sucks, rework convert_image and scale_image to allow
-    #        for it.
-    if width is not None and img_format is not None:
-        raise ApiException("Can not scale and convert at the same time.", 400)
-    transformable = fpath.suffix.lower() in ('.jpg', '.jpeg', '.tif', '.tiff',
-                                             '.png')
-    if (width is not None or img_format is not None) and not transformable:
-        raise ApiException("Can only scale/convert JPG, TIF or PNG files.",
-                           400)
-    if width:
-        # Scale image if requested
-        return scale_image(fpath, width=int(width))
-    elif img_format:
-        # Convert to target format
-        if fpath.suffix.lower() not in ('.tif', '.tiff', '.jpg', '.jpeg'):
-            img_format = 'png' if img_format == 'browser' else img_format
-        return convert_image(fpath, img_format)
+    try:
+        width, img_format, quality = parse_transform_args(
+            fpath, request.args.get('width'), request.args.get('format'),
+            request.args.get('quality'))
+    except ValueError as e:
+        raise ApiException(str(e), 400)
+    if img_format is not None:
+        transformed_path = app.config['image_cache'].get_transformed(
+            workflow, fpath, width, img_format, quality)
+        return send_file(str(transformed_path), conditional=True)
     else:
         # Send unmodified if no scaling/converting is requested
-        return send_file(str(fpath))
+        return send_file(str(fpath), conditional=True,
+                         etag=get_file_etag(workflow, fpath))
 
 
 @app.route('/api/workflow/<workflow:workflow>/page/<int:number>/<img_type>/'
@@ -924,17 +1132,47 @@ def get_page_image(fpath, page, workflow, number, img_type, plugname):
 @inject_page_image
 def get_page_image_thumb(fpath, page, workflow, number, img_type, plugname):
     """ Get thumbnail for a page image. """
-    if fpath.suffix.lower() not in ('.jpg', '.jpeg', '.tif', '.tiff', '.png'):
+    if fpath.suffix.lower() not in TRANSFORMABLE_SUFFIXES:
         raise ApiException("Can not serve thumbnails for files with type {0}"
                            .format(fpath.suffix), 400)
-    cache_key = "{0}.{1}.{2}".format(workflow.id, img_type, fpath.name)
-    thumbnail = None
-    if not request.args:
-        thumbnail = cache.get(cache_key)
-    if thumbnail is None:
-        thumbnail = get_thumbnail(fpath)
-        cache.set(cache_key, thumbnail)
-    return Response(thumbnail, mimetype='image/jpeg')
+    return conditional_response(
+        etag=get_file_etag(workflow, fpath) + '-thumb',
+        last_modified=fpath.stat().st_mtime, mimetype='image/jpeg',
+        get_data=lambda: app.config['image_cache'].get_thumbnail(workflow,
+                                                                 fpath))
+
+
+@app.route('/api/workflow/<workflow:workflow>/page/<int:number>/<img_type>/'
+           'tiles/<int:level>/<int:col>/<int:row>',
+           defaults={'plugname': None})
+@app.route('/api/workflow/<workflow:workflow>/page/<int:number>/<img_type>/'
+           '<plugname>/tiles/<int:level>/<int:col>/<int:row>')
+@inject_page_image
+def get_page_image_tile(fpath, page, workflow, number, img_type, plugname,
+                        level, col, row):
+    """ Get a tile of a page image for deep zooming.
+
+    :param level:   Zoom level, i.e. the index of the image width in
+                    :py:attr:`util.ImageCache.PYRAMID_WIDTHS`, the level after
+                    the last one has the full resolution.
+    :type level:    int
+    :param col:     Column of the tile, tiles are squares with a width of
+                    :py:attr:`util.ImageCache.TILE_SIZE`
+    :type col:      int
+    :param row:     Row of the tile
+    :type row:      int
+
+    :resheader Content-Type:    :mimetype:`image/jpeg`
+    """
+    if fpath.suffix.lower() not in TRANSFORMABLE_SUFFIXES:
+        raise ApiException("Can not serve tiles for files with type {0}"
+                           .format(fpath.suffix), 400)
+    try:
+        tile_path = app.config['image_cache'].get_tile(
+            workflow, fpath, level, col, row)
+    except ValueError as e:
+        raise ApiException(str(e), 404)
+    return send_file(str(tile_path), mimetype='image/jpeg', conditional=True)
 
 
 @app.route('/api/workflow/<workflow:workflow>/page/<int:number>',
@@ -959,16 +1197,16 @@ def crop_workflow_image(workflow, number, img_type, plugname, page):
     top = int(request.args.get('top', 0))
     width = int(request.args.get('width', 0)) or None
     height = int(request.args.get('height', 0)) or None
+    # NOTE: The cropped image will automatically get a new thumbnail, since
+    #       thumbnails are keyed by the stat signature of their source
     workflow.crop_page(page, left, top, width, height, run_async=True)
-    cache_key = "{0}.{1}.{2}".format(workflow.id, 'raw', page.raw_image.name)
-    cache.delete(cache_key)
     return 'OK'
 
 
 @app.route('/api/workflow/<workflow:workflow>/page', methods=['DELETE'])
 def bulk_delete_pages(workflow):
     """ Delete multiple pages from a workflow with one request. """
-    cap_nums = [p['capture_num'] for p in json.loads(request.data)['pages']]
+    cap_nums = {p['capture_num'] for p in json.loads(request.data)['pages']}
     to_delete = [p for p in workflow.pages if p.capture_num in cap_nums]
     logger.debug("Bulk removing from workflow {0}: {1}".format(
         workflow.id, to_delete))
@@ -1048,7 +1286,7 @@ def finish_capture(workflow):
 def start_processing(workflow):
     """ Enqueue the specified workflow for postprocessing. """
     workflow._update_status(step='process', step_progress=None)
-    from tasks import process_workflow
+    from .tasks import process_workflow
     process_workflow(workflow.id, app.config['base_path'])
     return 'OK'
 
@@ -1058,7 +1296,7 @@ def start_processing(workflow):
 def start_output_generation(workflow):
     """ Enqueue the specified workflow for output generation. """
     workflow._update_status(step='output', step_progress=None)
-    from tasks import output_workflow
+    from .tasks import output_workflow
     output_workflow(workflow.id, app.config['base_path'])
     return 'OK'
 
@@ -15,24 +15,24 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import functools
 import itertools
 import json
 import logging
 import os
+import re
+import shutil
 import uuid
-import tarfile
 import tempfile
 import threading
-import time
-import zipfile
-try:
-    import Queue
-except ImportError:
-    # Python 3
-    import queue as Queue
 
 import blinker
+from tornado import gen
+from tornado.concurrent import (Future, future_set_exception_unless_cancelled,
+                                future_set_result_unless_cancelled)
 from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 try:
     from tornado.web import RequestHandler, asynchronous, stream_request_body
 except ImportError:
@@ -45,17 +45,23 @@ except ImportError:
     def asynchronous(method):
         """Compatibility wrapper for Tornado's deprecated asynchronous decorator."""
         return method
+from tornado.web import HTTPError, StaticFileHandler
 from tornado.websocket import WebSocketHandler as TornadoWebSocketHandler
+from tornado.websocket import WebSocketClosedError
 
-try:
-    import util
-except ImportError:
-    from . import util
-from spreads.workflow import Workflow
+from . import util
+import spreads.vendor.bagit as bagit
+from spreads.workflow import Workflow, signals as workflow_signals
+
+logger = logging.getLogger('spreadsplug.web.handlers')
 
 signals = blinker.Namespace()
 on_download_finished = signals.signal('download:finished')
 
+#: Sent to clients that missed events, not part of :py:data:`signals` since
+#: it is never emitted on the server
+on_resync = blinker.NamedSignal('events:resync')
+
 event_buffer = None  # NOTE: Will be set after we defined EventHandler
 
 
@@ -86,79 +92,256 @@ class BoundaryStripper(object):
 
 
 class WebSocketHandler(TornadoWebSocketHandler):
+    """ Pushes events to the connected clients.
+
+    Every client has a bounded queue of outgoing messages that is drained as
+    fast as the client reads them. If a client falls behind by more than
+    :py:attr:`max_queue_size` messages, its queue is dropped and replaced by
+    a resync event that tells it to reload its state.
+    """
     # This is a class attribute valid for all SocketHandler objects, used
     # to store a reference to all open websockets.
     clients = []
-    lock = threading.Lock()
+    max_queue_size = 512
 
     def open(self):
+        self.queue = collections.deque()
+        self.sending = False
         if self not in self.clients:
             self.clients.append(self)
 
     def on_close(self):
         if self in self.clients:
             self.clients.remove(self)
+        self.queue.clear()
+
+    def send_queued(self, data):
+        """ Queue a message for the client and start sending if necessary.
+
+        Must be called from the IOLoop.
+
+        :param data:    Serialized event
+        :type data:     unicode
+        """
+        if len(self.queue) >= self.max_queue_size:
+            logger.warning("Websocket client {0} is too slow, dropping {1} "
+                           "queued events".format(self.request.remote_ip,
+                                                  len(self.queue)))
+            self.queue.clear()
+            data = event_buffer.get_resync_event().to_json()
+        self.queue.append(data)
+        if not self.sending:
+            self._send_queue()
+
+    @gen.coroutine
+    def _send_queue(self):
+        self.sending = True
+        try:
+            while self.queue:
+                while self.queue:
+                    future = self.write_message(self.queue.popleft())
+                # Wait until everything was flushed before writing more, so
+                # messages for slow clients pile up in the bounded queue
+                # instead of the stream's buffer
+                yield future
+        except WebSocketClosedError:
+            self.queue.clear()
+        finally:
+            self.sending = False
 
     @staticmethod
     def send_event(event):
-        data = json.dumps(event, cls=util.CustomJSONEncoder)
+        data = event.to_json()
+        # Can be called from any thread, but messages may only be written
+        # from the IOLoop
+        IOLoop.instance().add_callback(WebSocketHandler.broadcast, data)
+
+    @staticmethod
+    def broadcast(data):
         for client in WebSocketHandler.clients:
-            with WebSocketHandler.lock:
-                client.write_message(data)
+            client.send_queued(data)
 
 
 class EventBuffer(object):
-    def __init__(self):
+    """ Fixed-size ring buffer of the most recently published events.
+
+    Events get monotonically increasing ids, so the position of a cursor
+    (the id of the last event a client received) in the buffer can be
+    calculated instead of searched. Clients whose cursor has fallen off the
+    buffer receive a resync event instead of the events they missed.
+
+    All methods must be called from the IOLoop.
+
+    :param size:    Maximum number of buffered events
+    :type size:     int
+    """
+    def __init__(self, size=200):
         self.waiters = set()
-        self.cache = []
-        self.cache_size = 200
-        self.counter = itertools.count()
-        self.count_lock = threading.Lock()
+        self.cache = collections.deque(maxlen=size)
+        self.next_id = 0
+
+    def get_events_since(self, cursor):
+        """ Get the events that were published after an event.
+
+        :param cursor:  Id of the event
+        :type cursor:   int
+        :returns:       The events or `None` if some of them are no longer
+                        buffered or the cursor is unknown
+        :rtype:         list of :py:class:`util.Event`
+        """
+        num_new = self.next_id - 1 - cursor
+        if not 0 <= num_new <= len(self.cache):
+            return None
+        return list(itertools.islice(reversed(self.cache), num_new))[::-1]
+
+    def get_resync_event(self):
+        """ Create an event that tells a client that it has missed events
+        and needs to reload its state.
+
+        The event has the id of the most recent event, so clients can
+        continue from there.
+
+        :rtype:     :py:class:`util.Event`
+        """
+        return util.Event(on_resync, None, {}, id=self.next_id - 1)
 
     def wait_for_events(self, callback, cursor=None):
-        if cursor:
-            cursor = int(cursor)
-            new_count = 0
-            for event in reversed(self.cache):
-                if event.id == cursor:
-                    break
-                new_count += 1
-            if new_count:
-                callback(self.cache[-new_count:])
+        if cursor is not None:
+            events = self.get_events_since(cursor)
+            if events is None:
+                callback([self.get_resync_event()])
+                return
+            elif events:
+                callback(events)
                 return
         self.waiters.add(callback)
 
     def cancel_wait(self, callback):
-        self.waiters.remove(callback)
+        self.waiters.discard(callback)
 
     def new_events(self, events):
         for event in events:
-            with self.count_lock:
-                event.id = next(self.counter)
-        for callback in self.waiters:
+            event.id = self.next_id
+            self.next_id += 1
+        waiters, self.waiters = self.waiters, set()
+        for callback in waiters:
             try:
                 callback(events)
             except:
                 logging.error("Error in waiter callback", exc_info=True)
-        self.waiters = set()
         self.cache.extend(events)
-        if len(self.cache) > self.cache_size:
-            self.cache = self.cache[-self.cache_size:]
 # Global event buffer (previously defined at the top of the module)
 event_buffer = EventBuffer()
 
 
+class EventCoalescer(object):
+    """ Collects the events emitted within a short window and publishes
+    them to the long-polling and websocket clients in one go.
+
+    Multiple ``workflow:modified`` events of the same workflow are merged
+    into one, combining their page diffs, and every event is serialized only
+    once for all transports. The page diffs are the snapshots that were
+    emitted with the signal, the workflow itself is never accessed from the
+    IOLoop. Clients whose page revision does not match the start of a diff
+    fetch the pages they missed from the ``/page`` endpoint.
+
+    All methods must be called from the IOLoop.
+
+    :param delay:   Length of the window in seconds
+    :type delay:    float
+    """
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.pending = []
+        self._timeout = None
+
+    def add(self, event):
+        """ Queue an event for publication.
+
+        :type event:    :py:class:`util.Event`
+        """
+        if event.signal is workflow_signals['workflow:modified']:
+            for idx, other in enumerate(self.pending):
+                if (other.signal is event.signal and
+                        other.sender is event.sender):
+                    del self.pending[idx]
+                    changes = self._merge_changes(other.data['changes'],
+                                                  event.data['changes'])
+                    event = util.Event(event.signal, event.sender,
+                                       dict(event.data, changes=changes))
+                    break
+        self.pending.append(event)
+        if self._timeout is None:
+            self._timeout = IOLoop.current().call_later(self.delay,
+                                                        self.flush)
+
+    def flush(self):
+        """ Publish all queued events. """
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        events, self.pending = self.pending, []
+        if not events:
+            return
+        event_buffer.new_events(events)
+        for event in events:
+            WebSocketHandler.broadcast(event.to_json())
+
+    @staticmethod
+    def _merge_changes(old_changes, new_changes):
+        """ Merge the changes of two consecutive ``workflow:modified``
+        events, combining their page diffs.
+
+        If the diffs cannot be combined, only the latest one is kept and
+        clients fetch the pages they missed from the ``/page`` endpoint,
+        since it does not start at the revision they know.
+
+        :rtype:     dict
+        """
+        changes = dict(old_changes)
+        changes.update(new_changes)
+        old = old_changes.get('page_diff')
+        new = new_changes.get('page_diff')
+        if old is None or new is None or old['revision'] != new['since']:
+            return changes
+        if new['removed'] is None:
+            # The new diff contains all pages
+            pages, removed = new['pages'], None
+        else:
+            replaced = set(p.capture_num for p in new['pages'])
+            replaced.update(new['removed'])
+            pages = ([p for p in old['pages']
+                      if p.capture_num not in replaced] + new['pages'])
+            if old['removed'] is None:
+                removed = None
+            else:
+                removed = ([n for n in old['removed'] if n not in replaced] +
+                           new['removed'])
+        changes['page_diff'] = {'since': old['since'],
+                                'revision': new['revision'],
+                                'pages': pages, 'removed': removed}
+        return changes
+
+
+event_coalescer = EventCoalescer()
+
+
 class EventLongPollingHandler(RequestHandler):
     @asynchronous
     def post(self):
         cursor = self.get_argument("cursor", None)
+        try:
+            cursor = int(cursor) if cursor else None
+        except ValueError:
+            raise HTTPError(400)
         event_buffer.wait_for_events(self.on_new_events, cursor=cursor)
 
     def on_new_events(self, events):
         if self.request.connection.stream.closed():
             return
-        self.finish(json.dumps(dict(events=events),
-                               cls=util.CustomJSONEncoder))
+        # The events are already serialized, so we only have to join them
+        self.finish('{"events": [%s]}' % ", ".join(e.to_json()
+                                                   for e in events))
 
     def on_connection_close(self):
         event_buffer.cancel_wait(self.on_new_events)
@@ -166,34 +349,188 @@ class EventLongPollingHandler(RequestHandler):
 
 @stream_request_body
 class StreamingUploadHandler(RequestHandler):
-    def initialize(self, base_path):
+    """ Receives a workflow bag as an uncompressed ZIP archive.
+
+    The archive is extracted while it is being received and the workflow is
+    registered as soon as its last entry was written and verified against
+    the bag's manifests. Until then, the bag lives in a hidden staging
+    directory in the workflow directory, so it is not picked up by the
+    :py:class:`spreads.workflow.WorkflowRegistry` before it is complete.
+    """
+    def initialize(self, base_path, executor=None):
         self.base_path = base_path
+        self.executor = executor
 
     def prepare(self):
-        self.stripper = BoundaryStripper()
         self.request.connection.set_max_body_size(2*1024**3)
-        fdesc, self.fname = tempfile.mkstemp()
-        self.fp = os.fdopen(fdesc, 'wb')
+        self.staging_path = tempfile.mkdtemp(prefix='.upload-',
+                                             dir=str(self.base_path))
+        self.extractor = util.ZipStreamExtractor(self.staging_path)
+        self.workflow = None
+        self.error = None
+        # Future of the extractor's work that is running on the executor
+        self.pending = None
+        self.cancelled = False
 
+    @gen.coroutine
     def data_received(self, chunk):
-        # FIXME: When do we need the stripper???
-        # self.fp.write(self.stripper.process(chunk))
-        self.fp.write(chunk)
-        self.fp.flush()
+        if (self.cancelled or self.error is not None
+                or self.workflow is not None):
+            return
+        try:
+            # Tornado does not read more data until we're done
+            self.pending = self.run_blocking(self.extractor.feed, chunk)
+            finished = yield self.pending
+            if finished and not self.cancelled:
+                self.pending = self.run_blocking(self.register_workflow)
+                self.workflow = yield self.pending
+        except (util.ZipStreamError, bagit.BagError) as e:
+            self.error = e
 
-    def post(self):
-        self.fp.close()
-        with zipfile.ZipFile(self.fname) as zf:
-            wfname = os.path.dirname(zf.namelist()[0])
-            zf.extractall(path=self.base_path)
-        os.unlink(self.fname)
+    def run_blocking(self, func, *args):
+        """ Run a function on the executor (or the IOLoop's default executor
+        if none was configured).
+
+        :returns:   Future for the function's return value
+        """
+        return IOLoop.current().run_in_executor(
+            self.executor, functools.partial(func, *args))
 
-        workflow = Workflow(path=os.path.join(self.base_path, wfname))
+    def register_workflow(self):
+        """ Move the extracted bag out of the staging directory and create
+        the workflow from it.
+
+        :rtype:     :py:class:`spreads.workflow.Workflow`
+        """
+        wf_path = os.path.join(str(self.base_path),
+                               self.extractor.bag_name)
+        if os.path.exists(wf_path):
+            raise util.ZipStreamError(
+                "A workflow named '{0}' already exists"
+                .format(self.extractor.bag_name))
+        os.rename(os.path.join(self.staging_path, self.extractor.bag_name),
+                  wf_path)
+        workflow = Workflow(path=wf_path)
+        # Spare the bag from hashing the payload again
+        workflow.bag.hash_cache.update(
+            (relpath, bagit.stat_signature(os.path.join(wf_path, relpath)),
+             checksums)
+            for relpath, checksums in self.extractor.checksums.items()
+            if relpath.startswith('data' + os.sep))
         from spreads.workflow import on_created
         on_created.send(workflow, workflow=workflow)
+        return workflow
 
+    def post(self):
+        if self.error is None and self.workflow is None:
+            self.error = util.ZipStreamError("Upload is incomplete")
+        if self.error is not None:
+            self.set_status(400)
+            self.set_header('Content-Type', 'application/json')
+            self.write(json.dumps({'message': str(self.error)}))
+            return
         self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(workflow, cls=util.CustomJSONEncoder))
+        self.write(json.dumps(self.workflow, cls=util.CustomJSONEncoder))
+
+    def on_finish(self):
+        self.cleanup()
+
+    def on_connection_close(self):
+        self.cleanup()
+
+    def cleanup(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.pending is not None and not self.pending.done():
+            # The extractor is still busy on the executor, so we remove its
+            # files once it is done
+            self.pending.add_done_callback(
+                lambda future: self.remove_staging())
+        else:
+            self.remove_staging()
+
+    def remove_staging(self):
+        self.extractor.close()
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+
+@stream_request_body
+class SyncFileHandler(RequestHandler):
+    """ Receives a chunk of a file for a :py:class:`util.SyncSession`.
+
+    Chunks are sent with ``PUT`` and a ``Content-Range: bytes
+    <first>-<last>/<size>`` header, one after the other for a given file.
+    If the chunk does not continue the data received so far (e.g. because a
+    previous request was interrupted), the response has status code 409 and
+    the offset to continue at.
+    """
+    RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    def initialize(self, base_path, executor=None):
+        self.base_path = base_path
+        self.executor = executor
+        self.fp = None
+
+    def run_blocking(self, func, *args):
+        """ Run a function on the executor (or the IOLoop's default executor
+        if none was configured).
+
+        :returns:   Future for the function's return value
+        """
+        return IOLoop.current().run_in_executor(
+            self.executor, functools.partial(func, *args))
+
+    @gen.coroutine
+    def prepare(self):
+        if self.request.method != 'PUT':
+            raise HTTPError(405)
+        match = self.RANGE_PATTERN.match(
+            self.request.headers.get('Content-Range', ''))
+        if not match:
+            raise HTTPError(400, reason="Missing or invalid Content-Range")
+        first, last, size = (int(x) for x in match.groups())
+        self.request.connection.set_max_body_size(last - first + 1)
+        workflow_id, relpath = self.path_args
+        try:
+            self.session = util.SyncSession(self.base_path, workflow_id)
+            self.fp = yield self.run_blocking(self.session.open_part,
+                                              relpath, first, size)
+        except util.SyncError as e:
+            self.send_sync_error(e)
+
+    @gen.coroutine
+    def data_received(self, chunk):
+        if self.fp is not None:
+            yield self.run_blocking(self.fp.write, chunk)
+
+    @gen.coroutine
+    def put(self, workflow_id, relpath):
+        self.close_part()
+        try:
+            received = yield self.run_blocking(self.session.finish_part,
+                                               relpath)
+        except util.SyncError as e:
+            self.send_sync_error(e)
+            return
+        self.write({'received': received})
+
+    def send_sync_error(self, error):
+        self.close_part()
+        self.set_status(409 if error.offset is not None else 400)
+        self.finish({'type': 'sync', 'message': str(error),
+                     'payload': {'offset': error.offset}})
+
+    def close_part(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def on_finish(self):
+        self.close_part()
+
+    def on_connection_close(self):
+        self.close_part()
 
 
 class ZipDownloadHandler(RequestHandler):
@@ -209,7 +546,7 @@ class ZipDownloadHandler(RequestHandler):
         self.set_status(200)
         self.set_header('Content-type', 'application/zip')
         self.set_header('Content-length',
-                        str(util.calculate_zipsize(zstream.paths_to_write)))
+                        str(workflow.bag.get_archive_layout().zip_size))
 
         self.zstream_iter = iter(zstream)
 
@@ -224,91 +561,462 @@ class ZipDownloadHandler(RequestHandler):
         on_download_finished.send()
 
 
-class QueueIO(object):
-    """ File-like object that writes to a queue.
+def get_page_image_path(workflow, number, img_type, plugname):
+    """ Get the path of a page image as addressed in the REST API, see
+    :py:func:`spreadsplug.web.endpoints.inject_page_image`.
+
+    :returns:   Path to the image or `None` if it does not exist
+    :rtype:     :py:class:`pathlib.Path`
+    """
+    page = workflow.pages.get_by_capture_num(int(number))
+    if page is None:
+        return None
+    if img_type == 'raw':
+        return page.raw_image
+    elif plugname is None:
+        return page.get_latest_processed(image_only=True)
+    else:
+        return page.processed_images.get(plugname)
+
+
+class ApiHandlerMixin(object):
+    """ Common functionality for native implementations of REST API routes.
+
+    Unlike the WSGI endpoints in :py:mod:`spreadsplug.web.endpoints`, these
+    run on the IOLoop, so any blocking work has to be done through
+    :py:meth:`run_blocking` in order not to stall all other clients.
+    Requests that a handler can not answer (by default anything but `GET`
+    and `HEAD`, see :py:meth:`needs_fallback`) are passed on to the
+    `fallback` WSGI container.
+    """
+    def initialize(self, base_path, fallback, executor, **kwargs):
+        super(ApiHandlerMixin, self).initialize(**kwargs)
+        self.base_path = base_path
+        self.fallback = fallback
+        self.executor = executor
+
+    def needs_fallback(self):
+        return self.request.method not in ('GET', 'HEAD')
+
+    def prepare(self):
+        if self.needs_fallback():
+            # Same as tornado.web.FallbackHandler
+            self.fallback(self.request)
+            self._finished = True
+            self.on_finish()
+
+    def run_blocking(self, func, *args, **kwargs):
+        """ Run a function on the executor.
+
+        :returns:   Future for the function's return value
+        """
+        return IOLoop.current().run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    @gen.coroutine
+    def find_workflow(self, ident):
+        """ Find a workflow by its UUID or slug, responding with `404 Not
+        Found` if there is none.
+
+        :rtype:     :py:class:`spreads.workflow.Workflow`
+        """
+        workflow = yield self.run_blocking(util.find_workflow, self.base_path,
+                                           ident)
+        if workflow is None:
+            raise HTTPError(404)
+        raise gen.Return(workflow)
+
+    @gen.coroutine
+    def transform_image(self, func, *args):
+        """ Like :py:meth:`run_blocking`, but for functions that transform
+        images with the :py:class:`util.ImageProcessor`, responding with
+        `503 Service Unavailable` if it is busy.
+        """
+        try:
+            result = yield self.run_blocking(func, *args)
+        except util.ImageProcessorBusy as e:
+            raise HTTPError(503, reason=str(e))
+        raise gen.Return(result)
+
+    def write_error(self, status_code, **kwargs):
+        # Same format as the errors from the WSGI endpoints
+        if status_code == 503:
+            self.set_header('Retry-After', '1')
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({'type': 'general', 'payload': None,
+                                'message': self._reason}))
+
+
+class ApiHandler(ApiHandlerMixin, RequestHandler):
+    """ Base class for native handlers of JSON API routes. """
+    @gen.coroutine
+    def write_json(self, obj):
+        """ Serialize an object on the executor and finish the response with
+        it.
+
+        Clients that send the ETag of an unchanged response in
+        `If-None-Match` get a `304 Not Modified` response (see
+        :py:meth:`tornado.web.RequestHandler.finish`).
+        """
+        data = yield self.run_blocking(json.dumps, obj,
+                                       cls=util.CustomJSONEncoder)
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-cache')
+        self.finish(data)
+
+
+class WorkflowListHandler(ApiHandler):
+    """ See :py:func:`spreadsplug.web.endpoints.list_workflows`. """
+    def list_workflows(self, summary):
+        workflows = list(Workflow.find_all(self.base_path).values())
+        if summary:
+            workflows = [util.get_workflow_summary(wf) for wf in workflows]
+        return workflows
+
+    @gen.coroutine
+    def get(self):
+        workflows = yield self.run_blocking(
+            self.list_workflows, bool(self.get_argument('summary', None)))
+        yield self.write_json(workflows)
+
+
+class WorkflowHandler(ApiHandler):
+    """ See :py:func:`spreadsplug.web.endpoints.get_workflow`. """
+    @gen.coroutine
+    def get(self, workflow_id):
+        workflow = yield self.find_workflow(workflow_id)
+        yield self.write_json(workflow)
+
+
+class PageListHandler(ApiHandler):
+    """ See :py:func:`spreadsplug.web.endpoints.get_all_pages`. """
+    @gen.coroutine
+    def get(self, workflow_id):
+        workflow = yield self.find_workflow(workflow_id)
+        try:
+            listing = yield self.run_blocking(
+                util.get_page_listing, workflow,
+                *(self.get_argument(k, None)
+                  for k in ('offset', 'limit', 'fields', 'since')))
+        except ValueError as e:
+            raise HTTPError(400, reason=str(e))
+        yield self.write_json(listing)
+
+
+class PageThumbnailHandler(ApiHandler):
+    """ See :py:func:`spreadsplug.web.endpoints.get_page_image_thumb`. """
+    def initialize(self, image_cache, **kwargs):
+        super(PageThumbnailHandler, self).initialize(**kwargs)
+        self.image_cache = image_cache
+
+    @gen.coroutine
+    def get(self, workflow_id, number, img_type, plugname):
+        workflow = yield self.find_workflow(workflow_id)
+        fpath = yield self.run_blocking(get_page_image_path, workflow, number,
+                                        img_type, plugname)
+        if fpath is None:
+            raise HTTPError(404)
+        if fpath.suffix.lower() not in util.TRANSFORMABLE_SUFFIXES:
+            raise HTTPError(400, reason="Can not serve thumbnails for files "
+                                        "with type {0}".format(fpath.suffix))
+        etag = yield self.run_blocking(util.get_file_etag, workflow, fpath)
+        self.set_header('Etag', '"{0}-thumb"'.format(etag))
+        self.set_header('Cache-Control', 'no-cache')
+        if self.check_etag_header():
+            # Don't even load the thumbnail if the client's copy is current
+            self.set_status(304)
+            self.finish()
+            return
+        thumbnail = yield self.transform_image(self.image_cache.get_thumbnail,
+                                               workflow, fpath)
+        self.set_header('Content-Type', 'image/jpeg')
+        self.finish(thumbnail)
+
+
+class ResultPullHandler(ApiHandlerMixin, RequestHandler):
+    """ Streams the results of postprocessing and output generation of a
+    workflow that a client does not have yet, see
+    :py:func:`util.iter_result_archive`.
+
+    The request body is a JSON object with the checksums of the client's
+    result files in ``files`` and the ``algorithm`` they were calculated
+    with.
+    """
+    def needs_fallback(self):
+        return self.request.method != 'POST'
+
+    @gen.coroutine
+    def post(self, workflow_id):
+        try:
+            data = json.loads(self.request.body.decode('utf-8'))
+            known_files = data['files']
+            algorithm = data.get('algorithm', 'md5')
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(400, reason="Invalid list of files")
+        if (not isinstance(known_files, dict) or
+                algorithm not in bagit.HASH_ALGORITHMS):
+            raise HTTPError(400, reason="Invalid list of files")
+        workflow = yield self.find_workflow(workflow_id)
+        chunks = util.iter_result_archive(workflow, known_files, algorithm)
+        self.set_header('Content-Type', 'application/x-tar')
+        try:
+            while True:
+                chunk = yield self.run_blocking(next, chunks, None)
+                if chunk is None:
+                    break
+                self.write(chunk)
+                yield self.flush()
+        except StreamClosedError:
+            logger.debug("Client closed connection while pulling results")
+            return
+        finally:
+            chunks.close()
+        self.finish()
+
+
+class WorkflowFileHandler(ApiHandlerMixin, StaticFileHandler):
+    """ Serves files from a workflow directly from Tornado.
+
+    Unlike sending them from the WSGI application, where the whole response
+    passes through :py:class:`tornado.wsgi.WSGIContainer`, files are streamed
+    in chunks without blocking a thread. This handler also supports range
+    requests, so interrupted downloads of large files can be resumed, and
+    conditional requests with the same ETags as the WSGI endpoints.
+    """
+    def initialize(self, **kwargs):
+        super(WorkflowFileHandler, self).initialize(
+            path=str(kwargs['base_path']), **kwargs)
+
+    def get_workflow_file(self, workflow, *args):
+        """ Get the path of the requested file, called on the executor.
+
+        :param workflow:    Workflow identified by the request URL
+        :type workflow:     :py:class:`spreads.workflow.Workflow`
+        :param args:        Remaining arguments from the request URL
+        :returns:           Path to the file or `None` if it does not exist
+        :rtype:             :py:class:`pathlib.Path`
+        """
+        raise NotImplementedError
+
+    @gen.coroutine
+    def get(self, workflow_id, *args, **kwargs):
+        self.workflow = yield self.find_workflow(workflow_id)
+        fpath = yield self.run_blocking(self.get_workflow_file,
+                                        self.workflow, *args)
+        if fpath is None:
+            raise HTTPError(404)
+        yield self.send_file(fpath, kwargs.get('include_body', True))
+
+    def head(self, workflow_id, *args):
+        return self.get(workflow_id, *args, include_body=False)
+
+    @gen.coroutine
+    def send_file(self, fpath, include_body=True):
+        # Looking up the checksum may load the workflow's bag and query its
+        # hash cache, so it is done on the executor rather than in
+        # `compute_etag`
+        try:
+            self.etag = yield self.run_blocking(util.get_file_etag,
+                                                self.workflow, fpath)
+        except OSError:
+            # Answered with `404 Not Found` below
+            self.etag = None
+        self.root = str(fpath.parent)
+        yield super(WorkflowFileHandler, self).get(
+            fpath.name, include_body=include_body)
+
+    def compute_etag(self):
+        # The default implementation hashes the whole file
+        if self.etag is not None:
+            return '"{0}"'.format(self.etag)
+
+    def set_extra_headers(self, path):
+        self.set_header('Cache-Control', 'no-cache')
+
+
+class OutputFileHandler(WorkflowFileHandler):
+    """ See :py:func:`spreadsplug.web.endpoints.get_output_file`. """
+    def get_workflow_file(self, workflow, fname):
+        return next((fp for fp in workflow.out_files if fp.name == fname),
+                    None)
+
+
+class PageImageHandler(WorkflowFileHandler):
+    """ See :py:func:`spreadsplug.web.endpoints.get_page_image`.
+
+    Scaled and converted images are served from the `image_cache`.
+    """
+    def initialize(self, image_cache, **kwargs):
+        super(PageImageHandler, self).initialize(**kwargs)
+        self.image_cache = image_cache
+
+    def get_workflow_file(self, workflow, number, img_type, plugname):
+        return get_page_image_path(workflow, number, img_type, plugname)
+
+    @gen.coroutine
+    def send_file(self, fpath, include_body=True):
+        try:
+            width, img_format, quality = util.parse_transform_args(
+                fpath, self.get_argument('width', None),
+                self.get_argument('format', None),
+                self.get_argument('quality', None))
+        except ValueError as e:
+            raise HTTPError(400, reason=str(e))
+        if img_format is not None:
+            fpath = yield self.transform_image(
+                self.image_cache.get_transformed, self.workflow, fpath,
+                width, img_format, quality)
+        yield super(PageImageHandler, self).send_file(fpath, include_body)
+
+
+class PipeClosedError(ValueError):
+    """ Raised when writing to an :py:class:`AsyncPipe` whose reading end
+    was closed.
+    """
+
+
+class AsyncPipe(object):
+    """ File-like object that passes data written to it from another thread
+    to a reader on the IOLoop.
 
-    Data can be read from another thread by iterating over the object.
     Intended to be passed into tarfile.open as to allow streaming tar files
     over the network without buffering them in RAM or on disk.
+    Small writes are aggregated into chunks of `chunk_size` bytes and at
+    most `max_chunks` chunks are buffered, writers block until the reader
+    has caught up.
+
+    :param chunk_size:  Size of the chunks that are passed to the reader
+    :type chunk_size:   int
+    :param max_chunks:  Number of chunks that are buffered
+    :type max_chunks:   int
     """
-    def __init__(self, handler):
-        # That's right, length 1, we want to save memory, after all...
-        self.queue = Queue.Queue(maxsize=1)
+    def __init__(self, chunk_size=1024**2, max_chunks=4):
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
         self.closed = False
-        self.last_read = None
-        self.read_time = None
+        self.io_loop = IOLoop.current()
+        self._buffer = bytearray()
+        self._chunks = collections.deque()
+        self._condition = threading.Condition()
+        self._eof = False
+        self._error = None
+        self._waiter = None
 
     def write(self, data):
-        while not self.closed:
-            # To achieve a balance between wasted CPU cycles (checking the
-            # queue) and decreased transfer speed (sleeping for too long),
-            # we wait at most the minimum time (plus a little extra) between
-            # two reads (see also: comment in `next`)
-            try:
-                self.queue.put(data, block=False)
-                return
-            except Queue.Full:
-                if self.read_time is not None:
-                    time.sleep(self.read_time*1.1)
-        raise ValueError("I/O operation on closed file")
+        """ Write data to the pipe, blocking while its buffer is full.
 
-    def close(self):
-        self.closed = True
+        :raises PipeClosedError:    If the reader closed the pipe
+        """
+        if self.closed:
+            raise PipeClosedError("I/O operation on closed pipe")
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.chunk_size:
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            self._put(chunk)
+        return len(data)
+
+    def flush(self):
+        pass
 
-    def __iter__(self):
-        return self
+    def _put(self, chunk):
+        with self._condition:
+            while (len(self._chunks) >= self.max_chunks and
+                   not self.closed):
+                self._condition.wait()
+            if self.closed:
+                raise PipeClosedError("I/O operation on closed pipe")
+            if self._waiter is not None:
+                # The reader is already waiting, hand the chunk over directly
+                self._resolve(chunk)
+            else:
+                self._chunks.append(chunk)
 
-    def next(self):
-        if self.closed and self.queue.empty():
-            raise StopIteration
-        if self.last_read is None:
-            self.last_read = time.time()
+    def _resolve(self, value=None, error=None):
+        waiter, self._waiter = self._waiter, None
+        if error is None:
+            self.io_loop.add_callback(future_set_result_unless_cancelled,
+                                      waiter, value)
         else:
-            # See if we have gotten any faster since the last read
-            read_time = time.time() - self.last_read
-            if self.read_time is None or self.read_time > read_time:
-                self.read_time = read_time
-            self.last_read += read_time
-        return self.queue.get()
+            self.io_loop.add_callback(future_set_exception_unless_cancelled,
+                                      waiter, error)
+
+    def finish(self, error=None):
+        """ Signal the reader that all data was written, or that writing
+        failed with `error`, which is then raised from :py:meth:`read`.
+        """
+        with self._condition:
+            if error is None and self._buffer and not self.closed:
+                # Never wait for the reader here, the remainder is smaller
+                # than a chunk anyway
+                if self._waiter is not None:
+                    self._resolve(bytes(self._buffer))
+                else:
+                    self._chunks.append(bytes(self._buffer))
+            del self._buffer[:]
+            self._eof = True
+            self._error = error
+            if self._waiter is not None:
+                self._resolve(error=error)
+
+    def read(self):
+        """ Read the next chunk, must be called from the IOLoop.
+
+        :returns:   Future for the chunk, or `None` once all data was read
+                    or the pipe was closed
+        """
+        future = Future()
+        with self._condition:
+            if self._chunks:
+                future.set_result(self._chunks.popleft())
+                self._condition.notify()
+            elif self._error is not None:
+                future.set_exception(self._error)
+            elif self._eof or self.closed:
+                future.set_result(None)
+            else:
+                self._waiter = future
+        return future
+
+    def close(self):
+        """ Close the reading end, writers will fail from now on. """
+        with self._condition:
+            self.closed = True
+            self._chunks.clear()
+            self._condition.notify_all()
+            if self._waiter is not None:
+                self._resolve()
 
 
 class TarDownloadHandler(RequestHandler):
     def initialize(self, base_path):
         self.base_path = base_path
+        self.pipe = None
 
-    def create_tar(self, workflow, cb, exception_cb):
+    def create_tar(self, workflow):
         """ Intended to be run in a separate thread, since the call will block
         until the whole workflow has been written out to the client or
         the user cancels the transfer.
         """
         try:
-            workflow.bag.package_as_tarstream(self.fp)
-            IOLoop.instance().add_callback(cb)
-        except ValueError as e:
-            IOLoop.instance().add_callback(exception_cb, (e,))
+            workflow.bag.package_as_tarstream(self.pipe)
+        except PipeClosedError:
+            # The client went away
+            self.pipe.finish()
+        except Exception as e:
+            logger.error("Could not create tar archive", exc_info=True)
+            self.pipe.finish(e)
+        else:
+            self.pipe.finish()
 
     def calculate_tarsize(self, workflow):
-        """ Similar to :py:func:`util.calculate_zipsize`, we can safely
-        pre-calculate the size of the resulting tar-file since we don't
-        compress and the resulting file is in the POSIX.1-1988 ustar format.
+        """ We can safely pre-calculate the size of the resulting tar-file
+        since we don't compress and the resulting file is in the GNU tar
+        format, see :py:class:`spreads.vendor.bagit.ArchiveLayout`.
         """
-        # top-level directory block
-        size = tarfile.BLOCKSIZE
-        for path in workflow.path.glob('**/*'):
-            # file header
-            size += tarfile.BLOCKSIZE
-            # file size rounded up to next multiple of 512
-            if not path.is_dir():
-                size += ((path.stat().st_size/512)+1)*512
-        # empty end-of-file blocks
-        size += 2*tarfile.BLOCKSIZE
-        # fill up until the size is a multiple of tarfile.RECORDSIZE
-        blocks, remainder = divmod(size, tarfile.RECORDSIZE)
-        if remainder > 0:
-            size += (tarfile.RECORDSIZE - remainder)
-        return size
+        return workflow.bag.get_archive_layout().tar_size
 
-    @asynchronous
+    @gen.coroutine
     def get(self, workflow_id, filename):
         uuid.UUID(workflow_id)
         workflow = Workflow.find_by_id(self.base_path, workflow_id)
@@ -317,32 +1025,27 @@ class TarDownloadHandler(RequestHandler):
         self.set_header('Content-type', 'application/tar')
         self.set_header('Content-length', self.calculate_tarsize(workflow))
 
-        self.fp = QueueIO(self)
-        self.thread = threading.Thread(
-            target=self.create_tar,
-            args=(workflow, self.on_done, self.on_exception)
-        )
-        self.thread.start()
-        self.send_next_chunk()
-
-    def send_next_chunk(self):
+        self.pipe = AsyncPipe()
+        thread = threading.Thread(target=self.create_tar, args=(workflow,))
+        thread.daemon = True
+        thread.start()
         try:
-            self.write(next(self.fp))
-            self.flush(callback=self.send_next_chunk)
-        except StopIteration:
+            while True:
+                chunk = yield self.pipe.read()
+                if chunk is None:
+                    break
+                self.write(chunk)
+                yield self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self.pipe.close()
+        if not self.request.connection.stream.closed():
             self.finish()
 
-    def on_done(self):
-        self.fp.close()
-
-    def on_exception(self, exc):
-        skip = (isinstance(exc[0], ValueError) and
-                "closed file" in exc[0].message)
-        if not skip:
-            raise exc
-
     def on_finish(self):
         on_download_finished.send()
 
     def on_connection_close(self):
-        self.fp.close()
+        if self.pipe is not None:
+            self.pipe.close()
@@ -16,17 +16,29 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import json
 import logging
+import os
 import shutil
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from urllib import quote
+except ImportError:
+    # Python 3
+    from urllib.parse import quote
 
 import blinker
 import requests
 from pathlib import Path
 
 import spreads.util as util
-from spreads.workflow import Workflow
+import spreads.vendor.bagit as bagit
+from spreads.workflow import Workflow, on_modified
+from .util import SyncError, get_result_files, merge_result_archive
 from .app import task_queue
-from .util import GeneratorIO, calculate_zipsize
 
 IS_WIN = util.is_os('windows')
 if IS_WIN:
@@ -43,6 +55,16 @@ on_submit_started = signals.signal('submit:started')
 on_submit_progressed = signals.signal('submit:progressed')
 on_submit_completed = signals.signal('submit:completed')
 on_submit_error = signals.signal('submit:error')
+on_pull_started = signals.signal('pull:started')
+on_pull_completed = signals.signal('pull:completed')
+on_pull_error = signals.signal('pull:error')
+
+#: Size of the chunks that files are uploaded in when submitting a workflow
+SYNC_CHUNK_SIZE = 4*1024**2
+#: Number of files that are uploaded in parallel
+SYNC_NUM_WORKERS = 4
+#: Number of times the upload of a chunk is retried
+SYNC_MAX_RETRIES = 5
 
 
 @task_queue.task()
@@ -92,15 +114,123 @@ def transfer_to_stick(wf_id, base_path):
         workflow.status['step'] = None
 
 
+def get_sync_manifest(workflow, algorithm=None):
+    """ Get the checksums and sizes of all files in a workflow's bag, as
+    expected by :py:meth:`spreadsplug.web.util.SyncSession.start`.
+
+    :param workflow:    Workflow to get the files of
+    :type workflow:     :py:class:`spreads.workflow.Workflow`
+    :param algorithm:   Checksum algorithm, defaults to the first one of
+                        the bag's manifests
+    :type algorithm:    unicode
+    :returns:           ``checksum`` and ``size`` of the files by their path
+                        relative to the bag
+    :rtype:             dict
+    """
+    bag = workflow.bag
+    algorithm = algorithm or bag.algorithms[0]
+    # Files that were not modified after their manifest was written still
+    # have the checksum that is recorded in it, so they don't have to be
+    # read even if the hash cache is cold (e.g. after the bag was received)
+    manifests = []
+    for fname, manifest_files in (('manifest', bag.manifest_files),
+                                  ('tagmanifest', bag.tagmanifest_files)):
+        manifest_path = os.path.join(bag.path, '{0}-{1}.txt'
+                                     .format(fname, algorithm))
+        if algorithm in manifest_files and os.path.exists(manifest_path):
+            manifests.append((manifest_files[algorithm],
+                              os.stat(manifest_path).st_mtime_ns))
+    files = {}
+    cache_entries = []
+    for fpath in bagit.iterdir(bag.path):
+        if bagit._is_hash_cache(os.path.basename(fpath)):
+            continue
+        relpath = os.path.relpath(fpath, bag.path)
+        stat = os.stat(fpath)
+        checksum = next((manifest[relpath] for manifest, mtime in manifests
+                         if relpath in manifest and stat.st_mtime_ns < mtime),
+                        None)
+        if checksum is None:
+            checksum = bag.get_cached_checksum(fpath, algorithm)
+            if checksum is None:
+                _, checksums, _ = bagit.hash_file(fpath, [algorithm])
+                checksum = checksums[algorithm]
+                cache_entries.append((relpath, bagit.stat_signature(fpath),
+                                      checksums))
+        files[relpath.replace(os.sep, '/')] = {'checksum': checksum,
+                                               'size': stat.st_size}
+    bag.hash_cache.update(cache_entries)
+    return files
+
+
+def upload_file(url, fpath, offset, size, on_progress=None):
+    """ Upload a file in chunks, starting at a given offset.
+
+    Network errors are retried and the upload is continued at the offset
+    reported by the server if it did not receive a chunk completely.
+
+    :param url:         URL to ``PUT`` the chunks to
+    :type url:          unicode
+    :param fpath:       Path of the file
+    :type fpath:        unicode
+    :param offset:      Number of bytes the server already received
+    :type offset:       int
+    :param size:        Size of the file
+    :type size:         int
+    :param on_progress: Callback that is called with the number of bytes of
+                        every chunk that was uploaded
+    :type on_progress:  callable
+    """
+    retries = 0
+    with open(fpath, 'rb') as fp:
+        while True:
+            fp.seek(offset)
+            chunk = fp.read(SYNC_CHUNK_SIZE)
+            content_range = "bytes {0}-{1}/{2}".format(
+                offset, max(offset + len(chunk) - 1, 0), size)
+            try:
+                resp = requests.put(url, data=chunk, timeout=60,
+                                    headers={'Content-Range': content_range})
+                if resp.status_code != 409:
+                    resp.raise_for_status()
+            except requests.RequestException:
+                retries += 1
+                if retries > SYNC_MAX_RETRIES:
+                    raise
+                logger.warning("Uploading {0} failed, retrying".format(fpath),
+                               exc_info=True)
+                time.sleep(0.5 * 2**retries)
+                continue
+            if resp.status_code == 409:
+                # The server received less (or more) than we expected
+                retries += 1
+                if retries > SYNC_MAX_RETRIES:
+                    resp.raise_for_status()
+                offset = resp.json()['payload']['offset']
+            else:
+                retries = 0
+                offset += len(chunk)
+                if on_progress:
+                    on_progress(len(chunk))
+            if offset >= size:
+                return
+
+
 @task_queue.task()
-def upload_workflow(wf_id, base_path, endpoint, user_config,
+def upload_workflow(wf_id, base_path, server_url, user_config,
                     start_process=False, start_output=False):
+    """ Transfer a workflow to a postprocessing server.
+
+    Only the files that the server does not have yet are uploaded, in
+    parallel and in chunks, see :py:class:`spreadsplug.web.util.SyncSession`.
+    Interrupted uploads are resumed when the workflow is submitted again.
+    """
     logger.debug("Uploading workflow to postprocessing server")
 
     workflow = Workflow.find_by_id(base_path, wf_id)
     # NOTE: This is kind of nasty.... We temporarily write the user-supplied
-    # configuration to the bag, update the tag-payload, create the zip, and
-    # once everything is done, we restore the old version
+    # configuration to the bag, update the tag-payload, transfer the bag,
+    # and once everything is done, we restore the old version
     tmp_cfg = copy.deepcopy(workflow.config)
     tmp_cfg.set(user_config)
     tmp_cfg_path = workflow.path/'config.yml'
@@ -108,52 +238,99 @@ def upload_workflow(wf_id, base_path, endpoint, user_config,
                  sections=(user_config['plugins'] + ["plugins", "device"]))
     workflow.bag.add_tagfiles(str(tmp_cfg_path))
 
-    # Create a zipstream from the workflow-bag
-    zstream = workflow.bag.package_as_zipstream(compression=None)
-    zsize = calculate_zipsize(zstream.paths_to_write)
-
-    def zstream_wrapper():
-        """ Wrapper around our zstream so we can emit a signal when all data
-        has been streamed to the client.
-        """
-        transferred = 0
-        progress = "0.00"
-        for data in zstream:
-            yield data
-            transferred += len(data)
-            # Only update progress if we've progress at least by 0.01
-            new_progress = "{0:.2f}".format(transferred/zsize)
-            if new_progress != progress:
-                progress = new_progress
-                signals['submit:progressed'].send(
-                    workflow, progress=float(progress),
-                    status="Uploading workflow...")
-
-    # NOTE: This is neccessary since requests makes a chunked upload when
-    #       passed a plain generator, which is not supported by the WSGI
-    #       protocol that receives it. Hence we wrap it inside of a
-    #       GeneratorIO to make it appear as a file-like object with a
-    #       known size.
-    zstream_fp = GeneratorIO(zstream_wrapper(), zsize)
-    logger.debug("Projected size for upload: {}".format(zsize))
+    sync_url = server_url + '/api/sync/{0}'.format(workflow.id)
     signals['submit:started'].send(workflow)
-    resp = requests.post(endpoint, data=zstream_fp,
-                         headers={'Content-Type': 'application/zip'})
-    if not resp:
-        error_msg = "Upload failed: {0}".format(resp.content)
+    try:
+        algorithm = workflow.bag.algorithms[0]
+        files = get_sync_manifest(workflow, algorithm)
+        resp = requests.post(sync_url, data=json.dumps({
+            'name': workflow.path.name, 'algorithm': algorithm,
+            'files': files}))
+        resp.raise_for_status()
+        missing = resp.json()['missing']
+        total = sum(files[p]['size'] - offset
+                    for p, offset in missing.items()) or 1
+        logger.debug("Uploading {0} of {1} files ({2} bytes)"
+                     .format(len(missing), len(files), total))
+        progress = {'transferred': 0, 'reported': "0.00"}
+        progress_lock = threading.Lock()
+
+        def on_progress(num_bytes):
+            with progress_lock:
+                progress['transferred'] += num_bytes
+                # Only update progress if we've progress at least by 0.01
+                new_progress = "{0:.2f}".format(
+                    progress['transferred']/total)
+                if new_progress == progress['reported']:
+                    return
+                progress['reported'] = new_progress
+            signals['submit:progressed'].send(
+                workflow, progress=float(new_progress),
+                status="Uploading workflow...")
+
+        with ThreadPoolExecutor(SYNC_NUM_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    upload_file,
+                    sync_url + '/files/' + quote(relpath),
+                    str(workflow.path/relpath), offset,
+                    files[relpath]['size'], on_progress)
+                for relpath, offset in missing.items()]
+            for future in futures:
+                future.result()
+        resp = requests.post(sync_url + '/commit')
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        content = e.response.content if e.response is not None else None
+        error_msg = "Upload failed: {0}".format(content or e)
         signals['submit:error'].send(workflow, message=error_msg,
-                                     data=resp.content)
+                                     data=content)
         logger.error(error_msg)
     else:
         wfid = resp.json()['id']
         if start_process:
-            requests.post(endpoint + "/{0}/process".format(wfid))
+            requests.post(server_url +
+                          '/api/workflow/{0}/process'.format(wfid))
         if start_output:
-            requests.post(endpoint + "/{0}/output".format(wfid))
+            requests.post(server_url +
+                          '/api/workflow/{0}/output'.format(wfid))
         signals['submit:completed'].send(workflow, remote_id=wfid)
+    finally:
+        # Restore our old configuration
+        workflow._save_config()
+
 
-    # Restore our old configuration
-    workflow._save_config()
+@task_queue.task()
+def pull_results(wf_id, base_path, server_url):
+    """ Fetch the results of postprocessing and output generation of a
+    submitted workflow from a postprocessing server.
+
+    Only the files that are new or differ from the local ones are
+    transferred, see :py:func:`spreadsplug.web.util.iter_result_archive`.
+    """
+    workflow = Workflow.find_by_id(base_path, wf_id)
+    signals['pull:started'].send(workflow)
+    try:
+        algorithm = workflow.bag.algorithms[0]
+        resp = requests.post(
+            server_url + '/api/workflow/{0}/results'.format(workflow.id),
+            data=json.dumps({'algorithm': algorithm,
+                             'files': get_result_files(workflow, algorithm)}),
+            stream=True)
+        resp.raise_for_status()
+        # Undo any content encoding, since tarfile reads from the raw stream
+        resp.raw.decode_content = True
+        received, removed = merge_result_archive(workflow, resp.raw)
+    except (requests.RequestException, SyncError, tarfile.TarError) as e:
+        error_msg = "Fetching results failed: {0}".format(e)
+        signals['pull:error'].send(workflow, message=error_msg)
+        logger.error(error_msg)
+        return
+    logger.debug("Received {0} and removed {1} result files"
+                 .format(len(received), len(removed)))
+    on_modified.send(workflow, changes={'out_files': workflow.out_files})
+    signals['pull:completed'].send(workflow, received=received,
+                                   removed=removed)
 
 
 @task_queue.task()
@@ -15,12 +15,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import functools
+import hashlib
+import json
 import logging
 import mimetypes
+import multiprocessing
 import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
 import time
 import traceback
 import uuid
+import zlib
+from collections import OrderedDict
 from datetime import datetime
 from io import BufferedIOBase, UnsupportedOperation
 
@@ -30,7 +41,6 @@ try:
 except ImportError:
     # Flask 2.2+ moved JSONEncoder
     from flask.json.provider import DefaultJSONProvider
-    import json
     
     class JSONEncoder(json.JSONEncoder):
         """Compatibility wrapper for Flask's JSONEncoder."""
@@ -39,6 +49,8 @@ from pathlib import Path
 from wand.image import Image
 from werkzeug.routing import BaseConverter
 
+import concurrent.futures as concfut
+import spreads.vendor.bagit as bagit
 from spreads.workflow import Workflow, signals as workflow_signals
 from spreads.util import EventHandler
 
@@ -62,13 +74,26 @@ class Event(object):
     :param sender:      The object that emitted the signal or None
     :param dict data:   Parameters the signal was emitted with
     """
-    __slots__ = ['signal', 'sender', 'data', 'id']
+    __slots__ = ['signal', 'sender', 'data', 'id', '_json']
 
     def __init__(self, signal, sender, data, id=None):
         self.signal = signal
         self.sender = sender
         self.data = data
         self.id = id
+        self._json = None
+
+    def to_json(self):
+        """ Serialize the event to JSON.
+
+        The serialization is only done once and shared by all transports, so
+        the event must not be modified afterwards.
+
+        :rtype: unicode
+        """
+        if self._json is None:
+            self._json = json.dumps(self, cls=CustomJSONEncoder)
+        return self._json
 
 
 class CustomJSONEncoder(JSONEncoder):
@@ -97,6 +122,7 @@ class CustomJSONEncoder(JSONEncoder):
             'status': workflow.status,
             'last_modified': workflow.last_modified,
             'pages': workflow.pages,
+            'page_revision': workflow.page_revision,
             'out_files': [{'name': path.name,
                            'mimetype': path}
                           for path in workflow.out_files],
@@ -126,14 +152,134 @@ class CustomJSONEncoder(JSONEncoder):
         return {'name': name, 'data': data, 'id': event.id}
 
 
+def get_workflow_summary(workflow):
+    """ Get a compact representation of a workflow for listings.
+
+    Unlike the full representation produced by :py:class:`CustomJSONEncoder`,
+    this does not require the workflow's configuration, plugins or pages to be
+    loaded.
+
+    :param workflow:    Workflow to summarize
+    :type workflow:     :py:class:`spreads.workflow.Workflow`
+    :rtype:             dict
+    """
+    return {
+        'id': workflow.id,
+        'slug': workflow.slug,
+        'metadata': dict(workflow.metadata),
+        'status': workflow.status,
+        'last_modified': workflow.last_modified,
+        'page_count': workflow.page_count,
+    }
+
+
+#: Fields of pages that can be selected in :py:func:`get_page_listing`
+PAGE_FIELDS = ('sequence_num', 'capture_num', 'page_label', 'raw_image',
+               'processed_images', 'revision')
+
+
+def get_page_listing(workflow, offset=None, limit=None, fields=None,
+                     since=None):
+    """ Get a listing of a workflow's pages from the query parameters of a
+        request.
+
+    Without any of the optional parameters, this is simply the list of all
+    pages. Otherwise it is a dictionary with the current page revision of
+    the workflow (``revision``), the total number of pages (``total``), the
+    requested pages (``pages``) and, if `since` was specified, the capture
+    numbers of the pages that were removed since that revision
+    (``removed``). If the removed pages are not known, ``removed`` is `None`
+    and ``pages`` contains all pages, so clients have to replace their copy.
+
+    :param workflow:    Workflow to list the pages of
+    :type workflow:     :py:class:`spreads.workflow.Workflow`
+    :param offset:      Index of the first page to return
+    :type offset:       str
+    :param limit:       Maximum number of pages to return
+    :type limit:        str
+    :param fields:      Comma-separated names of the fields to include for
+                        every page, from :py:data:`PAGE_FIELDS`. The
+                        ``capture_num`` is always included.
+    :type fields:       str
+    :param since:       Only list pages that were added or changed since this
+                        revision
+    :type since:        str
+    :rtype:             list or dict
+    :raises ValueError: If one of the parameters is invalid
+    """
+    if offset is None and limit is None and fields is None and since is None:
+        return workflow.pages
+    try:
+        offset = int(offset or 0)
+        limit = int(limit) if limit is not None else None
+        since = int(since) if since is not None else None
+    except ValueError:
+        raise ValueError("Offset, limit and since must be integers")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("Offset and limit must not be negative")
+    if fields is not None:
+        fields = set(f for f in fields.split(',') if f) | {'capture_num'}
+        unknown = fields - set(PAGE_FIELDS)
+        if unknown:
+            raise ValueError("Unknown fields: {0}"
+                             .format(", ".join(sorted(unknown))))
+    listing = {'revision': workflow.page_revision,
+               'total': len(workflow.pages)}
+    if since is not None:
+        pages, listing['removed'] = workflow.get_page_changes(since)
+    else:
+        pages = workflow.pages
+    pages = pages[offset:offset+limit if limit is not None else None]
+    if fields is not None:
+        pages = [dict((k, v) for k, v in page.to_dict().items()
+                      if k in fields)
+                 for page in pages]
+    listing['pages'] = pages
+    return listing
+
+
+def get_file_etag(workflow, fpath):
+    """ Get an entity tag for a file from a workflow.
+
+    This is the file's checksum from the bag manifest if it is known for the
+    file's current state, otherwise it is derived from the file's size,
+    modification time and inode, so the file never has to be read.
+
+    :param workflow:    Workflow the file belongs to
+    :type workflow:     :py:class:`spreads.workflow.Workflow`
+    :param fpath:       Path to the file
+    :type fpath:        :py:class:`pathlib.Path`
+    :returns:           Entity tag for the file
+    :rtype:             str
+    """
+    checksum = workflow.bag.get_cached_checksum(str(fpath))
+    if checksum is None:
+        checksum = "{0:x}-{1:x}-{2:x}".format(
+            *bagit.stat_signature(str(fpath)))
+    return checksum
+
+
+def find_workflow(base_path, ident):
+    """ Find a workflow by its UUID or its slug.
+
+    :param base_path:   Directory the workflows are stored in
+    :type base_path:    :py:class:`pathlib.Path`
+    :param ident:       UUID or slug of the workflow
+    :type ident:        str
+    :returns:           The workflow or `None` if it could not be found
+    :rtype:             :py:class:`spreads.workflow.Workflow`
+    """
+    try:
+        uuid.UUID(ident)
+        return Workflow.find_by_id(base_path, ident)
+    except ValueError:
+        return Workflow.find_by_slug(base_path, ident)
+
+
 class WorkflowConverter(BaseConverter):
     def to_python(self, value):
         from spreadsplug.web.app import app
-        try:
-            uuid.UUID(value)
-            workflow = Workflow.find_by_id(app.config['base_path'], value)
-        except ValueError:
-            workflow = Workflow.find_by_slug(app.config['base_path'], value)
+        workflow = find_workflow(app.config['base_path'], value)
         if workflow is None:
             abort(404)
         return workflow
@@ -142,6 +288,27 @@ class WorkflowConverter(BaseConverter):
         return value.slug
 
 
+class SerializedWSGIApp(object):
+    """ WSGI middleware that handles requests which can modify a workflow
+        one at a time.
+
+    The WSGI endpoints run on a thread pool, but workflows, their bags and
+    page lists are not safe to modify from multiple threads at once. Safe
+    methods are still handled concurrently.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') in self.SAFE_METHODS:
+            return self.app(environ, start_response)
+        with self._lock:
+            return self.app(environ, start_response)
+
+
 class GeneratorIO(BufferedIOBase):
     """ Wrapper around a generator to act as a file-like object.
     """
@@ -175,29 +342,120 @@ class GeneratorIO(BufferedIOBase):
             raise UnsupportedOperation
 
 
-def convert_image(img_path, img_format):
-    with Image(filename=str(img_path)) as img:
+#: Suffixes of image files that can be scaled, converted and thumbnailed
+TRANSFORMABLE_SUFFIXES = ('.jpg', '.jpeg', '.tif', '.tiff', '.png')
+
+
+def parse_transform_args(img_path, width=None, img_format=None,
+                         quality=None):
+    """ Validate and normalize the parameters for :py:func:`transform_image`
+        from the query parameters of a request for an image.
+
+    :param img_path:    Path to the image to be transformed
+    :type img_path:     :py:class:`pathlib.Path`
+    :param width:       Desired width
+    :type width:        str
+    :param img_format:  Desired format, `browser` selects PNG for images
+                        that are neither JPEG nor PNG files
+    :type img_format:   str
+    :param quality:     Desired quality of lossy formats, from 1 to 100
+    :type quality:      str
+    :returns:           Width, format and quality, format is `None` if no
+                        transformation was requested
+    :rtype:             tuple
+    :raises ValueError: If one of the parameters is invalid
+    """
+    if width is None and img_format is None and quality is None:
+        return None, None, None
+    if img_path.suffix.lower() not in TRANSFORMABLE_SUFFIXES:
+        raise ValueError("Can only scale/convert JPG, TIF or PNG files.")
+    try:
+        width = int(width) if width is not None else None
+        quality = int(quality) if quality is not None else None
+    except ValueError:
+        raise ValueError("Width and quality must be integers")
+    if width is not None and width <= 0:
+        raise ValueError("Width must be positive")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Quality must be between 1 and 100")
+    img_format = (img_format or 'jpg').lower()
+    if img_format == 'browser':
+        img_format = img_path.suffix.lower()[1:]
+        if img_format not in ('jpg', 'jpeg', 'png'):
+            img_format = 'png'
+    if img_format == 'jpeg':
+        img_format = 'jpg'
+    if not img_format.isalnum():
+        raise ValueError("Invalid format: {0}".format(img_format))
+    return width, img_format, quality
+
+
+def _get_target_size(srcwidth, srcheight, width=None, height=None):
+    aspect = srcwidth/float(srcheight)
+    target_width = width if width else int(aspect*height)
+    target_height = height if height else int(width/aspect)
+    return target_width, target_height
+
+
+def transform_image(img_path, width=None, height=None, img_format='jpg',
+                    quality=None):
+    """ Scale and convert an image, decoding it only once.
+
+    JPEG images that are downscaled are decoded at a reduced size in the
+    DCT domain (i.e. 'draft mode'), which is a lot faster than decoding the
+    full image first.
+
+    :param img_path:    Path to image
+    :type img_path:     :py:class:`pathlib.Path`
+    :param width:       Desired width, keeps the aspect ratio if `height` is
+                        not set
+    :type width:        int
+    :param height:      Desired height, keeps the aspect ratio if `width` is
+                        not set
+    :type height:       int
+    :param img_format:  Target format as recognized by ImageMagick
+    :type img_format:   str
+    :param quality:     Quality for lossy formats from 1 to 100, the
+                        default of the encoder if not set
+    :type quality:      int
+    :returns:           The transformed image
+    :rtype:             bytestring
+    """
+    is_jpeg = img_path.suffix.lower() in ('.jpg', '.jpeg')
+    scale = width is not None or height is not None
+    if (HAS_JPEGTRAN and is_jpeg and img_format in ('jpg', 'jpeg') and
+            quality is None):
+        # Scales in the DCT domain
+        img = JPEGImage(str(img_path))
+        if scale:
+            img = img.downscale(*_get_target_size(img.width, img.height,
+                                                  width, height))
+        return img.as_blob()
+    with Image() as img:
+        if scale and is_jpeg:
+            with Image.ping(filename=str(img_path)) as info:
+                target_size = _get_target_size(info.width, info.height,
+                                               width, height)
+            # libjpeg picks the smallest DCT scaling that is still at least
+            # as large as the hint
+            img.options['jpeg:size'] = '{0}x{1}'.format(*target_size)
+        img.read(filename=str(img_path))
+        if scale:
+            img.sample(*_get_target_size(img.width, img.height,
+                                         width, height))
+        if quality is not None:
+            img.compression_quality = quality
         return img.make_blob(format=img_format)
 
 
-def scale_image(img_path, width=None, height=None):
-    def get_target_size(srcwidth, srcheight):
-        aspect = srcwidth/srcheight
-        target_width = width if width else int(aspect*height)
-        target_height = height if height else int(width/aspect)
-        return target_width, target_height
+def convert_image(img_path, img_format):
+    return transform_image(img_path, img_format=img_format)
+
 
+def scale_image(img_path, width=None, height=None):
     if width is None and height is None:
         raise ValueError("Please specify either width or height")
-    if HAS_JPEGTRAN and img_path.suffix.lower() in ('.jpg', '.jpeg'):
-        img = JPEGImage(str(img_path))
-        width, height = get_target_size(img.width, img.height)
-        return img.downscale(width, height).as_blob()
-    else:
-        with Image(filename=str(img_path)) as img:
-            width, height = get_target_size(img.width, img.height)
-            img.sample(width, height)
-            return img.make_blob(format='jpg')
+    return transform_image(img_path, width=width, height=height)
 
 
 def get_thumbnail(img_path):
@@ -219,6 +477,545 @@ def get_thumbnail(img_path):
     return scale_image(img_path, width=160)
 
 
+def crop_image(img_path, left, top, width, height):
+    """ Crop a region from an image.
+
+    :param img_path:    Path to image
+    :type img_path:     :py:class:`pathlib.Path`
+    :param left:        X coordinate of the region
+    :param top:         Y coordinate of the region
+    :param width:       Width of the region
+    :param height:      Height of the region
+    :returns:           The cropped region as a JPEG image
+    :rtype:             bytestring
+    """
+    if HAS_JPEGTRAN and img_path.suffix.lower() in ('.jpg', '.jpeg'):
+        # Lossless, does not require the image to be decoded
+        return JPEGImage(str(img_path)).crop(left, top, width,
+                                             height).as_blob()
+    with Image(filename=str(img_path)) as img:
+        img.crop(left, top, width=width, height=height)
+        return img.make_blob(format='jpg')
+
+
+def get_image_size(img_path):
+    """ Get the dimensions of an image.
+
+    :param img_path:    Path to image
+    :type img_path:     :py:class:`pathlib.Path`
+    :returns:           Width and height of the image
+    :rtype:             tuple of int
+    """
+    if HAS_JPEGTRAN and img_path.suffix.lower() in ('.jpg', '.jpeg'):
+        img = JPEGImage(str(img_path))
+        return img.width, img.height
+    # Only reads the image's header
+    with Image.ping(filename=str(img_path)) as img:
+        return img.width, img.height
+
+
+class ImageProcessorBusy(Exception):
+    """ Raised when an image transform is requested while too many are
+    already pending.
+    """
+
+
+class ImageProcessor(object):
+    """ Bounded pool of processes for image transforms (scaling, conversion,
+        thumbnails and tiles).
+
+    Decoding images is CPU-bound, so the transforms run in separate
+    processes. Transforms are identified by a key, and concurrent requests
+    for a transform that is already pending share its job instead of
+    starting another one. If `max_pending` distinct transforms are pending,
+    further ones are rejected with :py:exc:`ImageProcessorBusy`, so that
+    clients back off instead of piling up work.
+    """
+    def __init__(self, num_workers=None, max_pending=None, use_processes=True):
+        """ Create a new instance, the workers are started on demand.
+
+        :param num_workers:     Number of workers, one per CPU core by
+                                default
+        :type num_workers:      int
+        :param max_pending:     Maximum number of pending transforms, eight
+                                per worker by default
+        :type max_pending:      int
+        :param use_processes:   Run the transforms in processes, otherwise
+                                in threads
+        :type use_processes:    bool
+        """
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.max_pending = max_pending or 8*self.num_workers
+        self.use_processes = use_processes
+        self._executor = None
+        self._lock = threading.Lock()
+        #: Futures of the pending transforms by their keys
+        self._pending = {}
+        self._counters = dict.fromkeys(
+            ('submitted', 'coalesced', 'rejected', 'completed', 'failed'), 0)
+        self._peak_pending = 0
+        self._job_time = 0.0
+
+    def submit(self, key, func, *args, **kwargs):
+        """ Run a transform in the pool, unless one with the same key is
+            already pending.
+
+        :param key:         Hashable key that identifies the transform
+        :param func:        Picklable function that performs the transform
+        :param args:        Picklable arguments for `func`
+        :param callback:    Optional function that is called with the
+                            result of `func` before the future completes,
+                            its return value becomes the result of the
+                            future.
+        :type callback:     callable
+        :returns:           Future for the result of the transform
+        :rtype:             :py:class:`concurrent.futures.Future`
+        :raises ImageProcessorBusy: If too many transforms are pending
+        """
+        callback = kwargs.get('callback')
+        with self._lock:
+            if key in self._pending:
+                self._counters['coalesced'] += 1
+                return self._pending[key]
+            if len(self._pending) >= self.max_pending:
+                self._counters['rejected'] += 1
+                raise ImageProcessorBusy(
+                    "Too many pending image transforms ({0})"
+                    .format(len(self._pending)))
+            if self._executor is None:
+                if self.use_processes:
+                    self._executor = concfut.ProcessPoolExecutor(
+                        max_workers=self.num_workers)
+                else:
+                    self._executor = concfut.ThreadPoolExecutor(
+                        max_workers=self.num_workers)
+            future = concfut.Future()
+            self._pending[key] = future
+            self._counters['submitted'] += 1
+            self._peak_pending = max(self._peak_pending, len(self._pending))
+            executor = self._executor
+        job = executor.submit(func, *args)
+        job.add_done_callback(functools.partial(
+            self._on_job_done, key, future, callback, time.time()))
+        return future
+
+    def run(self, key, func, *args, **kwargs):
+        """ Like :py:meth:`submit`, but wait for the transform to finish.
+
+        :returns:   The result of the transform
+        """
+        return self.submit(key, func, *args, **kwargs).result()
+
+    def _on_job_done(self, key, future, callback, start_time, job):
+        try:
+            result = job.result()
+            if callback is not None:
+                result = callback(result)
+        except Exception as e:
+            if isinstance(e, concfut.BrokenExecutor):
+                # A worker died, start a new pool for the next transform
+                with self._lock:
+                    self._executor = None
+            self._finish_job(key, 'failed', start_time)
+            future.set_exception(e)
+        else:
+            self._finish_job(key, 'completed', start_time)
+            future.set_result(result)
+
+    def _finish_job(self, key, outcome, start_time):
+        with self._lock:
+            del self._pending[key]
+            self._counters[outcome] += 1
+            self._job_time += time.time() - start_time
+
+    def get_stats(self):
+        """ Get metrics for monitoring the load of the pool.
+
+        :returns:   Number of processes (``workers``), maximum and current
+                    number of pending transforms (``max_pending``,
+                    ``pending``), highest number of pending transforms so far
+                    (``peak_pending``), the number of requested transforms
+                    that were ``submitted``, ``coalesced`` with pending ones
+                    or ``rejected`` and the number of ``completed`` and
+                    ``failed`` transforms, as well as the average time from
+                    submission to completion in seconds (``avg_time``).
+        :rtype:     dict
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(workers=self.num_workers,
+                         max_pending=self.max_pending,
+                         pending=len(self._pending),
+                         peak_pending=self._peak_pending)
+            num_done = stats['completed'] + stats['failed']
+            stats['avg_time'] = self._job_time/num_done if num_done else None
+        return stats
+
+    def shutdown(self, wait=True):
+        """ Stop the processes, they are started again on demand. """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class ImageCache(object):
+    """ Persistent, size-bounded store for images derived from page images,
+        i.e. thumbnails, downscaled versions and tiles.
+
+    Derived images are stored as files in a directory per workflow. They are
+    keyed by the relative path and the stat signature of their source image,
+    so an image that was modified (e.g. by cropping) gets new derived images
+    without having to be read for hashing. Once the total size of all stored
+    images exceeds `max_size`, the least recently used ones are evicted.
+
+    Downscaled versions are built from a pyramid of fixed widths
+    (:py:attr:`PYRAMID_WIDTHS`), where every level is generated from the next
+    larger one. Requests for other widths are served by downscaling the
+    nearest larger level, so the full-resolution image only needs to be
+    decoded once per image. To bound the number of versions per image,
+    requested widths are rounded up to a multiple of
+    :py:attr:`WIDTH_STEP`, up to :py:attr:`MAX_WIDTH`.
+    """
+    #: Widths of the downscaled versions of an image that make up its pyramid
+    PYRAMID_WIDTHS = (160, 480, 1200)
+    #: Granularity of the widths of downscaled versions
+    WIDTH_STEP = 80
+    #: Largest width of downscaled versions
+    MAX_WIDTH = 4800
+    #: How often a pyramid level is generated again if it was evicted before
+    #: an image could be derived from it
+    MAX_LEVEL_ATTEMPTS = 3
+    #: Width and height of tiles
+    TILE_SIZE = 512
+
+    def __init__(self, path, max_size, processor=None):
+        """ Create a new instance and index the images already on disk.
+
+        :param path:        Directory to store images in
+        :type path:         :py:class:`pathlib.Path`
+        :param max_size:    Maximum total size of all images in bytes
+        :type max_size:     int
+        :param processor:   Pool to generate the images in, a new one with
+                            the default settings if not set
+        :type processor:    :py:class:`ImageProcessor`
+        """
+        self.path = Path(path)
+        self.max_size = max_size
+        self.processor = processor or ImageProcessor()
+        self._lock = threading.Lock()
+        #: Sizes of the stored images, least recently used first
+        self._entries = OrderedDict()
+        self._size = 0
+        self._executor = None
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+        self._load()
+
+    def _load(self):
+        # The modification time of an image is updated whenever it is
+        # served, so it reflects the last access across restarts
+        entries = []
+        for wf_path in self.path.iterdir():
+            if not wf_path.is_dir():
+                continue
+            for entry_path in wf_path.iterdir():
+                if entry_path.suffix == '.tmp':
+                    # Left over from an interrupted write
+                    entry_path.unlink()
+                    continue
+                stat = entry_path.stat()
+                entries.append((stat.st_mtime, entry_path, stat.st_size))
+        with self._lock:
+            for _, entry_path, size in sorted(entries):
+                self._entries[entry_path] = size
+                self._size += size
+            self._evict()
+
+    def _get_entry_path(self, workflow, img_path, variant, img_format='jpg'):
+        size, mtime, inode = bagit.stat_signature(str(img_path))
+        key = "{0}:{1}:{2}:{3}".format(
+            img_path.relative_to(workflow.path), size, mtime, inode)
+        return self.path / workflow.id / "{0}.{1}.{2}".format(
+            hashlib.sha1(key.encode('utf8')).hexdigest(), variant, img_format)
+
+    def _evict(self):
+        # Must be called with the lock held, so that entries are never
+        # removed while they are looked up or stored
+        while self._size > self.max_size and self._entries:
+            entry_path, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                entry_path.unlink()
+            except OSError:
+                pass
+
+    def _lookup(self, entry_path):
+        """ Mark an entry as used.
+
+        :returns:   Whether the entry exists
+        :rtype:     bool
+        """
+        with self._lock:
+            if entry_path not in self._entries:
+                return False
+            self._entries.move_to_end(entry_path)
+            try:
+                os.utime(str(entry_path))
+                return True
+            except OSError:
+                self._size -= self._entries.pop(entry_path, 0)
+                return False
+
+    def _contains(self, entry_path):
+        with self._lock:
+            return entry_path in self._entries
+
+    def _store(self, entry_path, data):
+        """ Store the data of an entry and evict the least recently used
+        entries if necessary.
+
+        :returns:   The data
+        :rtype:     bytestring
+        """
+        if not entry_path.parent.exists():
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_suffix('.tmp')
+        with tmp_path.open('wb') as fp:
+            fp.write(data)
+        with self._lock:
+            os.replace(str(tmp_path), str(entry_path))
+            self._size += len(data) - self._entries.pop(entry_path, 0)
+            self._entries[entry_path] = len(data)
+            self._evict()
+        return data
+
+    def _get_or_create(self, entry_path, func, *args):
+        """ Get the path to an entry, creating it if necessary.
+
+        The entry is created by the :py:attr:`processor`, so concurrent
+        requests for the same missing entry only create it once.
+
+        :param func:    Picklable function that returns the data for a
+                        missing entry when called with `args`
+        :type func:     callable
+        :rtype:         :py:class:`pathlib.Path`
+        :raises ImageProcessorBusy: If the entry is missing and the
+                                    processor is busy
+        """
+        if not self._lookup(entry_path):
+            self.processor.run(
+                entry_path, func, *args,
+                callback=functools.partial(self._store, entry_path))
+        return entry_path
+
+    def _get_or_create_data(self, entry_path, func, *args):
+        """ Like :py:meth:`_get_or_create`, but get the data of the entry.
+
+        Newly created entries are not read back from disk, so they can be
+        evicted at any time.
+
+        :rtype:     bytestring
+        """
+        if self._lookup(entry_path):
+            try:
+                with entry_path.open('rb') as fp:
+                    return fp.read()
+            except OSError:
+                # Evicted since it was looked up
+                pass
+        return self.processor.run(
+            entry_path, func, *args,
+            callback=functools.partial(self._store, entry_path))
+
+    def _snap_width(self, width):
+        return min(-(-width // self.WIDTH_STEP) * self.WIDTH_STEP,
+                   self.MAX_WIDTH)
+
+    def _from_level(self, workflow, img_path, level_width, create):
+        """ Derive an image from a level of an image's pyramid.
+
+        :param level_width: Width of the level
+        :type level_width:  int
+        :param create:      Function that derives the image when called with
+                            the path to the level
+        :type create:       callable
+        :returns:           Return value of `create`
+        """
+        for attempt in range(self.MAX_LEVEL_ATTEMPTS):
+            source_path = self.get_scaled(workflow, img_path, level_width)
+            try:
+                return create(source_path)
+            except Exception:
+                if (source_path.exists() or
+                        attempt == self.MAX_LEVEL_ATTEMPTS - 1):
+                    raise
+                # The level was evicted before it was read
+                logger.debug("Generating evicted level {0} of {1} again"
+                             .format(level_width, img_path))
+
+    def get_thumbnail(self, workflow, img_path):
+        """ Get the thumbnail for an image, generating it if necessary.
+
+        :param workflow:    Workflow the image belongs to
+        :type workflow:     :py:class:`spreads.workflow.Workflow`
+        :param img_path:    Path to image
+        :type img_path:     :py:class:`pathlib.Path`
+        :returns:           The thumbnail
+        :rtype:             bytestring
+        """
+        return self._get_or_create_data(
+            self._get_entry_path(workflow, img_path, 'thumb'),
+            get_thumbnail, img_path)
+
+    def get_scaled(self, workflow, img_path, width):
+        """ Get a downscaled version of an image, generating it if necessary.
+
+        :param workflow:    Workflow the image belongs to
+        :type workflow:     :py:class:`spreads.workflow.Workflow`
+        :param img_path:    Path to image
+        :type img_path:     :py:class:`pathlib.Path`
+        :param width:       Desired width, rounded up to a multiple of
+                            :py:attr:`WIDTH_STEP`
+        :type width:        int
+        :returns:           Path to the downscaled JPEG image
+        :rtype:             :py:class:`pathlib.Path`
+        """
+        width = self._snap_width(width)
+        entry_path = self._get_entry_path(workflow, img_path,
+                                          'w{0}'.format(width))
+        if self._lookup(entry_path):
+            return entry_path
+        create = functools.partial(
+            self._get_or_create, entry_path,
+            functools.partial(scale_image, width=width))
+        larger_levels = [w for w in self.PYRAMID_WIDTHS if w > width]
+        if larger_levels:
+            return self._from_level(workflow, img_path, larger_levels[0],
+                                    create)
+        return create(img_path)
+
+    def get_transformed(self, workflow, img_path, width=None,
+                        img_format='jpg', quality=None):
+        """ Get a scaled and/or converted version of an image, generating it
+            if necessary.
+
+        Downscaled versions are generated from the image pyramid, like with
+        :py:meth:`get_scaled`.
+
+        :param workflow:    Workflow the image belongs to
+        :type workflow:     :py:class:`spreads.workflow.Workflow`
+        :param img_path:    Path to image
+        :type img_path:     :py:class:`pathlib.Path`
+        :param width:       Desired width, the original width if not set,
+                            rounded up like with :py:meth:`get_scaled`
+        :type width:        int
+        :param img_format:  Desired format, see :py:func:`transform_image`
+        :type img_format:   str
+        :param quality:     Desired quality, see :py:func:`transform_image`
+        :type quality:      int
+        :returns:           Path to the transformed image, its suffix is the
+                            format
+        :rtype:             :py:class:`pathlib.Path`
+        """
+        if width is not None and img_format == 'jpg' and quality is None:
+            return self.get_scaled(workflow, img_path, width)
+        if width is not None:
+            width = self._snap_width(width)
+        variant = 'w{0}-q{1}'.format(width or 'full', quality or 'default')
+        entry_path = self._get_entry_path(workflow, img_path, variant,
+                                          img_format)
+        if self._lookup(entry_path):
+            return entry_path
+        create = functools.partial(
+            self._get_or_create, entry_path,
+            functools.partial(transform_image, width=width,
+                              img_format=img_format, quality=quality))
+        larger_levels = [w for w in self.PYRAMID_WIDTHS
+                         if width is not None and w > width]
+        if larger_levels:
+            return self._from_level(workflow, img_path, larger_levels[0],
+                                    create)
+        return create(img_path)
+
+    def get_tile(self, workflow, img_path, level, col, row):
+        """ Get a tile from a level of an image's pyramid, generating it if
+            necessary.
+
+        :param workflow:    Workflow the image belongs to
+        :type workflow:     :py:class:`spreads.workflow.Workflow`
+        :param img_path:    Path to image
+        :type img_path:     :py:class:`pathlib.Path`
+        :param level:       Index of the level in :py:attr:`PYRAMID_WIDTHS`,
+                            the level after the last one is the
+                            full-resolution image
+        :type level:        int
+        :param col:         Column of the tile
+        :type col:          int
+        :param row:         Row of the tile
+        :type row:          int
+        :returns:           Path to the tile
+        :rtype:             :py:class:`pathlib.Path`
+        :raises ValueError: If the level or the tile does not exist
+        """
+        if not 0 <= level <= len(self.PYRAMID_WIDTHS):
+            raise ValueError("No such level: {0}".format(level))
+        entry_path = self._get_entry_path(
+            workflow, img_path, 't{0}-{1}-{2}'.format(level, col, row))
+        if self._lookup(entry_path):
+            return entry_path
+
+        def create(source_path):
+            width, height = get_image_size(source_path)
+            left, top = col*self.TILE_SIZE, row*self.TILE_SIZE
+            if col < 0 or row < 0 or left >= width or top >= height:
+                raise ValueError("No such tile: {0}/{1}".format(col, row))
+            return self._get_or_create(
+                entry_path, crop_image, source_path, left, top,
+                min(self.TILE_SIZE, width-left),
+                min(self.TILE_SIZE, height-top))
+        if level < len(self.PYRAMID_WIDTHS):
+            return self._from_level(workflow, img_path,
+                                    self.PYRAMID_WIDTHS[level], create)
+        return create(img_path)
+
+    def generate_thumbnails(self, workflow, img_paths):
+        """ Generate missing thumbnails for images in the background.
+
+        :param workflow:    Workflow the images belong to
+        :type workflow:     :py:class:`spreads.workflow.Workflow`
+        :param img_paths:   Paths to images
+        :type img_paths:    iterable of :py:class:`pathlib.Path`
+        """
+        def generate_missing(img_paths):
+            for img_path in img_paths:
+                try:
+                    entry_path = self._get_entry_path(workflow, img_path,
+                                                      'thumb')
+                    if not self._contains(entry_path):
+                        self.get_thumbnail(workflow, img_path)
+                except Exception as e:
+                    logger.warning("Could not generate thumbnail for {0}: {1}"
+                                   .format(img_path, e))
+        with self._lock:
+            if self._executor is None:
+                self._executor = concfut.ThreadPoolExecutor(max_workers=1)
+        self._executor.submit(generate_missing, list(img_paths))
+
+    def remove_workflow(self, workflow_id):
+        """ Remove all images for a workflow.
+
+        :param workflow_id: ID of the workflow
+        :type workflow_id:  unicode
+        """
+        wf_path = self.path / workflow_id
+        with self._lock:
+            for entry_path in [p for p in self._entries
+                               if p.parent == wf_path]:
+                self._size -= self._entries.pop(entry_path)
+        shutil.rmtree(str(wf_path), ignore_errors=True)
+
+
 def find_stick():
     import dbus
     bus = dbus.SystemBus()
@@ -250,31 +1047,729 @@ def find_stick_win():
             return drive
 
 
-def calculate_zipsize(frecords):
-    """ Calculate size of resulting ZIP.
+class ZipStreamError(ValueError):
+    """ Raised when an uploaded ZIP stream cannot be extracted or does not
+    match the manifests of the bag contained in it.
+    """
+
+
+class ZipStreamExtractor(object):
+    """ Extracts an uncompressed ZIP archive containing a bag while it is
+    being received, without storing the archive itself.
+
+    The entries are written straight to their destination and checksummed
+    while they are written. Every entry is verified against the bag's
+    (tag-)manifests as soon as both the entry and the manifest listing it
+    have been received. Since the manifests are packaged before the payload
+    (see :py:meth:`spreads.vendor.bagit.BagPackager._write_bag_to_zipfile`),
+    this usually means right after the entry was written.
+
+    Streams created with ``zipstream`` do not record the entry sizes in the
+    local headers, the end of an entry is instead detected by a data
+    descriptor whose checksum and size match the data received so far.
+
+    :param path:    Directory the bag directory will be extracted to
+    :type path:     unicode
+    """
+    LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+    DESCRIPTOR = struct.Struct('<4sLLL')
+    DESCRIPTOR64 = struct.Struct('<4sLQQ')
+    SIG_LOCAL_HEADER = b'PK\x03\x04'
+    SIG_DESCRIPTOR = b'PK\x07\x08'
+    SIG_CENTRAL_DIRECTORY = (b'PK\x01\x02', b'PK\x05\x06', b'PK\x06\x06')
+    FLAG_DESCRIPTOR = 0x08
+    FLAG_UTF8 = 0x800
+
+    def __init__(self, path):
+        self.path = path
+        #: Name of the extracted bag directory
+        self.bag_name = None
+        #: Checksums of the received files by their path relative to the bag
+        self.checksums = {}
+        self.finished = False
+        self._buf = bytearray()
+        self._entry = None
+        self._expected = {}
+        self._payload_algs = set()
+        self._tag_algs = set()
+
+    def feed(self, data):
+        """ Process the next chunk of the archive.
+
+        :param data:    Chunk of the archive
+        :type data:     bytes
+        :returns:       Whether the last entry was extracted
+        :rtype:         bool
+        :raises ZipStreamError: If the archive is invalid or an entry
+                                does not match the manifests
+        """
+        if self.finished:
+            return True
+        self._buf.extend(data)
+        try:
+            while self._process():
+                pass
+        except Exception:
+            self.close()
+            raise
+        return self.finished
+
+    def close(self):
+        """ Close the file of the entry that is currently extracted. """
+        if self._entry is not None:
+            self._entry['fp'].close()
+            self._entry = None
+
+    def _process(self):
+        """ Consume as much of the buffer as possible.
+
+        :returns:   Whether processing can continue with the current buffer
+        """
+        if self.finished:
+            return False
+        elif self._entry is not None:
+            return self._process_data()
+        elif len(self._buf) < 4:
+            return False
+        signature = bytes(self._buf[:4])
+        if signature in self.SIG_CENTRAL_DIRECTORY:
+            self._finish()
+            return False
+        elif signature != self.SIG_LOCAL_HEADER:
+            raise ZipStreamError("Invalid ZIP archive")
+        if len(self._buf) < self.LOCAL_HEADER.size:
+            return False
+        (_, _, flags, method, _, _, crc, csize, _, name_len,
+         extra_len) = self.LOCAL_HEADER.unpack_from(self._buf)
+        header_len = self.LOCAL_HEADER.size + name_len + extra_len
+        if len(self._buf) < header_len:
+            return False
+        name = bytes(self._buf[self.LOCAL_HEADER.size:
+                               self.LOCAL_HEADER.size + name_len])
+        name = name.decode('utf8' if flags & self.FLAG_UTF8 else 'cp437')
+        if method != 0:
+            raise ZipStreamError("Entry '{0}' is compressed, only "
+                                 "uncompressed archives are supported"
+                                 .format(name))
+        if csize == 0xFFFFFFFF and not flags & self.FLAG_DESCRIPTOR:
+            csize = self._get_zip64_size(
+                self._buf[header_len-extra_len:header_len])
+        del self._buf[:header_len]
+        self._start_entry(name, flags, crc, csize)
+        return True
+
+    @staticmethod
+    def _get_zip64_size(extra):
+        """ Get the compressed size from the ZIP64 extra field. """
+        offset = 0
+        while offset + 4 <= len(extra):
+            field_id, field_len = struct.unpack_from('<HH', extra, offset)
+            if field_id == 0x0001 and field_len >= 16:
+                return struct.unpack_from('<Q', extra, offset + 12)[0]
+            offset += 4 + field_len
+        raise ZipStreamError("Missing ZIP64 size information")
+
+    def _start_entry(self, name, flags, crc, csize):
+        parts = name.split('/')
+        if name.endswith('/'):
+            # Directories are created along with the files in them
+            parts = parts[:-1]
+        if (len(parts) < 2 or any(p in ('', '.', '..') for p in parts) or
+                (self.bag_name not in (None, parts[0]))):
+            raise ZipStreamError("Invalid entry '{0}'".format(name))
+        self.bag_name = parts[0]
+        relpath = os.path.join(*parts[1:])
+        fpath = os.path.join(self.path, self.bag_name, relpath)
+        if name.endswith('/'):
+            if not os.path.isdir(fpath):
+                os.makedirs(fpath)
+            return
+        if not os.path.isdir(os.path.dirname(fpath)):
+            os.makedirs(os.path.dirname(fpath))
+        if relpath.startswith('data' + os.sep):
+            algorithms = self._payload_algs
+        else:
+            algorithms = self._tag_algs
+        self._entry = {
+            'relpath': relpath,
+            'fp': open(fpath, 'wb'),
+            'crc': 0,
+            'size': 0,
+            # Until we received the manifests, we have to guess
+            'digests': bagit._get_digests(algorithms or ('md5',)),
+            'expected_crc': crc,
+            'remaining': (None if flags & self.FLAG_DESCRIPTOR else csize)}
+
+    def _consume(self, num_bytes):
+        """ Write data from the start of the buffer to the current entry. """
+        entry = self._entry
+        with memoryview(self._buf) as view:
+            data = view[:num_bytes]
+            entry['fp'].write(data)
+            entry['crc'] = zlib.crc32(data, entry['crc'])
+            entry['size'] += num_bytes
+            for digest in entry['digests'].values():
+                digest.update(data)
+            data.release()
+        del self._buf[:num_bytes]
+
+    def _process_data(self):
+        entry = self._entry
+        if entry['remaining'] is not None:
+            num_bytes = min(entry['remaining'], len(self._buf))
+            self._consume(num_bytes)
+            entry['remaining'] -= num_bytes
+            if entry['remaining']:
+                return False
+            if entry['crc'] & 0xFFFFFFFF != entry['expected_crc']:
+                raise ZipStreamError("CRC mismatch for '{0}'"
+                                     .format(entry['relpath']))
+            self._finish_entry()
+            return True
+
+        idx = self._buf.find(self.SIG_DESCRIPTOR)
+        if idx < 0:
+            # Keep what could be the start of a descriptor signature
+            self._consume(max(len(self._buf) - 3, 0))
+            return False
+        self._consume(idx)
+        if len(self._buf) < self.DESCRIPTOR64.size:
+            return False
+        crc = entry['crc'] & 0xFFFFFFFF
+        for descriptor in (self.DESCRIPTOR, self.DESCRIPTOR64):
+            _, desc_crc, csize, _ = descriptor.unpack_from(self._buf)
+            if csize != entry['size']:
+                continue
+            elif desc_crc != crc:
+                raise ZipStreamError("CRC mismatch for '{0}'"
+                                     .format(entry['relpath']))
+            del self._buf[:descriptor.size]
+            self._finish_entry()
+            return True
+        # The signature is part of the entry's data
+        self._consume(4)
+        return True
+
+    def _finish_entry(self):
+        entry = self._entry
+        entry['fp'].close()
+        self._entry = None
+        relpath = entry['relpath']
+        self.checksums[relpath] = dict(
+            (alg, digest.hexdigest())
+            for alg, digest in entry['digests'].items())
+        self._verify(relpath)
+        fname = os.path.basename(relpath)
+        if relpath == fname and fname.endswith('.txt'):
+            for prefix, algs in (('manifest-', self._payload_algs),
+                                 ('tagmanifest-', self._tag_algs)):
+                alg = fname[len(prefix):-4]
+                if fname.startswith(prefix) and alg in bagit.HASH_ALGORITHMS:
+                    self._add_manifest(relpath, alg)
+                    algs.add(alg)
+
+    def _add_manifest(self, relpath, alg):
+        manifest = bagit.Manifest(
+            os.path.join(self.path, self.bag_name, relpath))
+        for path, digest in manifest.items():
+            self._expected.setdefault(path, {})[alg] = digest.lower()
+            if path in self.checksums:
+                self._verify(path)
+
+    def _verify(self, relpath):
+        """ Compare the checksums of a received file with those from the
+        manifests received so far.
+        """
+        expected = self._expected.get(relpath)
+        if not expected:
+            return
+        checksums = self.checksums[relpath]
+        missing = [alg for alg in expected if alg not in checksums]
+        if missing:
+            # The file arrived before the manifest with the algorithm
+            _, new_checksums, _ = bagit.hash_file(
+                os.path.join(self.path, self.bag_name, relpath), missing)
+            checksums.update(new_checksums)
+        for alg, digest in expected.items():
+            if checksums[alg] != digest:
+                raise ZipStreamError(str(bagit.ChecksumMismatch(
+                    relpath, alg, digest, checksums[alg])))
+
+    def _finish(self):
+        if self.bag_name is None:
+            raise ZipStreamError("Archive is empty")
+        missing = [path for path in self._expected
+                   if path not in self.checksums]
+        if missing:
+            raise ZipStreamError(str(bagit.FileMissing(missing[0])))
+        unexpected = [path for path in self.checksums
+                      if path.startswith('data' + os.sep) and
+                      path not in self._expected]
+        if self._payload_algs and unexpected:
+            raise ZipStreamError(str(bagit.UnexpectedFile(unexpected[0])))
+        self.finished = True
+
+
+class SyncError(ValueError):
+    """ Raised when a workflow transfer cannot proceed.
+
+    :attr offset:   For chunks that do not continue a partially received
+                    file, the number of bytes that were received so far
+    :type offset:   int
+    """
+    def __init__(self, message, offset=None):
+        super(SyncError, self).__init__(message)
+        self.offset = offset
+
+
+class SyncSession(object):
+    """ Receiving end of the resumable transfer of a workflow bag from a
+    scanner to a processor.
+
+    The transfer is driven by the sender's list of files and their
+    checksums:
+
+    1. :py:meth:`start` records the list and returns the files that are
+       missing on our end or whose checksum does not match, along with the
+       number of bytes that were already received of each.
+    2. The missing files are uploaded in chunks (see
+       :py:meth:`open_part`), in any order and in parallel. A file is
+       verified and staged as soon as its last chunk arrives. Interrupted
+       transfers are resumed from the received offsets.
+    3. :py:meth:`commit` moves the staged files into the workflow and
+       removes the files that the sender no longer has.
+
+    Files are staged in a hidden directory in the workflow directory, which
+    is kept between transfers so they can be resumed and the files removed
+    since the last transfer can be determined.
 
-    We can only safely pre-calculate this because we use no compression,
-    assume that we neither store empty directories and files bigger
-    than 4GiB.
-    Many thanks to 'flocki' from StackOverflow, who provided the underlying
-    formula: https://stackoverflow.com/a/19380600/487903
+    :param base_path:   Directory the workflows are stored in
+    :type base_path:    :py:class:`pathlib.Path`
+    :param workflow_id: UUID of the transferred workflow
+    :type workflow_id:  unicode
     """
-    size = 0
-    for args, kwargs in frecords:
-        filename = args[0]
-        arcname = kwargs['arcname']
-        isdir = os.path.isdir(filename)
-        if arcname is None:
-            arcname = filename
-        arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
-        while arcname[0] in (os.sep, os.altsep):
-            arcname = arcname[1:]
-        if isdir:
-            arcname += '/'
-        size += (2*len(arcname))  # Once in file header, once in EOCD
-        size += 30  # Fixed part of local file header
-        size += 16  # Data descriptor
-        size += 46  # Central file directory header
-        size += os.path.getsize(filename)
-    size += 22  # End of central directory record (EOCD)
-    return size
+    def __init__(self, base_path, workflow_id):
+        try:
+            workflow_id = str(uuid.UUID(workflow_id))
+        except ValueError:
+            raise SyncError("Invalid workflow id: {0}".format(workflow_id))
+        self.base_path = Path(base_path)
+        self.workflow_id = workflow_id
+        self.path = self.base_path/'.sync-{0}'.format(workflow_id)
+        self.files_path = self.path/'files'
+
+    @staticmethod
+    def _check_relpath(relpath):
+        parts = relpath.split('/')
+        if (not relpath or any(p in ('', '.', '..') for p in parts) or
+                bagit._is_hash_cache(parts[-1])):
+            raise SyncError("Invalid file name: {0}".format(relpath))
+        return os.path.join(*parts)
+
+    def _read_json(self, fname, default=None):
+        try:
+            with (self.path/fname).open('r', encoding='utf-8') as fp:
+                return json.load(fp)
+        except IOError:
+            return default
+
+    def _write_json(self, fname, data):
+        tmp_path = self.path/(fname + '.tmp')
+        with tmp_path.open('wb') as fp:
+            fp.write(json.dumps(data).encode('utf-8'))
+        os.rename(str(tmp_path), str(self.path/fname))
+
+    def _get_manifest(self):
+        manifest = self._read_json('manifest.json')
+        if manifest is None:
+            raise SyncError("No transfer was started for this workflow")
+        return manifest
+
+    def _get_workflow(self):
+        return Workflow.find_by_id(self.base_path, self.workflow_id)
+
+    def _get_part_size(self, relpath):
+        try:
+            return os.path.getsize(str(self.files_path/(relpath + '.part')))
+        except OSError:
+            return 0
+
+    def _has_file(self, fpath, checksum, algorithm, size, bag=None):
+        """ Check if a file exists with a given size and checksum. """
+        try:
+            if os.path.getsize(fpath) != size:
+                return False
+        except OSError:
+            return False
+        cached = bag.get_cached_checksum(fpath, algorithm) if bag else None
+        if cached is None:
+            _, checksums, _ = bagit.hash_file(fpath, [algorithm])
+            cached = checksums[algorithm]
+        return cached == checksum
+
+    def start(self, name, files, algorithm='md5'):
+        """ Start (or resume) a transfer.
+
+        :param name:        Directory name of the workflow on the sender
+        :type name:         unicode
+        :param files:       Checksums and sizes of all files in the bag by
+                            their path relative to the bag, as
+                            ``{path: {'checksum': ..., 'size': ...}}``
+        :type files:        dict
+        :param algorithm:   Algorithm the checksums were calculated with
+        :type algorithm:    unicode
+        :returns:           The files that need to be uploaded, mapped to the
+                            number of bytes that were already received
+        :rtype:             dict
+        """
+        if algorithm not in bagit.HASH_ALGORITHMS:
+            raise SyncError("Unsupported algorithm: {0}".format(algorithm))
+        if not name or name.startswith('.') or '/' in name or '\\' in name:
+            raise SyncError("Invalid workflow name: {0}".format(name))
+        for relpath in files:
+            self._check_relpath(relpath)
+        if not self.path.exists():
+            self.path.mkdir()
+        self._write_json('manifest.json', {
+            'name': name, 'algorithm': algorithm, 'files': files})
+
+        workflow = self._get_workflow()
+        missing = {}
+        for relpath, info in files.items():
+            local_path = self._check_relpath(relpath)
+            staged_path = str(self.files_path/local_path)
+            if self._has_file(staged_path, info['checksum'], algorithm,
+                              info['size']):
+                continue
+            elif os.path.exists(staged_path):
+                os.unlink(staged_path)
+            if workflow is not None and self._has_file(
+                    str(workflow.path/local_path), info['checksum'],
+                    algorithm, info['size'], workflow.bag):
+                continue
+            missing[relpath] = self._get_part_size(local_path)
+        return missing
+
+    def open_part(self, relpath, offset, size):
+        """ Open a file for writing a chunk to it.
+
+        :param relpath:     Path of the file relative to the bag
+        :type relpath:      unicode
+        :param offset:      Offset of the chunk in the file
+        :type offset:       int
+        :param size:        Total size of the file
+        :type size:         int
+        :returns:           The partial file, positioned at the offset
+        :rtype:             file
+        :raises SyncError:  If the file is not part of the transfer or the
+                            offset does not match the number of bytes that
+                            were received so far
+        """
+        manifest = self._get_manifest()
+        info = manifest['files'].get(relpath)
+        if info is None or info['size'] != size:
+            raise SyncError("{0} is not part of the transfer".format(relpath))
+        local_path = self._check_relpath(relpath)
+        if (self.files_path/local_path).exists():
+            raise SyncError("{0} was already received".format(relpath),
+                            offset=size)
+        received = self._get_part_size(local_path)
+        if offset != received:
+            raise SyncError("Chunk does not continue {0}".format(relpath),
+                            offset=received)
+        part_path = self.files_path/(local_path + '.part')
+        if not part_path.parent.exists():
+            part_path.parent.mkdir(parents=True)
+        return part_path.open('ab')
+
+    def finish_part(self, relpath):
+        """ Verify and stage a file after a chunk was written to it, if it
+        is complete.
+
+        :param relpath:     Path of the file relative to the bag
+        :type relpath:      unicode
+        :returns:           Number of bytes received so far
+        :rtype:             int
+        :raises SyncError:  If the complete file does not match its checksum,
+                            in which case it has to be sent again
+        """
+        manifest = self._get_manifest()
+        info = manifest['files'][relpath]
+        local_path = self._check_relpath(relpath)
+        received = self._get_part_size(local_path)
+        if received < info['size']:
+            return received
+        part_path = str(self.files_path/(local_path + '.part'))
+        _, checksums, _ = bagit.hash_file(part_path, [manifest['algorithm']])
+        if (received != info['size'] or
+                checksums[manifest['algorithm']] != info['checksum']):
+            os.unlink(part_path)
+            raise SyncError("{0} does not match its checksum".format(relpath),
+                            offset=0)
+        os.rename(part_path, str(self.files_path/local_path))
+        return received
+
+    def commit(self):
+        """ Move all received files into the workflow and remove the files
+        that were removed on the sender since the last transfer.
+
+        :returns:           The transferred workflow and whether it did not
+                            exist before
+        :rtype:             tuple of :py:class:`spreads.workflow.Workflow`
+                            and bool
+        :raises SyncError:  If not all files were received yet or if they
+                            belong to a different workflow
+        """
+        manifest = self._get_manifest()
+        algorithm = manifest['algorithm']
+        workflow = self._get_workflow()
+        if workflow is not None:
+            if workflow.status['step'] is not None:
+                raise SyncError("Workflow is busy with step '{0}'"
+                                .format(workflow.status['step']))
+            wf_path = workflow.path
+        else:
+            wf_path = self.base_path/manifest['name']
+            if wf_path.exists():
+                raise SyncError("A different workflow named '{0}' already "
+                                "exists".format(manifest['name']))
+        staged = []
+        for relpath, info in manifest['files'].items():
+            local_path = self._check_relpath(relpath)
+            if (self.files_path/local_path).exists():
+                staged.append(local_path)
+            elif not (workflow is not None and
+                      (wf_path/local_path).exists()):
+                raise SyncError("{0} was not received yet".format(relpath))
+        # The workflow is identified by the id in its bag-info.txt, which
+        # must not be replaced with the one of another workflow
+        info_path = self.files_path/'bag-info.txt'
+        if not info_path.exists():
+            info_path = wf_path/'bag-info.txt'
+        workflow_id = (bagit.BagInfo(str(info_path)).get('spreads-id')
+                       if info_path.exists() else None)
+        if workflow_id != self.workflow_id:
+            raise SyncError("The files belong to workflow '{0}', not '{1}'"
+                            .format(workflow_id, self.workflow_id))
+        for local_path in staged:
+            target = wf_path/local_path
+            if not target.parent.exists():
+                target.parent.mkdir(parents=True)
+            os.rename(str(self.files_path/local_path), str(target))
+        previous = self._read_json('committed.json', {})
+        for relpath in set(previous) - set(manifest['files']):
+            fpath = wf_path/self._check_relpath(relpath)
+            if fpath.exists():
+                fpath.unlink()
+        self._write_json('committed.json', manifest['files'])
+        (self.path/'manifest.json').unlink()
+
+        is_new = workflow is None
+        if is_new:
+            workflow = Workflow(path=wf_path)
+        else:
+            # Instances are shared, so the registered one has to pick up the
+            # new files instead of being replaced
+            workflow.reload()
+        # Spare the bag from hashing the received payload again
+        workflow.bag.hash_cache.update(
+            (local_path,
+             bagit.stat_signature(str(wf_path/local_path)),
+             {algorithm: manifest['files'][relpath]['checksum']})
+            for relpath, local_path in (
+                (r, self._check_relpath(r)) for r in manifest['files'])
+            if local_path.startswith('data' + os.sep))
+        if not is_new:
+            # Files that were only created on our end (e.g. during
+            # postprocessing) were dropped from the sender's manifests
+            workflow.bag.update_payload(trust_cache=True)
+        Workflow._add_to_cache(workflow)
+        return workflow, is_new
+
+
+#: Payload directories with the results of postprocessing and output
+#: generation
+RESULT_DIRS = ('data/done', 'data/out')
+#: Name of the first member of a result archive, see
+#: :py:func:`iter_result_archive`
+RESULT_INDEX_NAME = 'index.json'
+
+
+def _get_checksum(bag, fpath, algorithm):
+    checksum = bag.get_cached_checksum(fpath, algorithm)
+    if checksum is None:
+        _, checksums, _ = bagit.hash_file(fpath, [algorithm])
+        checksum = checksums[algorithm]
+    return checksum
+
+
+def get_result_files(workflow, algorithm='md5'):
+    """ Get the checksums of the files in the result directories of a
+    workflow (see :py:data:`RESULT_DIRS`).
+
+    :param workflow:    Workflow to get the files of
+    :type workflow:     :py:class:`spreads.workflow.Workflow`
+    :param algorithm:   Checksum algorithm
+    :type algorithm:    unicode
+    :returns:           Checksums of the files by their ``/``-separated path
+                        relative to the bag
+    :rtype:             dict
+    """
+    return dict((relpath, _get_checksum(workflow.bag, fpath, algorithm))
+                for fpath, relpath in _iter_result_files(workflow))
+
+
+def _iter_result_files(workflow):
+    for dname in RESULT_DIRS:
+        for fpath in bagit.iterdir(str(workflow.path/dname)):
+            if bagit._is_hash_cache(os.path.basename(fpath)):
+                continue
+            relpath = os.path.relpath(fpath, str(workflow.path))
+            yield fpath, relpath.replace(os.sep, '/')
+
+
+def _get_tar_header(name, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def _get_tar_padding(size):
+    return b'\0' * (-size % tarfile.BLOCKSIZE)
+
+
+def iter_result_archive(workflow, known_files, algorithm='md5',
+                        chunk_size=1024**2):
+    """ Generate an uncompressed tar archive with the results of a workflow
+    that a client does not have yet.
+
+    The first member of the archive is :py:data:`RESULT_INDEX_NAME`, a JSON
+    object with the ``algorithm``, the checksums of all result ``files``
+    (see :py:func:`get_result_files`) and the ``processed_images`` of the
+    pages by their capture number. It is followed by the result files whose
+    checksums differ from the ones in `known_files`.
+
+    :param workflow:    Workflow to send the results of
+    :type workflow:     :py:class:`spreads.workflow.Workflow`
+    :param known_files: Checksums of the result files the client has
+    :type known_files:  dict
+    :param algorithm:   Algorithm the checksums were calculated with
+    :type algorithm:    unicode
+    :param chunk_size:  Maximum size of the generated chunks
+    :type chunk_size:   int
+    :returns:           Generator over chunks of the archive
+    """
+    files = get_result_files(workflow, algorithm)
+    processed_images = dict(
+        (page.capture_num,
+         dict((plugname,
+               str(fpath.relative_to(workflow.path)).replace(os.sep, '/'))
+              for plugname, fpath in page.processed_images.items()))
+        for page in workflow.pages)
+    index = json.dumps({'algorithm': algorithm, 'files': files,
+                        'processed_images': processed_images}).encode('utf-8')
+    yield (_get_tar_header(RESULT_INDEX_NAME, len(index)) + index +
+           _get_tar_padding(len(index)))
+    for relpath, checksum in sorted(files.items()):
+        if known_files.get(relpath) == checksum:
+            continue
+        with (workflow.path/relpath).open('rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            yield _get_tar_header(relpath, size)
+            remaining = size
+            while remaining:
+                chunk = fp.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError("{0} was truncated while it was sent"
+                                  .format(relpath))
+                remaining -= len(chunk)
+                yield chunk
+        yield _get_tar_padding(size)
+    yield b'\0' * (2*tarfile.BLOCKSIZE)
+
+
+def merge_result_archive(workflow, fileobj):
+    """ Merge a result archive generated by :py:func:`iter_result_archive`
+    into a workflow.
+
+    The received files are verified against their checksums and replace the
+    local ones, result files that are not in the archive's index are
+    removed. The processed images of the pages are then taken from the
+    index, except for pages that the sender does not know about.
+
+    :param workflow:    Workflow to merge the results into
+    :type workflow:     :py:class:`spreads.workflow.Workflow`
+    :param fileobj:     Readable stream of the archive
+    :returns:           Paths of the received and of the removed files,
+                        relative to the bag
+    :rtype:             tuple of two lists
+    :raises SyncError:  If the archive is invalid or a file does not match
+                        its checksum
+    """
+    archive = tarfile.open(fileobj=fileobj, mode='r|')
+    member = archive.next()
+    if member is None or member.name != RESULT_INDEX_NAME:
+        raise SyncError("Result archive does not start with an index")
+    index = json.loads(archive.extractfile(member).read().decode('utf-8'))
+    algorithm, files = index['algorithm'], index['files']
+    if algorithm not in bagit.HASH_ALGORITHMS:
+        raise SyncError("Unsupported algorithm: {0}".format(algorithm))
+    for relpath in files:
+        SyncSession._check_relpath(relpath)
+        if not any(relpath.startswith(d + '/') for d in RESULT_DIRS):
+            raise SyncError("Invalid file name: {0}".format(relpath))
+
+    received = {}
+    for member in iter(archive.next, None):
+        if not member.isfile() or member.name not in files:
+            raise SyncError("Unexpected file in result archive: {0}"
+                            .format(member.name))
+        local_path = SyncSession._check_relpath(member.name)
+        target = workflow.path/local_path
+        if not target.parent.exists():
+            target.parent.mkdir(parents=True)
+        hasher = bagit.HASH_ALGORITHMS[algorithm]()
+        src = archive.extractfile(member)
+        fd, tmp_path = tempfile.mkstemp(prefix='.pull-',
+                                        dir=str(workflow.path))
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for chunk in iter(lambda: src.read(1024**2), b''):
+                    hasher.update(chunk)
+                    fp.write(chunk)
+            if hasher.hexdigest() != files[member.name]:
+                raise SyncError("{0} does not match its checksum"
+                                .format(member.name))
+            if os.path.exists(str(target)):
+                os.unlink(str(target))
+            os.rename(tmp_path, str(target))
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        received[local_path] = hasher.hexdigest()
+
+    removed = [relpath for _, relpath in _iter_result_files(workflow)
+               if relpath not in files]
+    for relpath in removed:
+        (workflow.path/SyncSession._check_relpath(relpath)).unlink()
+    # Spare the bag from hashing the received files again
+    workflow.bag.hash_cache.update(
+        (local_path, bagit.stat_signature(str(workflow.path/local_path)),
+         {algorithm: checksum})
+        for local_path, checksum in received.items())
+    workflow.bag.update_payload(trust_cache=True)
+
+    processed_images = index['processed_images']
+    for page in workflow.pages:
+        remote_images = processed_images.get(str(page.capture_num))
+        if remote_images is not None:
+            page.processed_images = dict(
+                (plugname, workflow.path/SyncSession._check_relpath(relpath))
+                for plugname, relpath in remote_images.items())
+        page.processed_images = dict(
+            (plugname, fpath)
+            for plugname, fpath in page.processed_images.items()
+            if fpath.exists())
+    workflow._save_pages()
+    return ([p.replace(os.sep, '/') for p in received], removed)
@@ -0,0 +1,199 @@
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+import mock
+import pytest
+
+import spreads.vendor.bagit as bagit
+
+
+@pytest.fixture
+def bag(tmpdir):
+    return bagit.Bag(str(tmpdir.join('bag')))
+
+
+def make_files(tmpdir, num):
+    paths = []
+    for idx in range(num):
+        fpath = tmpdir.join('{0:03}.jpg'.format(idx))
+        fpath.write_binary(b'page ' + str(idx).encode('ascii'))
+        paths.append(str(fpath))
+    return paths
+
+
+class UnseekableIO(io.RawIOBase):
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data.extend(data)
+        return len(data)
+
+
+def test_add_payload_writes_manifest_once(bag, tmpdir):
+    paths = make_files(tmpdir, 10)
+    with mock.patch.object(bagit.Manifest, 'save', autospec=True,
+                           side_effect=bagit.Manifest.save) as save:
+        bag.add_payload(*paths)
+    saved = [call[0][0]._path for call in save.call_args_list]
+    assert saved.count(bag._get_path('manifest-md5.txt')) == 1
+    assert saved.count(bag._get_path('tagmanifest-md5.txt')) == 1
+    assert len(bag.payload) == 10
+    assert bag.info['payload-oxum'] == "{0}.10".format(
+        sum(len('page {0}'.format(i)) for i in range(10)))
+    bag.validate()
+
+
+def test_batch_defers_writes(bag, tmpdir):
+    paths = make_files(tmpdir, 3)
+    with bag.batch():
+        bag.add_payload(paths[0])
+        bag.add_payload(*paths[1:])
+        with open(bag._get_path('manifest-md5.txt')) as fp:
+            assert fp.read() == ''
+    with open(bag._get_path('manifest-md5.txt')) as fp:
+        assert len(fp.readlines()) == 3
+    bag.validate()
+
+
+def test_remove_payload(bag, tmpdir):
+    bag.add_payload(*make_files(tmpdir, 4))
+    to_remove = bag.payload[:2]
+    bag.remove_payload(*to_remove)
+    assert len(bag.payload) == 2
+    reloaded = bagit.Bag(bag.path)
+    assert reloaded.payload == bag.payload
+    reloaded.validate()
+
+
+def test_add_payload_data_skips_missing(bag):
+    raw_dir = os.path.join(bag.path, 'data', 'raw')
+    os.makedirs(raw_dir)
+    entries = []
+    for idx in range(3):
+        data = 'page {0}'.format(idx).encode('ascii')
+        fpath = os.path.join(raw_dir, '{0:03}.jpg'.format(idx))
+        with open(fpath, 'wb') as fp:
+            fp.write(data)
+        entries.append((fpath, data))
+    os.unlink(entries[1][0])
+    bag.add_payload_data(*entries)
+    assert bag.payload == [entries[0][0], entries[2][0]]
+    bag.validate()
+
+
+def test_algorithms(bag, tmpdir):
+    assert bag.algorithms == ['md5']
+    path = str(tmpdir.join('sha'))
+    bagit.Bag(path, checksums=['sha256', 'md5'])
+    assert bagit.Bag(path).algorithms == ['md5', 'sha256']
+
+
+def test_validate_trusts_hash_cache(bag, tmpdir):
+    bag.add_payload(*make_files(tmpdir, 3))
+    with mock.patch('spreads.vendor.bagit.hash_file') as hash_file, \
+            mock.patch.object(bag, '_get_executor') as get_executor:
+        bag.validate(trust_cache=True)
+        assert not hash_file.called
+        assert not get_executor.called
+    with open(bag.payload[0], 'wb') as fp:
+        fp.write(b'modified page')
+    with pytest.raises(bagit.ValidationError) as exc:
+        bag.validate(trust_cache=True)
+    assert any(isinstance(e, bagit.ChecksumMismatch)
+               for e in exc.value.details)
+    bag.update_payload(trust_cache=True)
+    bag.validate()
+
+
+def test_hash_cache_not_packaged(bag, tmpdir):
+    bag.add_payload(*make_files(tmpdir, 2))
+    assert tmpdir.join('bag', bagit.HASH_CACHE_FNAME).check()
+    zpath = str(tmpdir.join('bag.zip'))
+    bag.package_as_zip(zpath)
+    with zipfile.ZipFile(zpath) as zf:
+        assert not any(bagit.HASH_CACHE_FNAME in n for n in zf.namelist())
+
+
+def test_hashing_executor_is_reused(bag, tmpdir):
+    paths = make_files(tmpdir, 4)
+    bag.add_payload(*paths[:2])
+    executor = bag._executor
+    bag.add_payload(*paths[2:])
+    assert bag._executor is executor
+    # Validation uses workers of its own and leaves the shared ones alone,
+    # e.g. for a capture that is running at the same time
+    bag.validate()
+    assert bag._executor is executor
+    bag.update_payload()
+    assert bag._executor is executor
+    bag.add_payload(*make_files(tmpdir.mkdir('more'), 2))
+    bag.shutdown_executors()
+    assert bag._executor is None
+    bag.validate()
+    assert bag._executor is None
+
+
+def test_process_pool_is_not_kept(bag, tmpdir, monkeypatch):
+    monkeypatch.setattr(bagit, 'PROCESS_POOL_THRESHOLD', 3)
+    bag.add_payload(*make_files(tmpdir, 3))
+    assert bag._executor is None
+    bag.validate()
+
+
+@pytest.mark.parametrize('buffer_size,mmap_threshold', [
+    (7, 0), (1024**2, 0), (7, 1), (1024**2, 1)])
+def test_hash_file(tmpdir, buffer_size, mmap_threshold):
+    data = b'0123456789'*100
+    fpath = tmpdir.join('file.bin')
+    fpath.write_binary(data)
+    _, checksums, size = bagit.hash_file(str(fpath), ['md5', 'blake2b-128'],
+                                         buffer_size, mmap_threshold)
+    assert size == len(data)
+    assert checksums['md5'] == hashlib.md5(data).hexdigest()
+    assert checksums['blake2b-128'] == (
+        hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+def test_archive_layout(bag, tmpdir):
+    bag.add_payload(*make_files(tmpdir, 3))
+    # Names that exceed the limits of the ustar format
+    long_dir = tmpdir.join('d' * 99)
+    long_dir.join('p' * 120 + '.jpg').write_binary(b'long', ensure=True)
+    bag.add_payload(str(long_dir))
+    layout = bag.get_archive_layout()
+    fp = io.BytesIO()
+    bag.package_as_tarstream(fp)
+    assert len(fp.getvalue()) == layout.tar_size
+    fp.seek(0)
+    with tarfile.open(fileobj=fp) as tf:
+        assert [m.offset for m in tf] == layout.tar_offsets
+        assert tf.getnames() == [name for name, _, _ in layout.entries]
+    # Like zipstream, zipfile writes data descriptors to unseekable streams
+    zip_fp = UnseekableIO()
+    with zipfile.ZipFile(zip_fp, 'w') as zf:
+        bagit.BagPackager(bag)._write_bag_to_zipfile(zf)
+    zip_data = bytes(zip_fp.data)
+    assert len(zip_data) == layout.zip_size
+    with zipfile.ZipFile(io.BytesIO(zip_data)) as zf:
+        assert ([i.header_offset for i in zf.infolist()] ==
+                [layout.zip_offsets[i.filename] for i in zf.infolist()])
+    assert bag.get_archive_layout() is layout
+    # Files the bag does not know about are checked on every call
+    tmpdir.join('bag', 'journal').write('entry')
+    assert bag.get_archive_layout() is not layout
+    layout = bag.get_archive_layout()
+    tmpdir.join('bag', 'journal').write('entry', mode='a')
+    assert bag.get_archive_layout() is not layout
+    layout = bag.get_archive_layout()
+    bag.add_payload(*make_files(tmpdir, 1))
+    assert bag.get_archive_layout() is not layout
+    layout = bag.get_archive_layout()
+    bag.info['foo'] = 'bar'
+    assert bag.get_archive_layout() is not layout
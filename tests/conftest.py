@@ -1,6 +1,5 @@
 import logging
 import os.path
-import shutil
 import time
 from itertools import chain
 from random import randint
@@ -125,7 +124,11 @@ class TestDriver(plugin.DeviceDriver):
         srcpath = os.path.abspath(
             './tests/data/{0}.jpg'.format(self.target_page or 'even')
         )
-        shutil.copyfile(srcpath, str(path))
+        with open(srcpath, 'rb') as fp:
+            data = fp.read()
+        with path.open('wb') as fp:
+            fp.write(data)
+        return data
 
     def finish_capture(self):
         pass
@@ -2,6 +2,7 @@ import json
 import os
 import random
 import re
+import threading
 import time
 
 import jpegtran
@@ -13,8 +14,9 @@ from conftest import TestPluginOutput, TestPluginProcess, TestPluginProcessB
 
 @pytest.yield_fixture
 def app(config, tmpdir):
-    from spreadsplug.web.app import WebApplication, app
+    from spreadsplug.web.app import WebApplication, WebCommands, app
     config.load_defaults(overwrite=False)
+    config.set_from_template('web', WebCommands.configuration_template())
 
     config['web']['mode'] = 'full'
     config['web']['project_dir'] = str(tmpdir.join('workflows'))
@@ -178,16 +180,452 @@ def test_submit_workflow(requests, app, tmpdir):
     wfid = create_workflow(client)
     with mock.patch('spreadsplug.web.app.task_queue') as mock_tq:
         mock_tq.task.return_value = lambda x: x
-        requests.post.return_value.json.return_value = {'id': 1}
+        requests.post.return_value.json.return_value = {'id': 1,
+                                                        'missing': {}}
         client.post('/api/workflow/{0}/submit'.format(wfid),
                     content_type="application/json",
                     data=json.dumps({'config': {'plugins': []},
                                      'server': '127.0.0.1:5000'}))
-    assert requests.post.call_count == 1
+    # Start and commit of the transfer, nothing is missing on the server
+    assert requests.post.call_count == 2
     # TODO: Iterate through data, assert events are emitted
     # TODO: Assert completed are emitted
 
 
+def test_get_page_listing():
+    from pathlib import Path
+    from spreads.workflow import Page
+    from spreadsplug.web.util import get_page_listing
+    pages = [Page(Path('{0:03}.jpg'.format(num)), revision=num)
+             for num in range(1, 6)]
+    workflow = mock.Mock(pages=pages, page_revision=5)
+    workflow.get_page_changes.return_value = (pages[3:], [7])
+    assert get_page_listing(workflow) is pages
+    listing = get_page_listing(workflow, '1', '2', 'page_label')
+    assert listing['total'] == 5
+    assert listing['pages'] == [{'capture_num': 2, 'page_label': '2'},
+                                {'capture_num': 3, 'page_label': '3'}]
+    listing = get_page_listing(workflow, since='3')
+    workflow.get_page_changes.assert_called_with(3)
+    assert listing['pages'] == pages[3:]
+    assert listing['removed'] == [7]
+    with pytest.raises(ValueError):
+        get_page_listing(workflow, fields='foo')
+
+
+def test_zipstream_extractor(tmpdir):
+    import io
+    import zipfile
+    import spreads.vendor.bagit as bagit
+    from spreadsplug.web.util import ZipStreamExtractor, ZipStreamError
+
+    class UnseekableIO(io.RawIOBase):
+        # Makes zipfile write data descriptors, like zipstream does
+        def __init__(self):
+            self.data = bytearray()
+
+        def writable(self):
+            return True
+
+        def write(self, data):
+            self.data.extend(data)
+            return len(data)
+
+    bag_path = tmpdir.join('src', 'book')
+    bag_path.ensure(dir=True)
+    bag = bagit.Bag(str(bag_path))
+    bag_path.join('data', 'raw', '000.jpg').write_binary(
+        os.urandom(1024) + b'PK\x07\x08' + os.urandom(1024), ensure=True)
+    bag.add_payload(str(bag_path.join('data')))
+
+    def make_zip(tamper=False):
+        fp = UnseekableIO()
+        with zipfile.ZipFile(fp, 'w') as zf:
+            for fpath in bagit.iterdir(str(bag_path)):
+                if bagit._is_hash_cache(os.path.basename(fpath)):
+                    continue
+                with open(fpath, 'rb') as data_fp:
+                    data = data_fp.read()
+                if tamper and fpath.endswith('manifest-md5.txt'):
+                    data = b'0' + data[1:]
+                zf.writestr(os.path.relpath(fpath, str(tmpdir.join('src'))),
+                            data)
+        return bytes(fp.data)
+
+    data = make_zip()
+    extractor = ZipStreamExtractor(str(tmpdir.join('dst')))
+    for idx in range(0, len(data), 100):
+        finished = extractor.feed(data[idx:idx+100])
+    assert finished
+    assert extractor.bag_name == 'book'
+    assert (tmpdir.join('dst', 'book', 'data', 'raw', '000.jpg').read_binary()
+            == bag_path.join('data', 'raw', '000.jpg').read_binary())
+    assert 'md5' in extractor.checksums[os.path.join('data', 'raw',
+                                                     '000.jpg')]
+
+    extractor = ZipStreamExtractor(str(tmpdir.join('dst2')))
+    with pytest.raises(ZipStreamError):
+        extractor.feed(make_zip(tamper=True))
+    with pytest.raises(ZipStreamError):
+        ZipStreamExtractor(str(tmpdir.join('dst3'))).feed(b'foobar')
+
+
+def test_upload_cleanup_waits_for_extractor(tmpdir):
+    import asyncio
+    from spreadsplug.web.handlers import StreamingUploadHandler
+
+    loop = asyncio.new_event_loop()
+    handler = StreamingUploadHandler.__new__(StreamingUploadHandler)
+    handler.initialize(str(tmpdir))
+    handler.request = mock.Mock()
+    handler.prepare()
+    handler.extractor = mock.Mock()
+    # The connection is closed while a chunk is being extracted
+    handler.pending = loop.create_future()
+    handler.on_connection_close()
+    assert os.path.exists(handler.staging_path)
+    assert not handler.extractor.close.called
+    handler.pending.set_result(False)
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    assert not os.path.exists(handler.staging_path)
+    assert handler.extractor.close.called
+    # Data that is still on its way is ignored
+    handler.data_received(b'foo')
+    assert not handler.extractor.feed.called
+
+
+def test_get_sync_manifest(tmpdir):
+    import hashlib
+    from pathlib import Path
+    import spreads.vendor.bagit as bagit
+    from spreadsplug.web.tasks import get_sync_manifest
+    bag = bagit.Bag(str(tmpdir.join('book')), checksums=['sha256'])
+    workflow = mock.Mock(bag=bag, path=Path(bag.path))
+    tmpdir.join('000.jpg').write_binary(b'page')
+    bag.add_payload(str(tmpdir.join('000.jpg')))
+    files = get_sync_manifest(workflow)
+    with open(bag._get_path('bagit.txt'), 'rb') as fp:
+        assert files['bagit.txt'] == {
+            'checksum': hashlib.sha256(fp.read()).hexdigest(),
+            'size': os.path.getsize(bag._get_path('bagit.txt'))}
+    assert files['data/000.jpg'] == {
+        'checksum': hashlib.sha256(b'page').hexdigest(), 'size': 4}
+
+    # Files that were not modified since their manifest was written are not
+    # read again, even with an empty hash cache
+    bag.hash_cache = bagit.HashCache(str(tmpdir.join('empty.db')))
+
+    def hashed():
+        return set(os.path.basename(c[0][0])
+                   for c in hash_file.call_args_list)
+    with mock.patch.object(bagit, 'hash_file',
+                           side_effect=bagit.hash_file) as hash_file:
+        assert get_sync_manifest(workflow) == files
+        assert not hashed() & {'000.jpg', 'bag-info.txt'}
+        hash_file.reset_mock()
+        tmpdir.join('book', 'data', '000.jpg').write_binary(b'changed')
+        changed = get_sync_manifest(workflow)
+    assert '000.jpg' in hashed()
+    assert changed['data/000.jpg']['checksum'] == hashlib.sha256(
+        b'changed').hexdigest()
+
+
+def test_sync_session(tmpdir):
+    import hashlib
+    import uuid
+    from pathlib import Path
+    from spreadsplug.web.util import SyncSession, SyncError
+    wfid = str(uuid.uuid4())
+    contents = {'bagit.txt': b'BagIt-Version: 0.97\n',
+                'bag-info.txt': 'Spreads-Id: {0}\n'.format(wfid).encode(),
+                'data/raw/000.jpg': os.urandom(1024),
+                'data/raw/001.jpg': os.urandom(1024)}
+    files = dict((path, {'checksum': hashlib.md5(data).hexdigest(),
+                         'size': len(data)})
+                 for path, data in contents.items())
+
+    def upload(session, path, offset=0):
+        with session.open_part(path, offset, len(contents[path])) as fp:
+            fp.write(contents[path][offset:offset+512])
+        return session.finish_part(path)
+
+    session = SyncSession(str(tmpdir), wfid)
+    assert session.start('book', files) == dict.fromkeys(files, 0)
+    assert upload(session, 'data/raw/000.jpg') == 512
+    with pytest.raises(SyncError) as excinfo:
+        upload(session, 'data/raw/000.jpg', 0)
+    assert excinfo.value.offset == 512
+    # Resume after an interruption
+    assert session.start('book', files)['data/raw/000.jpg'] == 512
+    assert upload(session, 'data/raw/000.jpg', 512) == 1024
+    with pytest.raises(SyncError):
+        session.commit()
+    upload(session, 'bagit.txt')
+    upload(session, 'bag-info.txt')
+    upload(session, 'data/raw/001.jpg')
+    upload(session, 'data/raw/001.jpg', 512)
+    with mock.patch('spreadsplug.web.util.Workflow') as workflow_cls:
+        workflow_cls.find_by_id.return_value = None
+        _, is_new = session.commit()
+    assert is_new
+    for path, data in contents.items():
+        assert tmpdir.join('book', path).read_binary() == data
+
+    # Only new files are transferred again, removed ones are deleted
+    del files['data/raw/001.jpg']
+    contents['data/raw/002.jpg'] = os.urandom(16)
+    files['data/raw/002.jpg'] = {
+        'checksum': hashlib.md5(contents['data/raw/002.jpg']).hexdigest(),
+        'size': 16}
+    with mock.patch('spreadsplug.web.util.Workflow') as workflow_cls:
+        workflow = workflow_cls.find_by_id.return_value
+        workflow.path = Path(str(tmpdir.join('book')))
+        workflow.bag.get_cached_checksum.return_value = None
+        assert session.start('book', files) == {'data/raw/002.jpg': 0}
+        upload(session, 'data/raw/002.jpg')
+        workflow.status = {'step': 'process'}
+        with pytest.raises(SyncError):
+            session.commit()
+        workflow.status = {'step': None}
+        committed, is_new = session.commit()
+    assert not is_new
+    # The registered instance is reloaded instead of being replaced
+    assert committed is workflow
+    assert workflow.reload.called
+    assert not workflow_cls.called
+    assert tmpdir.join('book', 'data', 'raw', '002.jpg').exists()
+    assert not tmpdir.join('book', 'data', 'raw', '001.jpg').exists()
+
+    # The files of a workflow can not be committed under a different id
+    session = SyncSession(str(tmpdir), str(uuid.uuid4()))
+    session.start('book2', files)
+    for path in files:
+        upload(session, path)
+        if files[path]['size'] > 512:
+            upload(session, path, 512)
+    with mock.patch('spreadsplug.web.util.Workflow') as workflow_cls:
+        workflow_cls.find_by_id.return_value = None
+        with pytest.raises(SyncError):
+            session.commit()
+    assert not tmpdir.join('book2').exists()
+
+
+@pytest.mark.parametrize('algorithm', ['md5', 'blake2b-128'])
+def test_result_archive(tmpdir, algorithm):
+    import io
+    import tarfile
+    from pathlib import Path
+    from spreadsplug.web.util import (get_result_files, iter_result_archive,
+                                      merge_result_archive)
+
+    def make_workflow(name, files):
+        path = Path(str(tmpdir.join(name)))
+        for relpath, data in files.items():
+            tmpdir.join(name, relpath).write_binary(data, ensure=True)
+        workflow = mock.Mock(path=path)
+        workflow.bag.get_cached_checksum.return_value = None
+        workflow.pages = [mock.Mock(capture_num=1, processed_images={}),
+                          mock.Mock(capture_num=2, processed_images={})]
+        return workflow
+
+    remote = make_workflow('remote', {'data/done/001.tif': b'one',
+                                      'data/done/002.tif': b'two',
+                                      'data/out/book.pdf': b'pdf'})
+    remote.pages[0].processed_images = {
+        'scantailor': remote.path/'data'/'done'/'001.tif'}
+    local = make_workflow('local', {'data/done/001.tif': b'one',
+                                    'data/done/003.tif': b'old'})
+    local.pages[1].processed_images = {
+        'scantailor': local.path/'data'/'done'/'003.tif'}
+    local.pages.append(mock.Mock(capture_num=3, processed_images={
+        'scantailor': local.path/'data'/'done'/'003.tif'}))
+
+    archive = b''.join(iter_result_archive(
+        remote, get_result_files(local, algorithm), algorithm))
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        assert tar.getnames() == ['index.json', 'data/done/002.tif',
+                                  'data/out/book.pdf']
+    received, removed = merge_result_archive(local, io.BytesIO(archive))
+    assert sorted(received) == ['data/done/002.tif', 'data/out/book.pdf']
+    assert removed == ['data/done/003.tif']
+    assert (get_result_files(local, algorithm) ==
+            get_result_files(remote, algorithm))
+    assert local.pages[0].processed_images == {
+        'scantailor': local.path/'data'/'done'/'001.tif'}
+    assert local.pages[1].processed_images == {}
+    assert local.pages[2].processed_images == {}
+    assert local.bag.update_payload.call_count == 1
+    assert local._save_pages.call_count == 1
+
+
+def test_serialized_wsgi_app():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from spreadsplug.web.util import SerializedWSGIApp
+    lock = threading.Lock()
+    active = []
+    max_active = {'GET': 0, 'POST': 0}
+
+    def wsgi_app(environ, start_response):
+        method = environ['REQUEST_METHOD']
+        with lock:
+            active.append(method)
+            max_active[method] = max(max_active[method],
+                                     active.count(method))
+        time.sleep(0.05)
+        with lock:
+            active.remove(method)
+        return [b'']
+
+    app = SerializedWSGIApp(wsgi_app)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(
+            lambda method: app({'REQUEST_METHOD': method}, None),
+            ['GET', 'POST']*4))
+    assert max_active == {'GET': 4, 'POST': 1}
+
+
+def test_async_pipe():
+    import threading
+    from tornado import gen
+    from tornado.ioloop import IOLoop
+    from spreadsplug.web.handlers import AsyncPipe, PipeClosedError
+    data = [os.urandom(100) for _ in range(100)]
+    errors = []
+
+    def write(pipe, items):
+        try:
+            for item in items:
+                pipe.write(item)
+        except PipeClosedError as e:
+            errors.append(e)
+        pipe.finish()
+
+    @gen.coroutine
+    def read_all():
+        pipe = AsyncPipe(chunk_size=1024, max_chunks=2)
+        threading.Thread(target=write, args=(pipe, data)).start()
+        chunks = []
+        while True:
+            chunk = yield pipe.read()
+            if chunk is None:
+                break
+            chunks.append(chunk)
+        # Writes are aggregated, except for the remainder
+        assert [len(c) for c in chunks] == [1024]*9 + [784]
+        assert b''.join(chunks) == b''.join(data)
+
+        # The writer gives up once the reader is gone
+        pipe = AsyncPipe(chunk_size=1024, max_chunks=2)
+        thread = threading.Thread(target=write, args=(pipe, data))
+        thread.start()
+        yield pipe.read()
+        pipe.close()
+        thread.join()
+        assert len(errors) == 1
+    IOLoop.current().run_sync(read_all)
+
+
+def test_event_coalescer():
+    from spreads.workflow import on_modified, on_removed
+    from spreadsplug.web import handlers
+    from spreadsplug.web.util import Event
+    from collections import namedtuple
+    # The coalescer must only use the snapshots emitted with the signal
+    workflow = mock.Mock(spec=['id'], id='foo')
+    pages = [namedtuple('Page', ['capture_num'])(num) for num in range(4)]
+
+    def modified(since, revision, changed, removed, **changes):
+        changes.update(page_diff={
+            'since': since, 'revision': revision, 'pages': changed,
+            'removed': removed})
+        return Event(on_modified, workflow, {'changes': changes})
+
+    def diff(event):
+        return event.data['changes']['page_diff']
+
+    coalescer = handlers.EventCoalescer()
+    with mock.patch.multiple(handlers, IOLoop=mock.DEFAULT,
+                             event_buffer=mock.DEFAULT,
+                             WebSocketHandler=mock.DEFAULT) as mocks:
+        coalescer.add(modified(0, 1, pages[:1], [], status=1))
+        coalescer.add(Event(on_removed, None, {'senderId': 'bar'}))
+        coalescer.add(modified(1, 2, pages[1:2], []))
+        assert mocks['IOLoop'].current.return_value.call_later.call_count == 1
+        coalescer.flush()
+        events = mocks['event_buffer'].new_events.call_args[0][0]
+        assert [e.signal for e in events] == [on_removed, on_modified]
+        # Consecutive diffs are combined
+        assert events[1].data['changes'] == {
+            'status': 1, 'page_diff': {'since': 0, 'revision': 2,
+                                       'pages': pages[:2], 'removed': []}}
+        assert mocks['WebSocketHandler'].broadcast.call_count == 2
+
+        coalescer.add(modified(2, 3, pages[2:3], []))
+        coalescer.add(modified(3, 4, pages[3:4], [0]))
+        coalescer.flush()
+        event = mocks['event_buffer'].new_events.call_args[0][0][0]
+        assert diff(event) == {
+            'since': 2, 'revision': 4, 'pages': pages[2:4], 'removed': [0]}
+
+        # A diff of all pages stays complete
+        coalescer.add(modified(4, 5, pages[1:4], None))
+        coalescer.add(modified(5, 6, pages[3:4], [1]))
+        coalescer.flush()
+        event = mocks['event_buffer'].new_events.call_args[0][0][0]
+        assert diff(event) == {
+            'since': 4, 'revision': 6, 'pages': [pages[2], pages[3]],
+            'removed': None}
+
+        # Diffs with a gap are not combined, clients fetch what they missed
+        coalescer.add(modified(6, 7, pages[:1], []))
+        coalescer.add(modified(8, 9, [], [3]))
+        coalescer.flush()
+        event = mocks['event_buffer'].new_events.call_args[0][0][0]
+        assert diff(event) == {
+            'since': 8, 'revision': 9, 'pages': [], 'removed': [3]}
+
+
+def test_event_buffer():
+    from spreads.workflow import on_removed
+    from spreadsplug.web.handlers import EventBuffer, on_resync
+    from spreadsplug.web.util import Event
+    buf = EventBuffer(size=5)
+    received = []
+    buf.wait_for_events(received.extend)
+    buf.new_events([Event(on_removed, None, {}) for _ in range(3)])
+    assert [e.id for e in received] == [0, 1, 2]
+    buf.new_events([Event(on_removed, None, {}) for _ in range(4)])
+    assert [e.id for e in buf.get_events_since(3)] == [4, 5, 6]
+    assert buf.get_events_since(6) == []
+    assert [e.id for e in buf.get_events_since(1)] == [2, 3, 4, 5, 6]
+    assert buf.get_events_since(0) is None
+    assert buf.get_events_since(7) is None
+    received = []
+    buf.wait_for_events(received.extend, cursor=0)
+    assert [(e.signal, e.id) for e in received] == [(on_resync, 6)]
+
+
+def test_websocket_queue():
+    from spreadsplug.web.handlers import WebSocketHandler
+    handler = WebSocketHandler.__new__(WebSocketHandler)
+    handler.request = mock.Mock(remote_ip='127.0.0.1')
+    handler.open()
+    # Simulate a client that has not read the previous message yet
+    handler.sending = True
+    try:
+        for idx in range(handler.max_queue_size):
+            handler.send_queued(str(idx))
+        assert len(handler.queue) == handler.max_queue_size
+        handler.send_queued('overflow')
+        assert len(handler.queue) == 1
+        assert json.loads(handler.queue[0])['name'] == 'events:resync'
+    finally:
+        handler.on_close()
+
+
 def test_get_page_image(client):
     wfid = create_workflow(client)
     with open(os.path.abspath('./tests/data/even.jpg'), 'rb') as fp:
@@ -196,12 +634,68 @@ def test_get_page_image(client):
     assert orig == fromapi
 
 
+def test_get_page_image_conditional(client):
+    wfid = create_workflow(client)
+    for url in ('/api/workflow/{0}/page/0/raw',
+                '/api/workflow/{0}/page/0/raw/thumb',
+                '/api/workflow/{0}/page'):
+        rv = client.get(url.format(wfid))
+        assert rv.status_code == 200
+        assert rv.headers['ETag']
+        rv = client.get(url.format(wfid),
+                        headers={'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 304
+        assert not rv.data
+
+
+def test_get_all_pages_conditional(client):
+    wfid = create_workflow(client, num_captures=2)
+    url = '/api/workflow/{0}/page'.format(wfid)
+    etag = client.get(url).headers['ETag']
+    assert client.get(url + '?since=0').headers['ETag'] != etag
+    with mock.patch('spreadsplug.web.endpoints.get_page_listing') as listing:
+        rv = client.get(url, headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    # The listing is not built for clients that are up to date
+    assert not listing.called
+    client.delete(url, data=json.dumps({'pages': [{'capture_num': 0}]}))
+    rv = client.get(url, headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+
+
 def test_get_page_image_scaled(client):
     wfid = create_workflow(client)
     rv = client.get('/api/workflow/{0}/page/0/raw?width=300'.format(wfid))
     assert rv.status_code == 200
     img = jpegtran.JPEGImage(blob=rv.data)
-    assert img.width == 300
+    # Widths are rounded up to a multiple of ImageCache.WIDTH_STEP
+    assert img.width == 320
+
+
+def test_get_page_image_scaled_and_converted(client):
+    wfid = create_workflow(client)
+    rv = client.get('/api/workflow/{0}/page/0/raw?width=300&format=png'
+                    .format(wfid))
+    assert rv.status_code == 200
+    assert rv.mimetype == 'image/png'
+
+
+def test_parse_transform_args():
+    from pathlib import Path
+    from spreadsplug.web.util import parse_transform_args
+    tif_path, jpg_path = Path('/tmp/0001.tif'), Path('/tmp/0001.jpeg')
+    assert parse_transform_args(tif_path) == (None, None, None)
+    assert parse_transform_args(tif_path, '300') == (300, 'jpg', None)
+    assert parse_transform_args(tif_path, '300', 'browser', '80') == (
+        300, 'png', 80)
+    assert parse_transform_args(jpg_path, None, 'browser') == (
+        None, 'jpg', None)
+    for args in (('abc',), ('300', 'png', '101'), (None, '../png')):
+        with pytest.raises(ValueError):
+            parse_transform_args(tif_path, *args)
+    with pytest.raises(ValueError):
+        parse_transform_args(Path('/tmp/0001.dng'), '300')
 
 
 def test_get_page_image_thumb(client):
@@ -212,6 +706,133 @@ def test_get_page_image_thumb(client):
     assert jpegtran.JPEGImage(blob=rv.data).width == 196
 
 
+def test_image_cache_thumbnails(tmpdir):
+    from pathlib import Path
+    from spreadsplug.web.util import ImageCache, ImageProcessor
+    workflow = mock.Mock(id='wfid', path=Path(str(tmpdir.join('wf'))))
+    processor = ImageProcessor(use_processes=False)
+    img_paths = []
+    for idx in range(3):
+        img_path = tmpdir.join('wf', 'raw', '{0:03}.jpg'.format(idx))
+        img_path.write_binary(b'image', ensure=True)
+        img_paths.append(Path(str(img_path)))
+    cache_path = tmpdir.join('thumbs')
+    with mock.patch('spreadsplug.web.util.get_thumbnail',
+                    return_value=b'x'*100) as get_thumbnail:
+        cache = ImageCache(Path(str(cache_path)), max_size=250,
+                           processor=processor)
+        cache.get_thumbnail(workflow, img_paths[0])
+        cache.get_thumbnail(workflow, img_paths[1])
+        cache.get_thumbnail(workflow, img_paths[0])
+        assert get_thumbnail.call_count == 2
+        # Least recently used thumbnail is evicted
+        cache.get_thumbnail(workflow, img_paths[2])
+        assert len(cache_path.join('wfid').listdir()) == 2
+        cache = ImageCache(Path(str(cache_path)), max_size=250,
+                           processor=processor)
+        cache.get_thumbnail(workflow, img_paths[0])
+        cache.get_thumbnail(workflow, img_paths[2])
+        assert get_thumbnail.call_count == 3
+        # Modified images get a new thumbnail
+        time.sleep(0.01)
+        tmpdir.join('wf', 'raw', '000.jpg').write_binary(b'cropped')
+        cache.get_thumbnail(workflow, img_paths[0])
+        assert get_thumbnail.call_count == 4
+        cache.remove_workflow('wfid')
+        assert not cache_path.join('wfid').check()
+        # Thumbnails that are evicted right away are still returned
+        cache = ImageCache(Path(str(cache_path)), max_size=50,
+                           processor=processor)
+        assert cache.get_thumbnail(workflow, img_paths[1]) == b'x'*100
+        assert not cache_path.join('wfid').listdir()
+
+
+def test_image_cache_pyramid(tmpdir):
+    from pathlib import Path
+    from spreadsplug.web.util import ImageCache, ImageProcessor
+    workflow = mock.Mock(id='wfid', path=Path(str(tmpdir.join('wf'))))
+    img_path = tmpdir.join('wf', 'raw', '000.jpg')
+    img_path.write_binary(b'image', ensure=True)
+    img_path = Path(str(img_path))
+    cache = ImageCache(Path(str(tmpdir.join('images'))), max_size=1024**2,
+                       processor=ImageProcessor(use_processes=False))
+    with mock.patch('spreadsplug.web.util.scale_image',
+                    side_effect=lambda path, width: str(width).encode()) \
+            as scale_image:
+        scaled_path = cache.get_scaled(workflow, img_path, 300)
+        # Widths are rounded up to bound the number of versions
+        assert scaled_path.read_bytes() == b'320'
+        # Every level is generated from the next larger one
+        sources = [(c[0][0], c[1]['width'])
+                   for c in scale_image.call_args_list]
+        assert sources == [
+            (img_path, 1200),
+            (cache.get_scaled(workflow, img_path, 1200), 480),
+            (cache.get_scaled(workflow, img_path, 480), 320)]
+        assert cache.get_scaled(workflow, img_path, 310) == scaled_path
+        assert scale_image.call_count == 3
+        assert cache.get_scaled(workflow, img_path, 10**6).read_bytes() == (
+            str(cache.MAX_WIDTH).encode())
+
+        # Levels that were evicted before they were read are generated again
+        level_path = cache.get_scaled(workflow, img_path, 480)
+        real_scale = scale_image.side_effect
+        evicted = []
+
+        def evict_level(path, width):
+            if path == level_path and not evicted:
+                evicted.append(path)
+                level_path.unlink()
+                raise IOError("No such file")
+            return real_scale(path, width)
+        scale_image.side_effect = evict_level
+        assert cache.get_scaled(workflow, img_path, 400).read_bytes() == b'400'
+        assert scale_image.call_args_list[-2:] == [
+            mock.call(cache.get_scaled(workflow, img_path, 1200), width=480),
+            mock.call(level_path, width=400)]
+
+
+def test_image_processor():
+    from spreadsplug.web.util import ImageProcessor, ImageProcessorBusy
+    processor = ImageProcessor(num_workers=1, max_pending=2,
+                               use_processes=False)
+    event = threading.Event()
+    first = processor.submit('a', event.wait)
+    # Requests for a pending transform share its job
+    assert processor.submit('a', event.wait) is first
+    second = processor.submit('b', event.wait, callback=lambda res: 'done')
+    with pytest.raises(ImageProcessorBusy):
+        processor.submit('c', event.wait)
+    assert processor.get_stats()['pending'] == 2
+    event.set()
+    assert first.result() is True
+    assert second.result() == 'done'
+    stats = processor.get_stats()
+    assert (stats['submitted'], stats['coalesced'], stats['rejected'],
+            stats['completed'], stats['pending']) == (2, 1, 1, 2, 0)
+    processor.shutdown()
+
+
+def test_get_page_image_busy(app, client):
+    from spreadsplug.web.util import ImageProcessorBusy
+    wfid = create_workflow(client)
+    with mock.patch.object(app.config['image_cache'], 'get_transformed',
+                           side_effect=ImageProcessorBusy("Too many jobs")):
+        rv = client.get('/api/workflow/{0}/page/0/raw?width=300'
+                        .format(wfid))
+    assert rv.status_code == 503
+    assert rv.headers['Retry-After'] == '1'
+    assert json.loads(rv.data)['type'] == 'busy'
+
+
+def test_get_stats(client):
+    wfid = create_workflow(client)
+    client.get('/api/workflow/{0}/page/0/raw?width=300'.format(wfid))
+    stats = json.loads(client.get('/api/stats').data)['image_processor']
+    assert stats['submitted'] >= 1
+    assert stats['pending'] == 0
+
+
 def test_prepare_capture(client):
     wfid = create_workflow(client, num_captures=None)
     rv = client.post('/api/workflow/{0}/prepare_capture'.format(wfid))
@@ -1,5 +1,9 @@
+import concurrent.futures as concfut
+
 import pytest
+from pathlib import Path
 import spreads.vendor.bagit as bagit
+import mock
 from mock import Mock
 
 import spreads.util as util
@@ -29,6 +33,56 @@ def test_convert_old_workflow(config, tmpdir):
         assert tmpdir.join('data', 'raw', '{0:03}.jpg'.format(num)).check()
 
 
+def test_find_workflows(config, tmpdir):
+    location = tmpdir.join('workflows')
+    location.mkdir()
+    wf = spreads.workflow.Workflow.create(str(location), {'title': 'foo'},
+                                          config)
+    find_all = spreads.workflow.Workflow.find_all
+    assert find_all(str(location)) == {'foo': wf}
+    assert spreads.workflow.Workflow.find_by_id(str(location), wf.id) is wf
+    registry = spreads.workflow.Workflow._cache[Path(str(location))]
+    with mock.patch.object(registry, '_scan') as scan:
+        assert spreads.workflow.Workflow.find_by_slug(
+            str(location), 'foo') is wf
+        assert not scan.called
+    # Workflows that appear or disappear externally are picked up, too
+    other = spreads.workflow.Workflow.create(str(tmpdir), {'title': 'bar'},
+                                             config)
+    other.path.rename(location.join('bar'))
+    assert set(find_all(str(location))) == {'foo', 'bar'}
+    # Staging directories of uploads and syncs are ignored, even if they
+    # contain a complete bag
+    location.join('bar').copy(location.join('.sync-1234'))
+    location.join('foo').remove()
+    with mock.patch.object(wf.bag, 'shutdown_executors') as shutdown:
+        assert set(find_all(str(location), key='id')) == {other.id}
+    assert ([p.name for p in registry._by_path] == ['bar'] and
+            not registry._pending)
+    # Evicted workflows release their hashing workers
+    assert shutdown.called
+    assert spreads.workflow.Workflow.find_by_id(str(location), wf.id) is None
+
+
+def test_lazy_loading(workflow):
+    workflow.prepare_capture()
+    workflow.capture()
+    workflow.finish_capture()
+    # The second capture is only recorded in the page journal
+    workflow.prepare_capture()
+    workflow.capture()
+    lazy = spreads.workflow.Workflow(workflow.path)
+    assert lazy._bag is None
+    assert lazy._plugin_instances is None
+    assert lazy._pages is None
+    assert (lazy.id, lazy.slug) == (workflow.id, workflow.slug)
+    assert lazy.page_count == 4
+    assert lazy._pages is None
+    assert len(lazy.pages) == 4
+    assert lazy._plugins
+    assert lazy.bag.payload == workflow.bag.payload
+
+
 def test_get_plugins(workflow):
     plugins = workflow._plugins
     names = [x.__name__ for x in plugins]
@@ -106,6 +160,93 @@ def test_capture_noparallel(workflow):
     workflow.finish_capture()
 
 
+def test_capture_hashes_from_memory(workflow):
+    workflow.prepare_capture()
+    with mock.patch('spreads.vendor.bagit.hash_file',
+                    wraps=bagit.hash_file) as hash_file:
+        workflow.capture()
+        workflow.finish_capture()
+    hashed = [call[0][0] for call in hash_file.call_args_list]
+    assert not any('data' in fpath for fpath in hashed)
+    manifest = workflow.bag.manifest_files['md5']
+    for page in workflow.pages:
+        assert str(page.raw_image.relative_to(workflow.path)) in manifest
+    workflow.bag.validate()
+
+
+def test_reload(workflow, config):
+    workflow.prepare_capture()
+    workflow.capture()
+    workflow.finish_capture()
+    other = spreads.workflow.Workflow(config=config, path=workflow.path)
+    other.remove_pages(other.pages[0])
+    assert len(workflow.pages) == 2
+    workflow.reload()
+    assert len(workflow.pages) == 1
+    assert workflow.bag.payload == other.bag.payload
+
+
+def test_capture_appends_to_page_journal(workflow, config):
+    workflow.prepare_capture()
+    workflow.capture()
+    workflow.capture()
+    journal = workflow.path/spreads.workflow.PAGE_JOURNAL_FNAME
+    assert not (workflow.path/'pagemeta.json').exists()
+    assert len(journal.read_text().splitlines()) == 4
+    reloaded = spreads.workflow.Workflow(config=config, path=workflow.path)
+    assert ([p.capture_num for p in reloaded.pages] ==
+            [p.capture_num for p in workflow.pages])
+    workflow.finish_capture()
+    assert not journal.exists()
+    reloaded = spreads.workflow.Workflow(config=config, path=workflow.path)
+    assert len(reloaded.pages) == 4
+
+
+def test_load_pages_after_interrupted_merge(workflow, config):
+    workflow.prepare_capture()
+    workflow.capture()
+    workflow.capture()
+    journal = workflow.path/spreads.workflow.PAGE_JOURNAL_FNAME
+    journal_data = journal.read_bytes()
+    workflow.pages[0].page_label = 'iv'
+    workflow.finish_capture()
+    # Simulate a crash after pagemeta.json was written, but before the
+    # journal was removed
+    journal.write_bytes(journal_data)
+    reloaded = spreads.workflow.Workflow(config=config, path=workflow.path)
+    assert reloaded.page_count == len(workflow.pages)
+    assert ([p.capture_num for p in reloaded.pages] ==
+            [p.capture_num for p in workflow.pages])
+    assert reloaded.pages[0].page_label == 'iv'
+
+
+def test_load_pages_after_interrupted_merge_with_removal(workflow, config):
+    workflow.prepare_capture()
+    workflow.capture()
+    workflow.capture()
+    journal = workflow.path/spreads.workflow.PAGE_JOURNAL_FNAME
+    journal_data = journal.read_bytes()
+    removed = workflow.pages[-1]
+    workflow.remove_pages(removed)
+    # Captured images are recorded in the bag in the background
+    concfut.wait(workflow._pending_tasks)
+    # Simulate a crash after pagemeta.json was written, but before the
+    # journal was removed
+    journal.write_bytes(journal_data)
+    reloaded = spreads.workflow.Workflow(config=config, path=workflow.path)
+    assert reloaded.page_count == 3
+    assert ([p.capture_num for p in reloaded.pages] ==
+            [p.capture_num for p in workflow.pages])
+    assert reloaded.page_revision == workflow.page_revision
+    # Pages captured afterwards are not mistaken for merged ones
+    reloaded.prepare_capture()
+    reloaded.capture()
+    concfut.wait(reloaded._pending_tasks)
+    reloaded = spreads.workflow.Workflow(config=config, path=workflow.path)
+    assert reloaded.page_count == 5
+    assert len(reloaded.pages) == 5
+
+
 def test_capture_flip_target_pages(workflow):
     workflow.config['device']['parallel_capture'] = False
     workflow.config['device']['flip_target_pages'] = True
@@ -129,3 +270,106 @@ def test_process(workflow):
 def test_output(workflow):
     workflow.output()
     # TODO: Verify
+
+
+def test_remove_pages(workflow, config):
+    workflow.prepare_capture()
+    for _ in range(4):
+        workflow.capture()
+    workflow.finish_capture()
+    pages = list(workflow.pages)
+    for page, label in zip(pages, ('i', 'ii', 'iii', '1', '2', '3', '4', '5')):
+        page.page_label = label
+    workflow.table_of_contents = [
+        spreads.workflow.TocEntry('Front', pages[0], pages[2], []),
+        spreads.workflow.TocEntry('Chapter 1', pages[3], pages[5], []),
+        spreads.workflow.TocEntry('Chapter 2', pages[6], pages[7], [])]
+    workflow.remove_pages(pages[1], pages[3], pages[4], pages[5])
+    assert workflow.pages == [pages[0], pages[2], pages[6], pages[7]]
+    assert [p.sequence_num for p in workflow.pages] == [0, 1, 2, 3]
+    assert [p.page_label for p in workflow.pages] == ['i', 'ii', '1', '2']
+    toc = workflow.table_of_contents
+    assert [(e.start_page, e.end_page) for e in toc] == [
+        (pages[0], pages[2]), (pages[6], pages[7])]
+    for page in (pages[1], pages[3]):
+        assert not page.raw_image.exists()
+    assert len(workflow.bag.payload) == 4
+    workflow.bag.validate()
+    reloaded = spreads.workflow.Workflow(config=config, path=workflow.path)
+    assert ([p.capture_num for p in reloaded.pages] ==
+            [p.capture_num for p in workflow.pages])
+    assert len(reloaded.table_of_contents) == 2
+
+
+def test_remove_pages_empty_labels(workflow):
+    workflow.prepare_capture()
+    workflow.capture()
+    workflow.capture()
+    workflow.finish_capture()
+    pages = list(workflow.pages)
+    for page, label in zip(pages, ('1', '', '', '2')):
+        page.page_label = label
+    workflow.remove_pages(pages[1])
+    assert [p.page_label for p in workflow.pages] == ['1', '', '2']
+
+
+def test_page_revisions(workflow, config):
+    workflow.prepare_capture()
+    workflow.capture()
+    workflow.capture()
+    workflow.finish_capture()
+    revision = workflow.page_revision
+    assert [p.revision for p in workflow.pages] == [1, 1, 2, 2]
+    assert workflow.get_page_changes(revision) == ([], [])
+    workflow.pages[0].page_label = 'i'
+    emitted = []
+
+    def on_modified(sender, changes):
+        emitted.append(changes)
+    spreads.workflow.on_modified.connect(on_modified, sender=workflow)
+    # Renumbers the following pages
+    workflow.remove_pages(workflow.pages[1])
+    spreads.workflow.on_modified.disconnect(on_modified, sender=workflow)
+    changed, removed = workflow.get_page_changes(revision)
+    assert [p.capture_num for p in changed] == [0, 2, 3]
+    assert removed == [1]
+    assert workflow.page_revision == revision + 1
+    # Only the changes are emitted, not all pages
+    page_changes = [c for c in emitted if 'page_diff' in c][-1]
+    assert 'pages' not in page_changes
+    assert page_changes['page_diff'] == {
+        'since': revision, 'revision': revision + 1, 'pages': changed,
+        'removed': removed}
+    # Unchanged pages don't get a new revision
+    workflow._save_pages()
+    assert workflow.page_revision == revision + 1
+    # Removals before the workflow was loaded are unknown
+    reloaded = spreads.workflow.Workflow(config=config, path=workflow.path)
+    assert reloaded.page_revision == workflow.page_revision
+    changed, removed = reloaded.get_page_changes(revision)
+    assert len(changed) == 3
+    assert removed is None
+    assert reloaded.get_page_changes(reloaded.page_revision) == ([], [])
+
+
+def test_page_list_lookup():
+    pages = spreads.workflow.PageList(
+        spreads.workflow.Page(Path('{0:03}.jpg'.format(num)))
+        for num in range(5))
+    assert pages.get_by_capture_num(3) is pages[3]
+    assert pages.get_by_sequence_num(7) is None
+    assert pages.index(pages[2]) == 2
+    new_page = spreads.workflow.Page(Path('005.jpg'))
+    pages.append(new_page)
+    assert pages.get_by_capture_num(5) is new_page
+    assert pages.index(new_page) == 5
+    removed = pages.pop(0)
+    assert pages.get_by_capture_num(0) is None
+    assert pages.index(new_page) == 4
+    with pytest.raises(ValueError):
+        pages.index(removed)
+    # Renumbering pages must not leave stale index entries behind
+    for idx, page in enumerate(pages):
+        page.sequence_num = idx
+    assert pages.get_by_sequence_num(0) is pages[0]
+    assert pages.get_by_sequence_num(4) is new_page